@@ -30,6 +30,9 @@ from selenium.webdriver.chrome.options import Options
 import time
 import os
 from dotenv import load_dotenv
+from export_cache import load_export
+from dtype_registry import apply_dtypes
+from time_buckets import time_buckets, month_labels
 import openpyxl
 from openpyxl.utils import get_column_letter
 
@@ -37,35 +40,74 @@ from openpyxl.utils import get_column_letter
 start_date = pd.to_datetime('2025-08-25')
 end_date = pd.to_datetime('2025-08-31')  # Fixed to today's date
 today_date = datetime.today().date().strftime('%Y-%m-%d')
-mois_ordre = ['January', 'February', 'March', 'April', 'May', 'June', 'July', 'August', 'September', 'October', 'November', 'December']
+mois_ordre = month_labels('fr')
 
 def transform_to_month_year_french(df, date_column):
     if date_column not in df.columns:
         raise ValueError(f"La colonne '{date_column}' n'existe pas dans le DataFrame.")
     df[date_column] = pd.to_datetime(df[date_column])
-    df['mois'] = df[date_column].dt.strftime('%B').str.capitalize()
-    df['annee'] = df[date_column].dt.strftime('%Y').str.capitalize()
+    # Mois en français (catégorie ordonnée) et année entière, en une passe vectorisée
+    buckets = time_buckets(df[date_column], lang='fr')
+    df['mois'] = buckets['mois']
+    df['annee'] = buckets['year']
     return df
 
-def create_pivot_table(df, oev_patient_code):
-    # Création du tableau croisé dynamique (pivot table)
-    pivot_table = pd.pivot_table(
-        df,
-        values=oev_patient_code,
-        index=['mois'],
-        columns=['commune', 'Trouvé'],
-        aggfunc=lambda x: len(x),
-        margins=True,
-        margins_name='Total'
-    ).fillna(0)
-
-    mois_ordre = ['January', 'February', 'March', 'April', 'May', 'June', 'July', 'August', 'September', 'October', 'November', 'December']
+# Dimensions du cube des performances
+cube_dimensions = ['mois', 'commune', 'Trouvé', 'Programme', 'Type']
+
+def build_performance_cube(df, value_columns=('patient_code', 'formid')):
+    """
+    Compte les formulaires pour chaque combinaison (mois, commune, Trouvé, Programme, Type)
+    en un seul groupby vectorisé. Les valeurs manquantes restent des clés (dropna=False),
+    et une dimension par colonne de value_columns indique si elle est remplie : comme dans
+    pivot_table, la colonne 'Total' ne compte que les lignes où la valeur comptée existe.
+
+    Parameters:
+        df (pd.DataFrame): Les formulaires nettoyés (data_cleaned).
+        value_columns (tuple): Les colonnes comptées par les tableaux croisés.
+
+    Returns:
+        pd.Series: Nombre de formulaires, indexé par les dimensions du cube et les indicateurs de valeur.
+    """
+    keys = [df[col] for col in cube_dimensions]
+    keys += [df[col].notna().rename(col) for col in value_columns]
+    return df.groupby(keys, observed=True, dropna=False).size()
+
+def pivot_from_cube(cube, value_column='patient_code', programme=None, types=None):
+    """
+    Tableau croisé d'une tranche du cube, même présentation que pd.pivot_table(margins=True) :
+    mois en lignes (ordre de mois_ordre, lignes vides retirées), (commune, Trouvé)
+    en colonnes triées et une colonne 'Total' en dernier.
+
+    Parameters:
+        cube (pd.Series): Résultat de build_performance_cube.
+        value_column (str): La colonne comptée (values= de pivot_table).
+        programme (str): 'OEV' ou 'PTME', tous les programmes si None.
+        types (list): Types de formulaire gardés ('Appel', 'Visite'), tous si None.
+
+    Returns:
+        pd.DataFrame: Le tableau croisé, vide si la tranche ne contient aucun formulaire.
+    """
+    keep = (cube > 0).to_numpy(copy=True)
+    if programme is not None:
+        keep &= np.asarray(cube.index.get_level_values('Programme') == programme)
+    if types is not None:
+        keep &= np.asarray(cube.index.get_level_values('Type').isin(types))
+    counts = cube[keep]
+    level = counts.index.get_level_values
+    counts = counts[np.asarray(level('mois').notna() & level('commune').notna() & level('Trouvé').notna())]
+    if counts.empty:
+        return pd.DataFrame()
+
+    cells = counts.groupby(level=['mois', 'commune', 'Trouvé']).sum()
+    # unstack garde l'ordre d'apparition dans le cube ; pivot_table trie les colonnes
+    pivot_table = cells.unstack(['commune', 'Trouvé']).sort_index(axis=1)
+    # Marge de pivot_table : lignes dont la valeur comptée est renseignée
+    complete = counts[np.asarray(counts.index.get_level_values(value_column))]
+    pivot_table[('Total', '')] = complete.groupby(level='mois').sum()
+
     pivot_table = pivot_table.reindex(mois_ordre).fillna(0)
-    
-    # Filtrage des lignes où toutes les valeurs ne sont pas égales à zéro
-    filtered_pivot_table = pivot_table[(pivot_table != 0).any(axis=1)]
-    
-    return filtered_pivot_table
+    return pivot_table[(pivot_table != 0).any(axis=1)]
 
 def update_column(df, search_column, search_value, is_column, is_value):
     """
@@ -94,8 +136,8 @@ def process_grouped(df, date_col, value_col, group_col):
     # Convertir la colonne de date en datetime
     df[date_col] = pd.to_datetime(df[date_col])
 
-    # Calculer la date du début de chaque semaine (lundi) et supprimer l'heure
-    df['Semaine'] = (df[date_col] - pd.to_timedelta(df[date_col].dt.weekday, unit='D')).dt.date
+    # Date du début de chaque semaine (lundi), sans l'heure
+    df['Semaine'] = time_buckets(df[date_col])['week_start']
 
     # Créer un pivot table pour regrouper les données
     df_pivot = df.pivot_table(
@@ -447,15 +489,15 @@ def main():
     
     # Import dial dataset
     print("Reading dial datasets...")
-    Apel_ptme = pd.read_excel(f"C:/Users/Moise/Downloads/caris-dashboard-app/data/Caris Health Agent - Femme PMTE  - APPELS PTME (created 2025-02-13) {today_date}.xlsx", parse_dates=True)
-    Apel_oev = pd.read_excel(f"C:/Users/Moise/Downloads/caris-dashboard-app/data/Caris Health Agent - Enfant - APPELS OEV (created 2025-01-08) {today_date}.xlsx", parse_dates=True)
+    Apel_ptme = load_export("Caris Health Agent - Femme PMTE  - APPELS PTME (created 2025-02-13)", today_date, parse_dates=True)
+    Apel_oev = load_export("Caris Health Agent - Enfant - APPELS OEV (created 2025-01-08)", today_date, parse_dates=True)
 
     # Import visit dataset
     print("Reading visit datasets...")
-    Visite_ptme = pd.read_excel(f"C:/Users/Moise/Downloads/caris-dashboard-app/data/Caris Health Agent - Femme PMTE  - Visite PTME (created 2025-02-13) {today_date}.xlsx", parse_dates=True)
-    Ration_ptme = pd.read_excel(f"C:/Users/Moise/Downloads/caris-dashboard-app/data/Caris Health Agent - Femme PMTE  - Ration & Autres Visites (created 2025-02-18) {today_date}.xlsx", parse_dates=True)
-    Ration_oev = pd.read_excel(f"C:/Users/Moise/Downloads/caris-dashboard-app/data/Caris Health Agent - Enfant - Ration et autres visites (created 2022-08-29) {today_date}.xlsx", parse_dates=True)
-    oev_visite = pd.read_excel(f"C:/Users/Moise/Downloads/caris-dashboard-app/data/Caris Health Agent - Enfant - Visite Enfant (created 2025-07-30) {today_date}.xlsx", parse_dates=True)
+    Visite_ptme = load_export("Caris Health Agent - Femme PMTE  - Visite PTME (created 2025-02-13)", today_date, parse_dates=True)
+    Ration_ptme = load_export("Caris Health Agent - Femme PMTE  - Ration & Autres Visites (created 2025-02-18)", today_date, parse_dates=True)
+    Ration_oev = load_export("Caris Health Agent - Enfant - Ration et autres visites (created 2022-08-29)", today_date, parse_dates=True)
+    oev_visite = load_export("Caris Health Agent - Enfant - Visite Enfant (created 2025-07-30)", today_date, parse_dates=True)
 
     # We copy ration oev file to have info on oev visit
     Visite_oev = Ration_oev.copy(deep=True)
@@ -543,10 +585,10 @@ def main():
     print(f"OEV combined: {oev.shape}")
 
     data = pd.concat([ptme, oev], axis=0, ignore_index=True)
+    # '---' devient NaT : ces lignes sont écartées par le filtre de période
+    data = apply_dtypes(data, 'commcare_callapp_forms')
     print(f"All data combined: {data.shape}")
 
-    data['date'].replace('---', '1901-01-01', inplace=True)
-
     # Pass start_date and end_date as parameters
     data = dataframe_for_period(data, 'date', start_date, end_date)
     print(f"Data after period filter: {data.shape}")
@@ -568,7 +610,7 @@ def main():
     print(f"Data cleaned final: {data_cleaned.shape}")
 
     if isinstance(data, pd.DataFrame):
-        grouped_data_cleaned = data_cleaned.groupby(['Programme', 'Type']).size().reset_index(name='Performances')
+        grouped_data_cleaned = data_cleaned.groupby(['Programme', 'Type'], observed=True).size().reset_index(name='Performances')
         print(grouped_data_cleaned)
     else:
         print("Error: 'data' is not a DataFrame.")
@@ -576,7 +618,7 @@ def main():
     # Group data for visits by monitor and calculate performances
     agent_data_visite = (
         data_cleaned[data_cleaned['Type'] == "Visite"]
-        .groupby(['username'])
+        .groupby(['username'], observed=True)
         .size()
         .reset_index(name='Performances')
     )
@@ -588,7 +630,7 @@ def main():
     # Group data for calls by monitor and calculate performances
     agent_data_appel = (
         data_cleaned[data_cleaned['Type'] == "Appel"]
-        .groupby(['username'])
+        .groupby(['username'], observed=True)
         .size()
         .reset_index(name='Performances')
     )
@@ -598,7 +640,7 @@ def main():
     print(agent_data_appel)
 
     # Group data for all performances by monitor
-    agent_data = (data_cleaned.groupby(['username'])
+    agent_data = (data_cleaned.groupby(['username'], observed=True)
         .size()
         .reset_index(name='Performances')
     )
@@ -607,27 +649,24 @@ def main():
     print(f"Total number of performances by monitors: {total_performances}")
     print(agent_data)
 
-    data_pivotable = create_pivot_table(data_cleaned[data_cleaned['Type'] == "Visite"], 'formid')
-    print("Data pivotable created")
+    # Un seul groupby pour toutes les tables de performance : chaque table est une tranche du cube
+    performance_cube = build_performance_cube(data_cleaned)
+    print(f"Performance cube created: {performance_cube.shape[0]} combinations")
 
-    # Filter the data for Type = "Appel"
-    appel_data = data_cleaned[data_cleaned['Type'] == "Appel"]
+    data_pivotable = pivot_from_cube(performance_cube, 'formid', types=["Visite"])
+    print("Data pivotable created")
 
-    # Create a pivot table for the filtered data
-    appel_pivot_table = create_pivot_table(appel_data, 'patient_code')
+    # Pivot table for Type = "Appel"
+    appel_pivot_table = pivot_from_cube(performance_cube, types=["Appel"])
     print("Appel pivot table created")
 
-    # Filter the data for Type = "Visite"
-    visit_data = data_cleaned[data_cleaned['Type'] == "Visite"]
-
-    # Create a pivot table for the filtered data
-    visit_pivot_table = create_pivot_table(visit_data, 'patient_code')
+    # Pivot table for Type = "Visite"
+    visit_pivot_table = pivot_from_cube(performance_cube, types=["Visite"])
     print("Visit pivot table created")
 
     print('Create pivot table for total performance (Appel and Visite)')
-    total_table = data_cleaned[(data_cleaned['Type'] == "Appel") | (data_cleaned['Type'] == "Visite")]
-    if not total_table.empty:
-        total = create_pivot_table(total_table, 'patient_code')
+    total = pivot_from_cube(performance_cube, types=["Appel", "Visite"])
+    if not total.empty:
         if isinstance(total.columns, pd.MultiIndex) and 'Oui' in total.columns.get_level_values(1):
             total_last = add_found_percentage(total)
             print("Total performance pivot created")
@@ -637,9 +676,8 @@ def main():
         print("No data found for total performance (Appel and Visite).")
 
     print('Create pivot table for OEV visit')
-    visite_table_oev = data_cleaned[(data_cleaned['Programme'] == "OEV") & (data_cleaned['Type'] == "Visite")]
-    if not visite_table_oev.empty:
-        visite_oev = create_pivot_table(visite_table_oev, 'patient_code')
+    visite_oev = pivot_from_cube(performance_cube, programme="OEV", types=["Visite"])
+    if not visite_oev.empty:
         if isinstance(visite_oev.columns, pd.MultiIndex) and 'Oui' in visite_oev.columns.get_level_values(1):
             visite_oev_last = add_found_percentage(visite_oev)
             print("OEV visit pivot created")
@@ -649,9 +687,8 @@ def main():
         print("No data found for OEV visits.")
 
     print('Create pivot table for PTME visit')
-    visite_table_ptme = data_cleaned[(data_cleaned['Programme'] == "PTME") & (data_cleaned['Type'] == "Visite")]
-    if not visite_table_ptme.empty:
-        visite_ptme = create_pivot_table(visite_table_ptme, 'patient_code')
+    visite_ptme = pivot_from_cube(performance_cube, programme="PTME", types=["Visite"])
+    if not visite_ptme.empty:
         if isinstance(visite_ptme.columns, pd.MultiIndex) and 'Oui' in visite_ptme.columns.get_level_values(1):
             visite_ptme_last = add_found_percentage(visite_ptme)
             print("PTME visit pivot created")
@@ -661,9 +698,8 @@ def main():
         print("No data found for PTME visits.")
      
     print('Create pivot table for call PTME')
-    appel_table_ptme = data_cleaned[(data_cleaned['Programme'] == "PTME") & (data_cleaned['Type'] == "Appel")]
-    if not appel_table_ptme.empty:
-        appel_ptme = create_pivot_table(appel_table_ptme, 'patient_code')
+    appel_ptme = pivot_from_cube(performance_cube, programme="PTME", types=["Appel"])
+    if not appel_ptme.empty:
         if isinstance(appel_ptme.columns, pd.MultiIndex) and 'Oui' in appel_ptme.columns.get_level_values(1):
             appel_ptme_last = add_found_percentage(appel_ptme)
             print("PTME call pivot created")
@@ -673,9 +709,8 @@ def main():
         print("No data found for call PTME.")
      
     print('Create pivot table for call OEV')
-    appel_table_oev = data_cleaned[(data_cleaned['Programme'] == "OEV") & (data_cleaned['Type'] == "Appel")]
-    if not appel_table_oev.empty:
-        appel_oev = create_pivot_table(appel_table_oev, 'patient_code')
+    appel_oev = pivot_from_cube(performance_cube, programme="OEV", types=["Appel"])
+    if not appel_oev.empty:
         if isinstance(appel_oev.columns, pd.MultiIndex) and 'Oui' in appel_oev.columns.get_level_values(1):
             appel_oev_last = add_found_percentage(appel_oev)
             print("OEV call pivot created")
@@ -741,7 +776,7 @@ def main():
     add_dataframe_to_workbook(output_file, "Agents", agent_data)
 
     # Personne trouvée par mois
-    mois_order = ['January', 'February', 'March', 'April', 'May', 'June', 'July', 'August', 'September', 'October', 'November', 'December']
+    mois_order = month_labels('fr')
     # Convert the 'mois' column to a categorical type with the defined order
     data_cleaned['mois'] = pd.Categorical(data_cleaned['mois'], categories=mois_order, ordered=True)
     groupeby_data = data_cleaned.groupby(['Programme', 'Trouvé']).size().reset_index(name='Performances')
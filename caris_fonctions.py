@@ -1,25 +1,11 @@
 import os
 from dotenv import load_dotenv
-from sqlalchemy import create_engine
 import pandas as pd
+from sql_engine import execute_sql_query as _execute_sql_query
 
 def execute_sql_query(env_path: str, sql_file_path: str) -> pd.DataFrame:
-    load_dotenv(env_path)
-    user = os.getenv('MYSQL_USER')
-    password = os.getenv('MYSQL_PASSWORD')
-    host = os.getenv('MYSQL_HOST')
-    db = os.getenv('MYSQL_DB')
-
-    conn_text = f'mysql+pymysql://{user}:{password}@{host}/{db}'
-    engine = create_engine(conn_text)
-
-    with open(sql_file_path, 'r') as file:
-        sql_query = file.read().replace('use caris_db;', '')
-
-    df = pd.read_sql_query(sql_query, engine)
-    engine.dispose()
-
-    return df
+    # Pooled engine shared by the whole run, see sql_engine.py
+    return _execute_sql_query(env_path, sql_file_path)
 
 #===========================================================================================================================
 #========================================================================================================================= 
@@ -30,6 +16,7 @@ from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.common.by import By
 import time
 from datetime import datetime
+from commcare_session import CommCareSession
 
 def download_files():
     load_dotenv('id_cc.env')
@@ -46,10 +33,9 @@ def download_files():
 
     def commcare_login():
         try:
-            driver.get('https://www.commcarehq.org/a/caris-test/data/export/custom/new/case/download/f6ddce2133f8d233d9fbd9341220ed6f/')
-            driver.find_element(By.XPATH, '//*[@id="id_auth-username"]').send_keys(email)
-            driver.find_element(By.XPATH, '//*[@id="id_auth-password"]').send_keys(password_cc)
-            driver.find_element(By.CSS_SELECTOR, 'button[type=submit]').click()
+            # Session enregistrée (commcare_session.py), formulaire seulement si elle a expiré
+            CommCareSession(email, password_cc).login_driver(
+                driver, 'https://www.commcarehq.org/a/caris-test/data/export/custom/new/case/download/f6ddce2133f8d233d9fbd9341220ed6f/')
         except Exception as e:
             print(f"An error occurred during login: {e}")
 
@@ -148,6 +134,7 @@ import pandas as pd
 def creer_colonne_match_conditional(df1, df2, on, nouvelle_colonne, mapping):
     """
     Crée une colonne dans df1 en fonction des correspondances avec df2, conditionnées par un mapping.
+    Pour un simple drapeau oui/non, préférer membership.flag_membership (pas de merge ni de doublons).
     
     :param df1: Le premier DataFrame
     :param df2: Le second DataFrame
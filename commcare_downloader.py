@@ -9,8 +9,12 @@ import os
 import re
 import time
 import glob
+import queue
+import shutil
 import logging
+import threading
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict, Tuple, Optional
 
 # Selenium imports
@@ -21,7 +25,9 @@ from selenium.webdriver.support import expected_conditions as EC
 from selenium.common.exceptions import TimeoutException, StaleElementReferenceException
 from selenium.webdriver.common.action_chains import ActionChains
 
-from utils import file_matches_today
+from download_watcher import DownloadWatcher
+from export_index import ExportIndex
+from commcare_session import CommCareSession
 
 # ===================== CONFIG =====================
 DOWNLOAD_DIR = r"C:\Users\Moise\Downloads\caris-dashboard-app\data"
@@ -73,6 +79,16 @@ VERIFICATION_TIMEOUT = 60
 HEAVY_FILE_TIMEOUT = 180  # 3 minutes pour les gros fichiers
 HEADLESS = False
 
+# Mode parallèle : nombre de navigateurs Chrome (headless) téléchargeant en même temps.
+# 1 = mode séquentiel historique dans une seule session.
+PARALLEL_WORKERS = 1
+# Sous-dossier de téléchargement de chaque navigateur, dans DOWNLOAD_DIR
+WORKER_DIR_PREFIX = ".worker_"
+
+# Exports téléchargés d'abord par HTTP (export_client.py), sans navigateur ;
+# Chrome ne sert plus qu'aux exports que le client HTTP n'a pas pu récupérer.
+USE_HTTP_CLIENT = True
+
 # Fichiers lourds nécessitant plus de temps
 HEAVY_FILES = [
     "muso_beneficiaries",
@@ -101,9 +117,6 @@ def expected_filename_for_today(base: str, sep: str = " ") -> str:
     # Affichage indicatif pour les autres
     return f"{base}{sep}(created XXXX-XX-XX) {today_str()}.xlsx"
 
-def list_xlsx(folder: str) -> List[str]:
-    return [os.path.basename(p) for p in glob.glob(os.path.join(folder, "*.xlsx"))]
-
 def list_partial_downloads(folder: str) -> List[str]:
     return glob.glob(os.path.join(folder, "*.crdownload"))
 
@@ -116,25 +129,16 @@ def cleanup_orphan_crdownload(folder: str) -> None:
 
 def cleanup_duplicate_files(folder: str) -> None:
     """Nettoie les fichiers dupliqués en gardant le plus récent."""
-    ensure_dir(folder)
-    files = list_xlsx(folder)
-    file_groups: Dict[str, List[str]] = {}
-    for filename in files:
-        for base in EXPECTED_BASES:
-            if file_matches_today(base, filename):
-                file_groups.setdefault(base, []).append(filename)
-                break
-
-    for base, group_files in file_groups.items():
-        if len(group_files) > 1:
-            log.info(f"Fichiers dupliqués trouvés pour {base}: {group_files}")
-            group_files.sort(key=lambda f: os.path.getmtime(os.path.join(folder, f)))
-            for file_to_delete in group_files[:-1]:
-                try:
-                    os.remove(os.path.join(folder, file_to_delete))
-                    log.info(f"Fichier dupliqué supprimé: {file_to_delete}")
-                except Exception as e:
-                    log.warning(f"Impossible de supprimer {file_to_delete}: {e}")
+    index = get_export_index(folder).refresh()
+    for base, group_files in index.duplicates().items():
+        log.info(f"Fichiers dupliqués trouvés pour {base}: {group_files}")
+        # Fichiers déjà triés du plus ancien au plus récent par l'index
+        for file_to_delete in group_files[:-1]:
+            try:
+                index.remove(file_to_delete)
+                log.info(f"Fichier dupliqué supprimé: {file_to_delete}")
+            except Exception as e:
+                log.warning(f"Impossible de supprimer {file_to_delete}: {e}")
 
 def human_list(items: List[str]) -> str:
     return "[" + ", ".join(items) + "]" if items else "[]"
@@ -170,58 +174,73 @@ def build_pattern_with_today(base: str) -> re.Pattern:
         pat = rf"^{special_prefix}{re.escape(date)}(?:\s+\(\d+\))?\.xlsx$"
     else:
         # ex: "Caris Health Agent ... (created 2025-01-01) 2025-08-14.xlsx"
-        pat = rf"^{base_esc}\s*\(created\s+\d{{4}}-\d{{2}}-\d{{2}}\)\s+{re.escape(date)}\.xlsx$"
+        pat = rf"^{base_esc}\s*\(created\s+\d{{4}}-\d{{2}}-\d{{2}}\)\s+{re.escape(date)}(?:\s+\(\d+\))?\.xlsx$"
 
     return re.compile(pat, re.IGNORECASE)
 
-def file_matches_today(base: str, filename: str) -> bool:
-    # Normalisation pour éviter les faux négatifs (casse, espaces)
-    today = today_str()
-    base_norm = base.lower().replace(" ", "_")
-    fname_norm = os.path.basename(filename).lower().replace(" ", "_")
-    # Pattern robuste pour tous les cas
-    pat = re.compile(rf"^{re.escape(base_norm)}(\s*\(created\s+\d{{4}}-\d{{2}}-\d{{2}}\))?\s+{today}(?:\s+\(\d+\))?\.xlsx$")
-    return bool(pat.match(fname_norm))
+# Un index par dossier : motifs du jour compilés une fois, fichiers classés à leur arrivée
+_indexes: Dict[str, ExportIndex] = {}
+_indexes_lock = threading.Lock()
+
+def get_export_index(folder_path: str) -> ExportIndex:
+    """Index des fichiers du jour du dossier, construit au premier appel puis tenu à jour."""
+    key = os.path.abspath(folder_path)
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is None:
+            index = ExportIndex(key, {b: build_pattern_with_today(b) for b in EXPECTED_BASES})
+            _indexes[key] = index
+        return index
+
+def drop_export_index(folder_path: str) -> None:
+    with _indexes_lock:
+        _indexes.pop(os.path.abspath(folder_path), None)
 
 # ===================== VERIFICATION =====================
 def check_existing_files(expected_bases: List[str], folder_path: str) -> Tuple[List[str], Dict[str, List[str]]]:
-    ensure_dir(folder_path)
-    present = list_xlsx(folder_path)
-    present_map: Dict[str, List[str]] = {}
-    missing_bases: List[str] = []
-    for base in expected_bases:
-        matches = [f for f in present if file_matches_today(base, f)]
-        present_map[base] = matches
-        if not matches:
-            missing_bases.append(base)
+    index = get_export_index(folder_path).refresh()
+    present_map: Dict[str, List[str]] = {base: index.matches(base) for base in expected_bases}
+    missing_bases = [base for base in expected_bases if not present_map[base]]
     return missing_bases, present_map
 
-def _file_size_stable(path: str, wait_interval: float = 1.5) -> bool:
-    try:
-        s1 = os.path.getsize(path)
-        time.sleep(wait_interval)
-        s2 = os.path.getsize(path)
-        return s1 > 0 and s1 == s2
-    except Exception:
-        return False
+# Un observateur par dossier de téléchargement (DOWNLOAD_DIR et dossiers des navigateurs parallèles)
+_watchers: Dict[str, DownloadWatcher] = {}
+_watchers_lock = threading.Lock()
+
+def get_download_watcher(folder_path: str) -> DownloadWatcher:
+    """Observateur du dossier, démarré au premier appel, qui rattache chaque fichier terminé à sa base."""
+    key = os.path.abspath(folder_path)
+    with _watchers_lock:
+        watcher = _watchers.get(key)
+        if watcher is None:
+            watcher = DownloadWatcher(key, {b: build_pattern_with_today(b) for b in EXPECTED_BASES}).start()
+            _watchers[key] = watcher
+        return watcher
+
+def stop_download_watcher(folder_path: str) -> None:
+    with _watchers_lock:
+        watcher = _watchers.pop(os.path.abspath(folder_path), None)
+    if watcher is not None:
+        watcher.stop()
 
 def verify_download_success_for_base(base: str, folder_path: str, timeout: int = VERIFICATION_TIMEOUT) -> Optional[str]:
     actual_timeout = HEAVY_FILE_TIMEOUT if base in HEAVY_FILES else timeout
     log.info(f"Vérification du téléchargement pour {base} (timeout: {actual_timeout}s)")
-    pat = build_pattern_with_today(base)
+    watcher = get_download_watcher(folder_path)
     end = time.time() + actual_timeout
 
+    # Réveil dès que le .crdownload est renommé en .xlsx, sans balayer le dossier
     while time.time() < end:
-        if list_partial_downloads(folder_path):
-            log.info(f"Téléchargement en cours pour {base}...")
-            time.sleep(2.0)
-
-        for f in list_xlsx(folder_path):
-            if pat.match(f):
-                full = os.path.join(folder_path, f)
-                if _file_size_stable(full, wait_interval=2.0):
-                    return full
-        time.sleep(2.0)
+        path = watcher.wait_for(base, timeout=end - time.time())
+        if path is None:
+            break
+        if os.path.isfile(path) and os.path.getsize(path) > 0:
+            get_export_index(folder_path).add(path)
+            return path
+        # Fichier signalé puis supprimé entre-temps (doublon nettoyé) : on attend le suivant
+        watcher.forget(base)
+    if list_partial_downloads(folder_path):
+        log.info(f"Téléchargement toujours en cours pour {base}...")
     return None
 
 # ===================== SELENIUM HELPERS =====================
@@ -375,18 +394,20 @@ def trigger_download(export_base: str, driver) -> None:
         raise
 
 # ===================== TÉLÉCHARGEMENT + VÉRIF =====================
-def download_with_verification(export_base: str, driver, max_retries: int = MAX_RETRIES_PER_FILE) -> bool:
+def download_with_verification(export_base: str, driver, max_retries: int = MAX_RETRIES_PER_FILE,
+                               download_dir: str = DOWNLOAD_DIR) -> bool:
     target_hint = expected_filename_for_today(export_base)
     actual_retries = 2 if export_base in HEAVY_FILES else max_retries
 
     for attempt in range(1, actual_retries + 1):
         # Vérifie si le fichier existe déjà AVANT de tenter quoi que ce soit (sécurité renforcée)
-        if any(file_matches_today(export_base, f) for f in list_xlsx(DOWNLOAD_DIR)):
+        if get_export_index(download_dir).has(export_base):
             log.info(f"⏩ Fichier déjà présent pour {export_base} (avant tentative {attempt}). Aucun téléchargement lancé.")
             return True
 
         log.info(f"Téléchargement de {target_hint} (tentative {attempt}/{actual_retries})…")
-        cleanup_orphan_crdownload(DOWNLOAD_DIR)
+        cleanup_orphan_crdownload(download_dir)
+        get_download_watcher(download_dir).forget(export_base)
 
         try:
             trigger_download(export_base, driver)
@@ -398,14 +419,14 @@ def download_with_verification(export_base: str, driver, max_retries: int = MAX_
             timeout = 600
         else:
             timeout = HEAVY_FILE_TIMEOUT if export_base in HEAVY_FILES else VERIFICATION_TIMEOUT
-        path = verify_download_success_for_base(export_base, DOWNLOAD_DIR, timeout=timeout)
+        path = verify_download_success_for_base(export_base, download_dir, timeout=timeout)
         if path:
             size_mb = os.path.getsize(path) / (1024 * 1024)
             log.info("🎉 Téléchargement vérifié: %s (%.1f MB)", os.path.basename(path), size_mb)
             return True
 
         log.warning("Non confirmé pour %s (tentative %d)", target_hint, attempt)
-        cleanup_orphan_crdownload(DOWNLOAD_DIR)
+        cleanup_orphan_crdownload(download_dir)
 
     log.error("Échec après %d tentatives pour %s", actual_retries, target_hint)
     return False
@@ -435,33 +456,135 @@ def start_chrome(download_dir: str, headless: bool = HEADLESS):
     return driver
 
 def commcare_login(driver, email: str, password: str, first_export_url: str):
-    driver.get(first_export_url)
+    """Connecte le navigateur ; le formulaire n'est rempli que si la session enregistrée a expiré."""
+    CommCareSession(email, password).login_driver(driver, first_export_url)
 
-    user = WebDriverWait(driver, 60).until(EC.visibility_of_element_located((By.ID, "id_auth-username")))
-    pwd = WebDriverWait(driver, 60).until(EC.visibility_of_element_located((By.ID, "id_auth-password")))
-
-    user.clear(); user.send_keys(email.strip())
-    pwd.clear();  pwd.send_keys(password.strip())
-
-    login_btn = driver.find_element(By.XPATH, "//form[.//input[@id='id_auth-username']]//button[@type='submit']")
-    driver.execute_script("arguments[0].scrollIntoView({block:'center'});", login_btn)
-    login_btn.click()
+# ===================== CLIENT HTTP =====================
+def download_exports_http(bases: List[str], session: CommCareSession, download_dir: str = DOWNLOAD_DIR) -> List[str]:
+    """
+    Télécharge les exports par HTTP (session enregistrée ou nouvelle connexion, préparation, suivi, fichier en flux).
 
+    Returns:
+        Liste des bases à confier au navigateur (échec HTTP ou nom de fichier inattendu)
+    """
     try:
-        WebDriverWait(driver, 2).until(lambda d: "/login" not in d.current_url)
-    except Exception:
-        pwd.send_keys(Keys.RETURN)
+        client = session.export_client(timeout=600)
+    except Exception as e:
+        log.warning(f"Connexion HTTP impossible ({e}) — téléchargement par le navigateur.")
+        return bases[:]
 
+    remaining: List[str] = []
+    for base in bases:
+        try:
+            path = client.export(EXPORT_URLS[base], download_dir)
+        except Exception as e:
+            log.warning(f"Export HTTP échoué pour {base}: {e}")
+            remaining.append(base)
+            continue
+        if get_export_index(download_dir).add(path) == base:
+            log.info(f"✅ Téléchargement HTTP réussi pour: {base}")
+        else:
+            # Fichier non reconnu par la vérification : on le retire et le navigateur reprend l'export
+            log.warning(f"Nom de fichier inattendu pour {base}: {os.path.basename(path)}")
+            get_export_index(download_dir).remove(path)
+            remaining.append(base)
+    return remaining
+
+# ===================== MODE PARALLÈLE =====================
+def export_login_cookies(driver) -> List[Dict]:
+    """Cookies de la session authentifiée, à partager avec les autres navigateurs."""
+    return driver.get_cookies()
+
+def load_login_cookies(driver, cookies: List[Dict], url: str) -> None:
+    """Installe les cookies de connexion dans un navigateur (il doit d'abord être sur le domaine)."""
+    driver.get(url)
+    for cookie in cookies:
+        cookie = {k: v for k, v in cookie.items() if k in ("name", "value", "domain", "path", "secure", "httpOnly", "expiry")}
+        try:
+            driver.add_cookie(cookie)
+        except Exception as e:
+            log.debug(f"Cookie {cookie.get('name')} non installé: {e}")
+
+def merge_worker_downloads(worker_dir: str, download_dir: str, export_base: str) -> List[str]:
+    """Déplace les fichiers terminés d'un export depuis le dossier d'un navigateur vers download_dir."""
+    moved = []
+    source, target = get_export_index(worker_dir), get_export_index(download_dir)
+    for f in source.matches(export_base):
+        shutil.move(source.path(f), target.path(f))
+        source.discard(f)
+        target.add(f)
+        moved.append(f)
+    return moved
+
+def _download_worker(worker_id: int, jobs: "queue.Queue[str]", cookies: List[Dict],
+                     results: Dict[str, bool], merge_lock: threading.Lock) -> None:
+    """
+    Un navigateur headless avec son propre dossier : prend les exports dans la file jusqu'à
+    ce qu'elle soit vide, avec les mêmes tentatives et vérifications que le mode séquentiel.
+    """
+    worker_dir = os.path.join(DOWNLOAD_DIR, f"{WORKER_DIR_PREFIX}{worker_id}")
+    ensure_dir(worker_dir)
+    driver = None
     try:
-        WebDriverWait(driver, 30).until(
-            lambda d: ("/login" not in d.current_url) or bool(d.find_elements(By.ID, "download-export-form"))
-        )
-        log.info("Authentification réussie.")
-    except TimeoutException:
-        raise RuntimeError("Échec d'authentification")
+        driver = start_chrome(worker_dir, headless=True)
+        load_login_cookies(driver, cookies, "https://www.commcarehq.org/")
+        while True:
+            try:
+                base = jobs.get_nowait()
+            except queue.Empty:
+                break
+            log.info(f"[navigateur {worker_id}] 📥 Début du téléchargement: {expected_filename_for_today(base)}")
+            try:
+                ok = download_with_verification(base, driver, max_retries=MAX_RETRIES_PER_FILE, download_dir=worker_dir)
+            except Exception as e:
+                log.error(f"[navigateur {worker_id}] Erreur pour {base}: {e}")
+                ok = False
+            if ok:
+                with merge_lock:
+                    moved = merge_worker_downloads(worker_dir, DOWNLOAD_DIR, base)
+                    cleanup_duplicate_files(DOWNLOAD_DIR)
+                log.info(f"[navigateur {worker_id}] ✅ {base} -> {human_list(moved)}")
+            results[base] = ok
+    finally:
+        if driver is not None:
+            try:
+                driver.quit()
+            except Exception as e:
+                log.warning(f"⚠️ Erreur lors de la fermeture du navigateur {worker_id}: {e}")
+        stop_download_watcher(worker_dir)
+        drop_export_index(worker_dir)
+        cleanup_orphan_crdownload(worker_dir)
+        try:
+            os.rmdir(worker_dir)
+        except OSError:
+            pass
+
+def download_in_parallel(bases: List[str], cookies: List[Dict], workers: int = PARALLEL_WORKERS) -> List[str]:
+    """
+    Télécharge `bases` avec `workers` navigateurs headless partageant les cookies de connexion.
+
+    Les exports lourds partent en premier pour ne pas finir la passe sur eux.
+
+    Returns:
+        Liste des bases non téléchargées
+    """
+    jobs: "queue.Queue[str]" = queue.Queue()
+    for base in sorted(bases, key=lambda b: b not in HEAVY_FILES):
+        jobs.put(base)
+    results: Dict[str, bool] = {}
+    merge_lock = threading.Lock()
+    n_workers = max(1, min(workers, len(bases)))
+    with ThreadPoolExecutor(max_workers=n_workers) as pool:
+        futures = [pool.submit(_download_worker, i + 1, jobs, cookies, results, merge_lock) for i in range(n_workers)]
+        for future in futures:
+            try:
+                future.result()
+            except Exception as e:
+                log.error(f"Navigateur arrêté: {e}")
+    return [b for b in bases if not results.get(b)]
 
 # ===================== MAIN =====================
-def main_enhanced(driver=None):
+def main_enhanced(driver=None, workers: int = PARALLEL_WORKERS):
     from dotenv import load_dotenv
 
     t0 = time.time()
@@ -486,6 +609,23 @@ def main_enhanced(driver=None):
         log.info("Tous les fichiers datés %s sont déjà présents. Rien à faire.", today_str())
         return
 
+    # Identifiants
+    load_dotenv("id_cc.env")
+    email = os.getenv("EMAIL")
+    password = os.getenv("PASSWORD") or os.getenv("PASSWORD_CC")
+    if not email or not password:
+        raise RuntimeError("EMAIL / PASSWORD introuvables dans id_cc.env")
+    session = CommCareSession(email, password)
+
+    if USE_HTTP_CLIENT:
+        log.info("=== TÉLÉCHARGEMENT HTTP ===")
+        missing_bases = download_exports_http(missing_bases, session)
+        cleanup_duplicate_files(DOWNLOAD_DIR)
+        if not missing_bases:
+            log.info("🎉 Tous les exports (date %s) téléchargés par HTTP, navigateur inutile.", today_str())
+            return
+        log.info("Repli sur le navigateur pour: %s", human_list(missing_bases))
+
     own_driver = False
     if driver is None:
         driver = start_chrome(DOWNLOAD_DIR, headless=HEADLESS)
@@ -493,14 +633,8 @@ def main_enhanced(driver=None):
 
     try:
         # Login
-        load_dotenv("id_cc.env")
-        email = os.getenv("EMAIL")
-        password = os.getenv("PASSWORD") or os.getenv("PASSWORD_CC")
-        if not email or not password:
-            raise RuntimeError("EMAIL / PASSWORD introuvables dans id_cc.env")
-
         first_url = EXPORT_URLS[missing_bases[0]]
-        commcare_login(driver, email, password, first_url)
+        session.login_driver(driver, first_url)
 
         # Passes globales
         total_success = 0
@@ -512,27 +646,36 @@ def main_enhanced(driver=None):
             successful_downloads = 0
             failed_files: List[str] = []
 
-            for base in files_to_download:
-                # Vérification stricte AVANT chaque tentative, même en cas de relance
-                if any(file_matches_today(base, f) for f in list_xlsx(DOWNLOAD_DIR)):
-                    log.info(f"⏩ Fichier déjà présent pour {base}. Aucun téléchargement lancé.")
-                    successful_downloads += 1
-                    continue
-
-                log.info(f"📥 Début du téléchargement: {expected_filename_for_today(base)}")
-                ok = download_with_verification(base, driver, max_retries=MAX_RETRIES_PER_FILE)
-                if ok:
-                    successful_downloads += 1
-                    log.info(f"✅ Téléchargement réussi pour: {base}")
-                    cleanup_duplicate_files(DOWNLOAD_DIR)
-                else:
-                    failed_files.append(base)
-                    log.warning(f"❌ Téléchargement échoué pour: {base}")
+            if workers > 1:
+                # Vérification stricte AVANT chaque passe, puis répartition entre les navigateurs
+                index = get_export_index(DOWNLOAD_DIR)
+                already = [b for b in files_to_download if index.has(b)]
+                pending = [b for b in files_to_download if b not in already]
+                log.info("Mode parallèle: %d navigateurs pour %d exports", min(workers, len(pending)), len(pending))
+                failed_files = download_in_parallel(pending, export_login_cookies(driver), workers) if pending else []
+                successful_downloads = len(files_to_download) - len(failed_files)
+            else:
+                for base in files_to_download:
+                    # Vérification stricte AVANT chaque tentative, même en cas de relance
+                    if get_export_index(DOWNLOAD_DIR).has(base):
+                        log.info(f"⏩ Fichier déjà présent pour {base}. Aucun téléchargement lancé.")
+                        successful_downloads += 1
+                        continue
+
+                    log.info(f"📥 Début du téléchargement: {expected_filename_for_today(base)}")
+                    ok = download_with_verification(base, driver, max_retries=MAX_RETRIES_PER_FILE)
+                    if ok:
+                        successful_downloads += 1
+                        log.info(f"✅ Téléchargement réussi pour: {base}")
+                        cleanup_duplicate_files(DOWNLOAD_DIR)
+                    else:
+                        failed_files.append(base)
+                        log.warning(f"❌ Téléchargement échoué pour: {base}")
 
             # Filtrer à nouveau les bases déjà téléchargées pour la prochaine passe
             files_to_download = [
                 b for b in failed_files
-                if not any(file_matches_today(b, f) for f in list_xlsx(DOWNLOAD_DIR))
+                if not get_export_index(DOWNLOAD_DIR).has(b)
             ]
             log.info("Résultats Passe %d:", current_pass)
             log.info("   Réussis: %d", successful_downloads)
@@ -587,6 +730,7 @@ def main_enhanced(driver=None):
         time.sleep(2)
 
     finally:
+        stop_download_watcher(DOWNLOAD_DIR)
         if own_driver and driver:
             try:
                 log.info("🔒 Fermeture du navigateur Chrome…")
@@ -14,6 +14,8 @@ from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 
+from commcare_session import CommCareSession
+
 # Empêcher TensorFlow d’émettre des messages de log (niveau INFO/WARNING)
 os.environ["TF_CPP_MIN_LOG_LEVEL"] = "3"
 
@@ -78,18 +80,22 @@ DOWNLOAD_LINKS = [
 # Connexion à CommCare
 def login_to_commcare(driver: webdriver.Chrome) -> None:
     print("🔐 Connexion à CommCare…")
+    # Session enregistrée réutilisée ; formulaire seulement si elle a expiré
+    CommCareSession(EMAIL, PASSWORD).login_driver(driver, DOWNLOAD_LINKS[0]["url"], form_login=submit_login_form)
+
+def submit_login_form(driver: webdriver.Chrome, email: str, password: str, url: str) -> None:
     # On utilise l’URL du premier lien pour déclencher la connexion
-    driver.get(DOWNLOAD_LINKS[0]["url"])
+    driver.get(url)
     try:
         username_field = WebDriverWait(driver, 30).until(
             EC.element_to_be_clickable((By.ID, "id_auth-username"))
         )
         username_field.clear()
-        username_field.send_keys(EMAIL)
+        username_field.send_keys(email)
 
         password_field = driver.find_element(By.ID, "id_auth-password")
         password_field.clear()
-        password_field.send_keys(PASSWORD)
+        password_field.send_keys(password)
 
         # Essayons plusieurs sélecteurs pour trouver le bouton « Se connecter »
         selectors = [
@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+"""
+Session CommCare persistante, partagée par les téléchargeurs
+
+Les cookies de la dernière connexion sont gardés sur disque (SESSION_FILE).
+À chaque lancement, leur validité est vérifiée par une simple requête HTTP ;
+la connexion (HTTP, ou formulaire dans Chrome en repli) n'a lieu que si la
+session a expiré. Les mêmes cookies servent aux requests.Session du client
+HTTP et aux navigateurs Chrome, plusieurs navigateurs pouvant tourner en même temps.
+
+Usage :
+    session = CommCareSession(email, password)
+    client = session.export_client()           # exports par HTTP
+    session.login_driver(driver, export_url)   # navigateur déjà connecté
+"""
+
+import os
+import json
+import time
+import logging
+from typing import Callable, Dict, List, Optional
+
+import requests
+
+from export_client import LOGIN_PATH, CommCareExportClient
+
+COMMCARE_URL = "https://www.commcarehq.org"
+COMMCARE_DOMAIN = "caris-test"
+
+# Cookies de la dernière session, à côté des autres caches (ignoré par git)
+SESSION_DIR = os.path.join("data", ".commcare_session")
+SESSION_FILE = os.path.join(SESSION_DIR, "cookies.json")
+
+SELENIUM_COOKIE_KEYS = ("name", "value", "domain", "path", "secure", "httpOnly", "expiry")
+
+log = logging.getLogger("commcare-session")
+
+
+def submit_login_form(driver, email: str, password: str, url: str) -> None:
+    """
+    Connexion par le formulaire dans le navigateur : ouvre url (redirection vers la connexion),
+    saisit les identifiants et soumet le formulaire qui contient le champ username.
+    """
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.common.keys import Keys
+    from selenium.webdriver.support.ui import WebDriverWait
+    from selenium.webdriver.support import expected_conditions as EC
+    from selenium.common.exceptions import TimeoutException
+
+    if LOGIN_PATH not in driver.current_url:
+        driver.get(url)
+
+    user = WebDriverWait(driver, 60).until(EC.visibility_of_element_located((By.ID, "id_auth-username")))
+    pwd = WebDriverWait(driver, 60).until(EC.visibility_of_element_located((By.ID, "id_auth-password")))
+
+    user.clear(); user.send_keys(email.strip())
+    pwd.clear();  pwd.send_keys(password.strip())
+
+    login_btn = driver.find_element(By.XPATH, "//form[.//input[@id='id_auth-username']]//button[@type='submit']")
+    driver.execute_script("arguments[0].scrollIntoView({block:'center'});", login_btn)
+    login_btn.click()
+
+    try:
+        WebDriverWait(driver, 2).until(lambda d: "/login" not in d.current_url)
+    except Exception:
+        pwd.send_keys(Keys.RETURN)
+
+    try:
+        WebDriverWait(driver, 30).until(
+            lambda d: ("/login" not in d.current_url) or bool(d.find_elements(By.ID, "download-export-form"))
+        )
+    except TimeoutException:
+        raise RuntimeError("Échec d'authentification")
+
+
+class CommCareSession:
+    """
+    Cookies de connexion CommCare conservés d'un lancement à l'autre
+
+    Args:
+        email, password: Identifiants, utilisés seulement quand la session a expiré
+            (lus dans env_file s'ils ne sont pas fournis)
+        base_url: Hôte CommCare (ou celui du serveur de test)
+        domain: Domaine CommCare, pour la page de contrôle de la session
+        session_file: Fichier JSON des cookies
+        env_file: Fichier des identifiants (EMAIL, PASSWORD)
+    """
+
+    def __init__(self, email: Optional[str] = None, password: Optional[str] = None, base_url: str = COMMCARE_URL,
+                 domain: str = COMMCARE_DOMAIN, session_file: str = SESSION_FILE, env_file: str = "id_cc.env"):
+        if not email or not password:
+            from dotenv import load_dotenv
+            load_dotenv(env_file)
+            email = email or os.getenv("EMAIL")
+            password = password or os.getenv("PASSWORD") or os.getenv("PASSWORD_CC")
+        self.email = email
+        self.password = password
+        self.base_url = base_url.rstrip("/")
+        self.domain = domain
+        self.session_file = session_file
+        self._session: Optional[requests.Session] = None
+
+    @property
+    def probe_url(self) -> str:
+        """Page qui renvoie vers la connexion quand la session n'est plus valide."""
+        return f"{self.base_url}/a/{self.domain}/dashboard/"
+
+    # ---------- Cookies sur disque ----------
+    def load_cookies(self) -> List[Dict]:
+        """Cookies enregistrés (format Selenium), expirés exclus."""
+        try:
+            with open(self.session_file, encoding="utf-8") as f:
+                cookies = json.load(f)
+        except (OSError, ValueError):
+            return []
+        now = time.time()
+        return [c for c in cookies if not c.get("expiry") or c["expiry"] > now]
+
+    def save_cookies(self, cookies: List[Dict]) -> None:
+        """Enregistre les cookies, lisibles par l'utilisateur seul."""
+        os.makedirs(os.path.dirname(self.session_file) or ".", exist_ok=True)
+        cookies = [{k: v for k, v in c.items() if k in SELENIUM_COOKIE_KEYS} for c in cookies]
+        tmp = self.session_file + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(cookies, f)
+        os.chmod(tmp, 0o600)
+        os.replace(tmp, self.session_file)
+
+    @staticmethod
+    def _to_jar(session: requests.Session, cookies: List[Dict]) -> None:
+        for c in cookies:
+            session.cookies.set(c["name"], c["value"], domain=c.get("domain", ""), path=c.get("path", "/"),
+                                secure=c.get("secure", False), expires=c.get("expiry"))
+
+    @staticmethod
+    def _from_jar(session: requests.Session) -> List[Dict]:
+        cookies = []
+        for c in session.cookies:
+            cookie = {"name": c.name, "value": c.value, "domain": c.domain, "path": c.path or "/", "secure": bool(c.secure)}
+            if c.expires:
+                cookie["expiry"] = int(c.expires)
+            cookies.append(cookie)
+        return cookies
+
+    # ---------- requests.Session ----------
+    def is_valid(self, session: Optional[requests.Session] = None) -> bool:
+        """Une requête HTTP sur la page de contrôle, sans navigateur."""
+        client = CommCareExportClient(self.base_url, session=session or self._session or requests.Session())
+        return client.is_authenticated(self.probe_url)
+
+    def http_session(self) -> requests.Session:
+        """
+        requests.Session authentifiée : cookies enregistrés s'ils sont encore valides,
+        sinon nouvelle connexion HTTP (cookies enregistrés pour les lancements suivants).
+        """
+        if self._session is not None:
+            return self._session
+        session = requests.Session()
+        cookies = self.load_cookies()
+        if cookies:
+            self._to_jar(session, cookies)
+            if self.is_valid(session):
+                log.info("Session CommCare réutilisée, pas de connexion.")
+                self._session = session
+                return session
+            log.info("Session CommCare expirée, nouvelle connexion.")
+            session = requests.Session()
+        if not self.email or not self.password:
+            raise RuntimeError("EMAIL / PASSWORD introuvables pour la connexion à CommCare")
+        CommCareExportClient(self.base_url, session=session).login(self.email, self.password)
+        self.save_cookies(self._from_jar(session))
+        self._session = session
+        return session
+
+    def export_client(self, **kwargs) -> CommCareExportClient:
+        """Client HTTP des exports sur la session authentifiée."""
+        return CommCareExportClient(self.base_url, session=self.http_session(), **kwargs)
+
+    def download_export(self, export_url: str, dest_dir: str, browser_download: Optional[Callable] = None,
+                        **export_kwargs) -> Optional[str]:
+        """
+        Télécharge un export par HTTP ; renvoie le chemin du fichier
+
+        En cas d'échec (connexion, préparation, téléchargement), browser_download(), le parcours
+        dans le navigateur, prend le relais et son résultat est renvoyé ; sans lui, l'erreur remonte.
+        """
+        try:
+            return self.export_client().export(export_url, dest_dir, **export_kwargs)
+        except Exception as e:
+            if browser_download is None:
+                raise
+            log.warning(f"Export HTTP échoué ({e}), téléchargement par le navigateur.")
+            return browser_download()
+
+    # ---------- Navigateur ----------
+    def login_driver(self, driver, url: str, form_login: Optional[Callable] = None) -> None:
+        """
+        Rend le navigateur connecté puis ouvre url
+
+        Les cookies de la session (vérifiée ou renouvelée par HTTP) sont installés dans le navigateur ;
+        le formulaire de connexion (form_login, submit_login_form par défaut) ne sert que si la page
+        renvoie encore vers la connexion. Les cookies obtenus sont alors enregistrés.
+        """
+        try:
+            cookies = self._from_jar(self.http_session())
+        except Exception as e:
+            log.warning(f"Session HTTP indisponible ({e}), connexion par le navigateur.")
+            cookies = []
+
+        if cookies:
+            # Le navigateur doit être sur le domaine pour accepter ses cookies
+            driver.get(self.base_url + LOGIN_PATH)
+            for cookie in cookies:
+                cookie = {k: v for k, v in cookie.items() if k in SELENIUM_COOKIE_KEYS}
+                try:
+                    driver.add_cookie(cookie)
+                except Exception as e:
+                    log.debug(f"Cookie {cookie.get('name')} non installé: {e}")
+        driver.get(url)
+
+        if LOGIN_PATH in driver.current_url:
+            (form_login or submit_login_form)(driver, self.email, self.password, url)
+            self.save_cookies(driver.get_cookies())
+            self._session = None
+            log.info("Authentification réussie (formulaire).")
+        else:
+            log.info("Navigateur connecté avec la session enregistrée.")
+
+    def new_driver(self, url: str, download_dir: Optional[str] = None, headless: bool = False):
+        """Nouveau Chrome, téléchargeant dans download_dir, déjà connecté et sur url."""
+        from selenium import webdriver
+        from selenium.webdriver.chrome.options import Options
+
+        options = Options()
+        options.add_argument("--start-maximized")
+        if headless:
+            options.add_argument("--headless=new")
+        if download_dir:
+            os.makedirs(download_dir, exist_ok=True)
+            options.add_experimental_option("prefs", {
+                "download.default_directory": os.path.abspath(download_dir),
+                "download.prompt_for_download": False,
+                "download.directory_upgrade": True,
+            })
+        driver = webdriver.Chrome(options=options)
+        driver.implicitly_wait(10)
+        self.login_driver(driver, url)
+        return driver
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+"""
+Détection des téléchargements terminés dans un dossier
+
+Les fichiers terminés sont signalés par des événements du système
+(watchdog : inotify sous Linux, ReadDirectoryChangesW sous Windows),
+repli sur un balayage périodique du dossier quand watchdog n'est pas installé.
+Un fichier est terminé quand Chrome renomme le .crdownload en .xlsx, ou quand
+son écriture est fermée (créateurs autres que Chrome).
+Chaque nom de fichier est rattaché à son export par une seule expression combinée.
+"""
+
+import os
+import re
+import logging
+import threading
+from typing import Dict, Iterable, List, Optional
+
+log = logging.getLogger("download-watcher")
+
+PARTIAL_SUFFIXES = (".crdownload", ".part", ".tmp")
+
+
+def combine_patterns(patterns: Dict[str, "re.Pattern"]) -> "re.Pattern":
+    """
+    Une seule expression pour tous les exports : chaque motif devient un groupe nommé g<i>,
+    le groupe qui correspond (match.lastgroup) désigne l'export.
+    """
+    alternatives = [f"(?P<g{i}>{pattern.pattern})" for i, pattern in enumerate(patterns.values())]
+    return re.compile("|".join(alternatives), re.IGNORECASE)
+
+
+class DownloadWatcher:
+    """
+    Surveille un dossier et note, pour chaque export, le dernier fichier terminé
+
+    Args:
+        folder: Dossier de téléchargement
+        patterns: {base: motif compilé du nom de fichier du jour}
+        poll_interval: Intervalle du balayage de repli, en secondes
+        use_watchdog: False pour forcer le balayage
+
+    Exemple :
+        with DownloadWatcher(DOWNLOAD_DIR, {b: build_pattern_with_today(b) for b in EXPECTED_BASES}) as watcher:
+            trigger_download(base, driver)
+            path = watcher.wait_for(base, timeout=180)
+    """
+
+    def __init__(self, folder: str, patterns: Dict[str, "re.Pattern"], poll_interval: float = 0.5,
+                 use_watchdog: bool = True):
+        self.folder = os.path.abspath(folder)
+        self.bases = list(patterns)
+        self.pattern = combine_patterns(patterns)
+        self.poll_interval = poll_interval
+        self.use_watchdog = use_watchdog
+        self.finished: Dict[str, str] = {}
+        self.completed: List[str] = []
+        self._changed = threading.Condition()
+        self._observer = None
+        self._poller = None
+        self._stop = threading.Event()
+        self._sizes: Dict[str, int] = {}
+
+    # ---------- Rattachement d'un fichier à son export ----------
+    def classify(self, filename: str) -> Optional[str]:
+        """Export correspondant à un nom de fichier, ou None."""
+        match = self.pattern.match(os.path.basename(filename)) if self.bases else None
+        return self.bases[int(match.lastgroup[1:])] if match else None
+
+    def _record(self, path: str) -> None:
+        if path.endswith(PARTIAL_SUFFIXES):
+            return
+        base = self.classify(path)
+        with self._changed:
+            if path in self.completed:
+                return
+            self.completed.append(path)
+            if base is not None:
+                self.finished[base] = path
+            self._changed.notify_all()
+        log.info(f"Téléchargement terminé détecté: {os.path.basename(path)}" + (f" ({base})" if base else ""))
+
+    def forget(self, base: str) -> None:
+        """Oublie le fichier noté pour un export (avant une nouvelle tentative)."""
+        with self._changed:
+            path = self.finished.pop(base, None)
+            if path in self.completed:
+                self.completed.remove(path)
+
+    # ---------- Démarrage ----------
+    def start(self) -> "DownloadWatcher":
+        os.makedirs(self.folder, exist_ok=True)
+        if self.use_watchdog and self._start_watchdog():
+            log.info(f"Surveillance par événements de {self.folder}")
+        else:
+            self._poller = threading.Thread(target=self._poll_loop, daemon=True)
+            self._poller.start()
+            log.info(f"Surveillance par balayage ({self.poll_interval}s) de {self.folder}")
+        # Fichiers déjà présents au démarrage
+        with os.scandir(self.folder) as entries:
+            for entry in entries:
+                if entry.is_file():
+                    self._record(entry.path)
+        return self
+
+    def _start_watchdog(self) -> bool:
+        try:
+            from watchdog.observers import Observer
+            from watchdog.events import FileSystemEventHandler
+        except ImportError:
+            return False
+
+        watcher = self
+
+        class Handler(FileSystemEventHandler):
+            def on_moved(self, event):
+                # .crdownload -> .xlsx : Chrome a fini d'écrire
+                if not event.is_directory:
+                    watcher._record(event.dest_path)
+
+            def on_closed(self, event):
+                # Écriture fermée (inotify IN_CLOSE_WRITE)
+                if not event.is_directory:
+                    watcher._record(event.src_path)
+
+        self._observer = Observer()
+        self._observer.schedule(Handler(), self.folder, recursive=False)
+        self._observer.start()
+        return True
+
+    def _poll_loop(self) -> None:
+        # Un fichier est retenu quand sa taille n'a pas changé d'un balayage au suivant
+        while not self._stop.wait(self.poll_interval):
+            try:
+                with os.scandir(self.folder) as entries:
+                    for entry in entries:
+                        if not entry.is_file() or entry.name.endswith(PARTIAL_SUFFIXES):
+                            continue
+                        size = entry.stat().st_size
+                        if size > 0 and self._sizes.get(entry.name) == size:
+                            self._record(entry.path)
+                        self._sizes[entry.name] = size
+            except OSError as e:
+                log.debug(f"Balayage de {self.folder} impossible: {e}")
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer.join(timeout=5)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    # ---------- Attente ----------
+    def wait_for(self, base: str, timeout: float) -> Optional[str]:
+        """Chemin du fichier terminé de `base` dès qu'il est signalé, None après timeout secondes."""
+        with self._changed:
+            self._changed.wait_for(lambda: base in self.finished, timeout)
+            return self.finished.get(base)
+
+    def wait_for_new(self, known: Iterable[str], timeout: float) -> Optional[str]:
+        """Premier fichier terminé dont le nom n'est pas dans `known` (fichiers présents avant le téléchargement)."""
+        known = {os.path.basename(f) for f in known}
+
+        def new_files():
+            return [p for p in self.completed if os.path.basename(p) not in known]
+
+        with self._changed:
+            self._changed.wait_for(lambda: bool(new_files()), timeout)
+            found = new_files()
+        return found[-1] if found else None
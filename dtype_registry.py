@@ -0,0 +1,74 @@
+import pandas as pd
+
+# Column types of each data source, applied once when the data is loaded.
+# 'category' for repeated labels, nullable small ints ('Int8', 'Int16') for
+# flags and ages, 'datetime' for dates (unparseable values become NaT).
+# Columns absent from a frame are skipped.
+SOURCE_DTYPES = {
+    # Charges_virales_pediatriques.sql (oev_pipeline.py)
+    'sql_charges_virales': {
+        'category': ['office', 'network', 'site', 'hospital_name', 'departement', 'commune', 'section',
+                     'sex', 'club_type', 'in_club'],
+        'Int8': ['is_abandoned', 'is_dead'],
+        'Int16': ['age'],
+        'datetime': ['date_of_birth', 'arv_start_date', 'viral_load_date', 'last_viral_load_collection_date'],
+    },
+    # APPELS / Visites exports of the Caris Health Agent app, once combined (call-app.py)
+    'commcare_callapp_forms': {
+        'category': ['username', 'Programme', 'Type'],
+        'datetime': ['date'],
+    },
+    # Household members OData feed (oev_pipeline.py)
+    'odata_hh_child': {
+        'category': ['gender', 'infant_relationship', 'hiv_test', 'hiv_test_result', 'caregiver_yes_no',
+                     'is_accepted', 'is_caris_beneficiary', 'opened_by_username'],
+    },
+}
+
+
+def apply_dtypes(df, source, verbose=True):
+    """
+    Convert the columns of a freshly loaded frame to the types registered for its source
+
+    Args:
+        df (pd.DataFrame): Frame as loaded
+        source (str): Key of SOURCE_DTYPES
+        verbose (bool): Print the memory used before and after
+
+    Returns:
+        pd.DataFrame: Typed copy of df
+    """
+    spec = SOURCE_DTYPES[source]
+    before = df.memory_usage(deep=True).sum() if verbose else 0
+    df = df.copy()
+    for dtype, columns in spec.items():
+        for col in columns:
+            if col not in df.columns:
+                continue
+            if dtype == 'category':
+                df[col] = df[col].astype('category')
+            elif dtype == 'datetime':
+                df[col] = pd.to_datetime(df[col], errors='coerce')
+            else:
+                values = pd.to_numeric(df[col], errors='coerce')
+                # Non-integer values would not fit a nullable int: keep them as float
+                if values.dropna().mod(1).eq(0).all():
+                    values = values.astype(dtype)
+                df[col] = values
+    if verbose:
+        after = df.memory_usage(deep=True).sum()
+        print(f"[{source}] {before / 1e6:.1f} MB -> {after / 1e6:.1f} MB")
+    return df
+
+
+def uncategorize(df):
+    """
+    Turn categorical columns back into plain object columns
+
+    Needed before steps that write values outside the categories, such as
+    df.fillna(0) on a frame whose categorical columns have missing values.
+    """
+    categorical = df.select_dtypes('category').columns
+    if len(categorical) == 0:
+        return df
+    return df.astype({col: object for col in categorical})
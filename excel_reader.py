@@ -0,0 +1,174 @@
+import os
+import time
+import importlib.util
+
+import pandas as pd
+from pandas.io.parsers import TextParser
+
+# Options the streaming openpyxl backend knows how to honour
+STREAM_OPTIONS = {'sheet_name', 'usecols', 'nrows', 'parse_dates'}
+
+
+def _calamine_available():
+    """The calamine engine needs the python-calamine package (pandas >= 2.2)."""
+    return importlib.util.find_spec('python_calamine') is not None
+
+
+def _read_calamine(path, **read_kwargs):
+    return pd.read_excel(path, engine='calamine', **read_kwargs)
+
+
+def _read_openpyxl(path, **read_kwargs):
+    if os.path.splitext(path)[1].lower() in ('.xlsx', '.xlsm'):
+        read_kwargs.setdefault('engine', 'openpyxl')
+    return pd.read_excel(path, **read_kwargs)
+
+
+def _resolve_usecols(names, usecols):
+    """Return the positions of the columns selected by `usecols` (None, list of names/positions or callable)."""
+    if usecols is None:
+        return list(range(len(names)))
+    if callable(usecols):
+        return [i for i, name in enumerate(names) if usecols(name)]
+    wanted = list(usecols)
+    if all(isinstance(col, int) for col in wanted):
+        return sorted(wanted)
+    missing = [col for col in wanted if col not in names]
+    if missing:
+        raise ValueError(f"Usecols do not match columns, columns expected but not found: {missing}")
+    return [i for i, name in enumerate(names) if name in wanted]
+
+
+def _convert_cell(value):
+    """Same cell conversion as the pandas openpyxl engine."""
+    if value is None:
+        return ''
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def _read_openpyxl_stream(path, sheet_name=0, usecols=None, nrows=None, parse_dates=False):
+    """
+    Read one sheet with openpyxl in read-only mode, keeping only the `usecols` cells
+
+    Rows are streamed from the workbook and the other columns are never
+    converted, which is what makes it faster than pd.read_excel on wide exports.
+    """
+    import openpyxl
+
+    workbook = openpyxl.load_workbook(path, read_only=True, data_only=True, keep_links=False)
+    try:
+        sheet = workbook.worksheets[sheet_name] if isinstance(sheet_name, int) else workbook[sheet_name]
+        rows = sheet.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return pd.DataFrame()
+        names = [name if name is not None else f"Unnamed: {i}" for i, name in enumerate(header)]
+        positions = _resolve_usecols(names, usecols)
+        data = [[names[i] for i in positions]]
+        for row in rows:
+            if nrows is not None and len(data) > nrows:
+                break
+            data.append([_convert_cell(row[i]) if i < len(row) else '' for i in positions])
+    finally:
+        workbook.close()
+
+    # Trailing empty rows are dropped, as pandas does
+    while len(data) > 1 and all(value == '' for value in data[-1]):
+        data.pop()
+    return TextParser(data, header=0).read()
+
+
+# name -> (reader, availability check); tried in this order by the 'auto' mode
+EXCEL_BACKENDS = {
+    'calamine': (_read_calamine, _calamine_available),
+    'openpyxl_stream': (_read_openpyxl_stream, lambda: importlib.util.find_spec('openpyxl') is not None),
+    'openpyxl': (_read_openpyxl, lambda: True),
+}
+
+
+def register_excel_backend(name, reader, available=lambda: True, first=False):
+    """
+    Add an Excel reader backend
+
+    Args:
+        name (str): Backend name, usable as read_excel_fast(..., backend=name)
+        reader (callable): reader(path, **read_kwargs) -> pd.DataFrame
+        available (callable): Returns False when the backend cannot run here
+        first (bool): Try this backend before the others in 'auto' mode
+    """
+    global EXCEL_BACKENDS
+    if first:
+        EXCEL_BACKENDS = {name: (reader, available), **EXCEL_BACKENDS}
+    else:
+        EXCEL_BACKENDS[name] = (reader, available)
+
+
+def _backend_supports(name, path, read_kwargs):
+    """Whether a backend can read this file with these options."""
+    extension = os.path.splitext(path)[1].lower()
+    if name == 'calamine':
+        return extension in ('.xlsx', '.xlsm', '.xlsb', '.xls', '.ods')
+    if name == 'openpyxl_stream':
+        usecols = read_kwargs.get('usecols')
+        return (
+            extension in ('.xlsx', '.xlsm')
+            # Without a column selection pandas' own openpyxl reader does the same work
+            and usecols is not None and not isinstance(usecols, str)
+            and set(read_kwargs) <= STREAM_OPTIONS
+            and isinstance(read_kwargs.get('sheet_name', 0), (int, str))
+            and read_kwargs.get('parse_dates', False) in (True, False)
+        )
+    return True
+
+
+def select_excel_backend(path, **read_kwargs):
+    """
+    Pick the fastest available backend able to read `path` with these options
+
+    Returns:
+        list: Backend names, best first
+    """
+    return [
+        name for name, (_, available) in EXCEL_BACKENDS.items()
+        if available() and _backend_supports(name, path, read_kwargs)
+    ]
+
+
+def read_excel_fast(path, backend='auto', **read_kwargs):
+    """
+    pd.read_excel through the fastest available backend
+
+    'auto' tries calamine (Rust reader), then the streaming openpyxl reader
+    when a column selection is given, then plain openpyxl. A backend that
+    fails on a file hands over to the next one.
+
+    Args:
+        path (str): Excel file ('~' is expanded)
+        backend (str): 'auto' or a name from EXCEL_BACKENDS
+        **read_kwargs: Passed to the reader (sheet_name, usecols, nrows, ...)
+
+    Returns:
+        pd.DataFrame: Content of the sheet
+    """
+    path = os.path.expanduser(path)
+    if backend == 'auto' and 'engine' in read_kwargs:
+        # An explicit pandas engine wins over the automatic choice
+        backend = 'openpyxl'
+    candidates = select_excel_backend(path, **read_kwargs) if backend == 'auto' else [backend]
+    if not candidates:
+        candidates = ['openpyxl']
+
+    for i, name in enumerate(candidates):
+        reader, _ = EXCEL_BACKENDS[name]
+        start = time.perf_counter()
+        try:
+            df = reader(path, **read_kwargs)
+        except Exception as e:
+            if i == len(candidates) - 1:
+                raise
+            print(f"Backend {name} failed on {os.path.basename(path)} ({e}), trying {candidates[i + 1]}")
+            continue
+        print(f"{os.path.basename(path)} read with {name} in {time.perf_counter() - start:.1f}s")
+        return df
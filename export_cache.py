@@ -0,0 +1,228 @@
+import os
+import re
+import glob
+import time
+import hashlib
+import tempfile
+import types
+from datetime import date, datetime
+
+import pandas as pd
+
+from excel_reader import read_excel_fast
+
+# Folder where commcare_downloader.py saves the daily CommCare exports
+EXPORT_DIR = os.path.expanduser("~/Downloads/caris-dashboard-app/data")
+# Converted copies of the exports, next to the pipelines
+CACHE_DIR = os.path.join("data", ".export_cache")
+
+
+def _code_signature(code):
+    """Bytecode, constants and names of a code object, nested code objects (lambdas, comprehensions) included."""
+    return (code.co_code, tuple(_stable_repr(const) for const in code.co_consts), code.co_names)
+
+
+def _stable_repr(value):
+    """repr() that stays the same across runs, also for callables such as usecols=lambda col: ..."""
+    if isinstance(value, types.CodeType):
+        return repr(_code_signature(value))
+    if isinstance(value, (set, frozenset)):
+        # Iteration order of a set of strings changes from one run to the next
+        return f"{type(value).__name__}({sorted(_stable_repr(item) for item in value)!r})"
+    if isinstance(value, (list, tuple)):
+        return f"{type(value).__name__}({[_stable_repr(item) for item in value]!r})"
+    if isinstance(value, dict):
+        return f"dict({sorted((_stable_repr(k), _stable_repr(v)) for k, v in value.items())!r})"
+    if callable(value) and hasattr(value, '__code__'):
+        closure = [_stable_repr(cell.cell_contents) for cell in value.__closure__ or ()]
+        defaults = _stable_repr(value.__defaults__ or ())
+        return repr((_code_signature(value.__code__), defaults, closure))
+    text = repr(value)
+    if re.search(r' at 0x[0-9a-fA-F]+', text):
+        raise TypeError(f"{text} has no stable representation and cannot be part of a cache key")
+    return text
+
+
+def _cache_prefix(path, read_kwargs):
+    """Identify one (file, read options) pair, independently of the file version."""
+    options = sorted((name, _stable_repr(value)) for name, value in read_kwargs.items())
+    signature = f"{os.path.abspath(path)}|{options!r}"
+    return hashlib.sha1(signature.encode('utf-8')).hexdigest()[:16]
+
+
+def _replace_atomically(path, write):
+    """
+    Write a file through a temporary file of the same folder, then rename it
+
+    Readers (another pipeline run, another thread) see either the previous
+    file or the complete new one, never a file being written.
+    """
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or '.', prefix='.' + os.path.basename(path), suffix='.tmp')
+    os.close(fd)
+    try:
+        write(tmp)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    return path
+
+
+def _write_cache(df, cache_base):
+    """Store a frame as Parquet, or as a pickle when Parquet cannot hold it (mixed types, non-text headers)."""
+    if isinstance(df, pd.DataFrame):
+        try:
+            return _replace_atomically(cache_base + '.parquet', df.to_parquet)
+        except Exception as e:
+            print(f"Parquet cache not possible ({type(e).__name__}), using pickle")
+            if os.path.exists(cache_base + '.parquet'):
+                os.remove(cache_base + '.parquet')
+    return _replace_atomically(cache_base + '.pkl', lambda tmp: pd.to_pickle(df, tmp))
+
+
+def _cache_base(path, read_kwargs, cache_dir):
+    """Cache file name (without extension) of the current version of `path` read with `read_kwargs`."""
+    stat = os.stat(path)
+    prefix = _cache_prefix(path, read_kwargs)
+    return prefix, os.path.join(cache_dir, f"{prefix}_{stat.st_size}_{stat.st_mtime_ns}")
+
+
+def _load_cached(path, cache_base):
+    """Return the cached frame, or None on a cache miss."""
+    for cached in (cache_base + '.parquet', cache_base + '.pkl'):
+        if os.path.exists(cached):
+            start = time.perf_counter()
+            df = pd.read_parquet(cached) if cached.endswith('.parquet') else pd.read_pickle(cached)
+            print(f"Cache hit: {os.path.basename(path)} ({time.perf_counter() - start:.3f}s)")
+            return df
+    return None
+
+
+def _store(df, prefix, cache_base, cache_dir):
+    """Save a freshly read frame, dropping the copies of older versions of the same export."""
+    os.makedirs(cache_dir, exist_ok=True)
+    for stale in glob.glob(os.path.join(cache_dir, prefix + '_*')):
+        os.remove(stale)
+    _write_cache(df, cache_base)
+
+
+def read_excel_cached(path, cache_dir=CACHE_DIR, backend='auto', **read_kwargs):
+    """
+    pd.read_excel with a columnar cache
+
+    The first read of a file parses the workbook and stores the result; later
+    reads of the same file (same path, size and modification time) with the
+    same options load the stored copy instead. A new version of the export
+    replaces the stored copy.
+
+    Args:
+        path (str): Excel file ('~' is expanded)
+        cache_dir (str): Folder holding the converted copies
+        backend (str): Excel reader used on a cache miss, see excel_reader.read_excel_fast
+        **read_kwargs: Passed to pd.read_excel (sheet_name, usecols, parse_dates, ...)
+
+    Returns:
+        pd.DataFrame: Same result as pd.read_excel(path, **read_kwargs)
+    """
+    path = os.path.expanduser(path)
+    prefix, cache_base = _cache_base(path, read_kwargs, cache_dir)
+    df = _load_cached(path, cache_base)
+    if df is not None:
+        return df
+
+    start = time.perf_counter()
+    df = read_excel_fast(path, backend=backend, **read_kwargs)
+    elapsed = time.perf_counter() - start
+    _store(df, prefix, cache_base, cache_dir)
+    print(f"Cache miss: {os.path.basename(path)} read in {elapsed:.1f}s and cached")
+    return df
+
+
+def read_excel_sheets_cached(path, sheet_names, cache_dir=CACHE_DIR, backend='auto', **read_kwargs):
+    """
+    Read several sheets of one workbook, opening and parsing it only once
+
+    Each sheet is cached on its own, with the same entry as
+    read_excel_cached(path, sheet_name=<sheet>, ...), so a later single-sheet
+    read of the same file is a cache hit. Sheets missing from the cache are
+    all read in a single pass over the workbook.
+
+    Args:
+        path (str): Excel file ('~' is expanded)
+        sheet_names (list): Sheet names or positions, e.g. ['Cases', 'Parent Cases'] or [0, 1]
+        cache_dir (str): Folder holding the converted copies
+        backend (str): Excel reader used on a cache miss, see excel_reader.read_excel_fast
+        **read_kwargs: Passed to pd.read_excel for every sheet
+
+    Returns:
+        dict: {sheet: pd.DataFrame}, in the order of sheet_names
+    """
+    path = os.path.expanduser(path)
+    sheets = {}
+    missing = {}
+    for sheet in sheet_names:
+        prefix, cache_base = _cache_base(path, {**read_kwargs, 'sheet_name': sheet}, cache_dir)
+        df = _load_cached(path, cache_base)
+        if df is None:
+            missing[sheet] = (prefix, cache_base)
+        else:
+            sheets[sheet] = df
+
+    if missing:
+        start = time.perf_counter()
+        frames = read_excel_fast(path, backend=backend, sheet_name=list(missing), **read_kwargs)
+        elapsed = time.perf_counter() - start
+        for sheet, (prefix, cache_base) in missing.items():
+            sheets[sheet] = frames[sheet]
+            _store(frames[sheet], prefix, cache_base, cache_dir)
+        print(f"Cache miss: {len(missing)} sheet(s) of {os.path.basename(path)} read in {elapsed:.1f}s and cached")
+    return {sheet: sheets[sheet] for sheet in sheet_names}
+
+
+def export_path(base, export_date=None, export_dir=EXPORT_DIR):
+    """
+    Path of a dated CommCare export, e.g. 'muso_groupes (created 2025-03-25) 2025-09-01.xlsx'
+
+    Args:
+        base (str): Export name without the download date
+        export_date (str | date): Download date, today by default
+        export_dir (str): Folder of the exports
+    """
+    if export_date is None:
+        export_date = datetime.today()
+    if isinstance(export_date, (date, datetime)):
+        export_date = export_date.strftime('%Y-%m-%d')
+    return os.path.join(os.path.expanduser(export_dir), f"{base} {export_date}.xlsx")
+
+
+def load_export(base, export_date=None, export_dir=EXPORT_DIR, **read_kwargs):
+    """
+    Load a dated CommCare export through the cache
+
+    Args:
+        base (str): Export name without the download date
+        export_date (str | date): Download date, today by default
+        export_dir (str): Folder of the exports
+        **read_kwargs: Passed to pd.read_excel
+
+    Returns:
+        pd.DataFrame: Content of the export
+    """
+    return read_excel_cached(export_path(base, export_date, export_dir), **read_kwargs)
+
+
+def load_export_sheets(base, sheet_names, export_date=None, export_dir=EXPORT_DIR, **read_kwargs):
+    """
+    Load several sheets of a dated CommCare export (e.g. 'Cases' and 'Parent Cases') in one pass
+
+    Returns:
+        dict: {sheet: pd.DataFrame}, see read_excel_sheets_cached
+    """
+    return read_excel_sheets_cached(export_path(base, export_date, export_dir), sheet_names, **read_kwargs)
+
+
+def clear_export_cache(cache_dir=CACHE_DIR):
+    """Remove every converted copy."""
+    for cached in glob.glob(os.path.join(cache_dir, '*')):
+        os.remove(cached)
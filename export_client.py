@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+"""
+Client HTTP des exports CommCare (sans navigateur)
+
+Reproduit les appels faits par la page d'export de CommCare :
+connexion, préparation de l'export, suivi de la préparation puis
+téléchargement du fichier, en flux, par blocs.
+Les chemins des points d'accès sont regroupés ci-dessous ;
+export_stub_server.py simule le même déroulé pour travailler hors ligne.
+"""
+
+import os
+import re
+import json
+import time
+import logging
+from datetime import datetime
+from urllib.parse import unquote, urljoin
+from typing import Dict, Optional, Tuple
+
+import requests
+
+LOGIN_PATH = "/accounts/login/"
+PREPARE_PATH = "/a/{domain}/data/export/custom/prepare_custom_export/"
+POLL_PATH = "/a/{domain}/data/export/custom/poll_custom_export_download/"
+
+# URL d'export : https://<hôte>/a/<domaine>/data/export/custom/new/<form|case>/download/<id>/
+EXPORT_URL_PATTERN = re.compile(
+    r"^(?P<base_url>https?://[^/]+)/a/(?P<domain>[^/]+)/data/export/custom/new/"
+    r"(?P<model>form|case)/download/(?P<export_id>[0-9a-fA-F]+)/?$"
+)
+
+CHUNK_SIZE = 1024 * 1024
+
+log = logging.getLogger("commcare-export-client")
+
+
+class ExportClientError(RuntimeError):
+    """Échec de connexion, de préparation ou de téléchargement d'un export."""
+
+
+def parse_export_url(export_url: str) -> Dict[str, str]:
+    """Hôte, domaine, type (form/case) et identifiant d'une URL d'EXPORT_URLS."""
+    match = EXPORT_URL_PATTERN.match(export_url)
+    if not match:
+        raise ExportClientError(f"URL d'export non reconnue : {export_url}")
+    return match.groupdict()
+
+
+def filename_from_response(response: requests.Response) -> Optional[str]:
+    """Nom du fichier annoncé par l'en-tête Content-Disposition, s'il y en a un."""
+    disposition = response.headers.get("Content-Disposition", "")
+    match = re.search(r"filename\*=(?:UTF-8'')?([^;]+)", disposition, re.IGNORECASE)
+    if match:
+        return os.path.basename(unquote(match.group(1).strip().strip('"')))
+    match = re.search(r'filename="?([^";]+)"?', disposition, re.IGNORECASE)
+    return os.path.basename(match.group(1).strip()) if match else None
+
+
+class CommCareExportClient:
+    """
+    Session HTTP authentifiée sur CommCare, capable de préparer et télécharger les exports
+
+    Args:
+        base_url: Hôte CommCare (ou celui du serveur de test)
+        session: requests.Session déjà authentifiée à réutiliser (cookies compris)
+        poll_interval: Secondes entre deux interrogations de l'état de préparation
+        timeout: Secondes accordées à la préparation d'un export
+    """
+
+    def __init__(self, base_url: str = "https://www.commcarehq.org", session: Optional[requests.Session] = None,
+                 poll_interval: float = 2.0, timeout: float = 600):
+        self.base_url = base_url.rstrip("/")
+        self.session = session or requests.Session()
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+
+    # ---------- Authentification ----------
+    def _csrf_token(self) -> str:
+        return self.session.cookies.get("csrftoken", "")
+
+    def login(self, username: str, password: str) -> None:
+        """Ouvre la session avec le formulaire de connexion (jeton CSRF compris)."""
+        login_url = self.base_url + LOGIN_PATH
+        self.session.get(login_url, timeout=30).raise_for_status()
+        response = self.session.post(
+            login_url,
+            data={
+                "csrfmiddlewaretoken": self._csrf_token(),
+                "auth-username": username.strip(),
+                "auth-password": password.strip(),
+                "login_view-current_step": "auth",
+            },
+            headers={"Referer": login_url},
+            timeout=30,
+        )
+        response.raise_for_status()
+        if LOGIN_PATH in response.url:
+            raise ExportClientError("Échec d'authentification HTTP")
+        log.info("Authentification HTTP réussie.")
+
+    def is_authenticated(self, probe_url: str) -> bool:
+        """Vérifie la session sans navigateur : la page ne doit pas renvoyer vers la connexion."""
+        try:
+            response = self.session.get(probe_url, allow_redirects=False, timeout=30)
+        except requests.RequestException:
+            return False
+        if response.is_redirect:
+            return LOGIN_PATH not in response.headers.get("Location", "")
+        return response.status_code == 200
+
+    # ---------- Export ----------
+    def prepare(self, export_url: str, start_date: str = "2021-01-01", end_date: Optional[str] = None) -> Tuple[Dict, str]:
+        """Lance la préparation d'un export ; renvoie (description de l'URL, identifiant de la tâche)."""
+        info = parse_export_url(export_url)
+        end_date = end_date or datetime.now().strftime("%Y-%m-%d")
+        response = self.session.post(
+            self.base_url + PREPARE_PATH.format(domain=info["domain"]),
+            data={
+                "form_or_case": info["model"],
+                "sms_export": "false",
+                "exports": json.dumps([{"export_id": info["export_id"]}]),
+                "form_data": json.dumps({"date_range": f"{start_date} to {end_date}"}),
+            },
+            headers={"X-CSRFToken": self._csrf_token(), "Referer": export_url},
+            timeout=60,
+        )
+        response.raise_for_status()
+        payload = response.json()
+        if not payload.get("success") or not payload.get("download_id"):
+            raise ExportClientError(f"Préparation refusée : {payload}")
+        return info, payload["download_id"]
+
+    def wait_until_ready(self, info: Dict, download_id: str) -> str:
+        """Interroge l'état de la préparation jusqu'à ce que le fichier soit prêt ; renvoie son URL."""
+        poll_url = self.base_url + POLL_PATH.format(domain=info["domain"])
+        end = time.time() + self.timeout
+        while time.time() < end:
+            response = self.session.get(
+                poll_url, params={"download_id": download_id, "form_or_case": info["model"]}, timeout=60
+            )
+            response.raise_for_status()
+            status = response.json()
+            if status.get("error"):
+                raise ExportClientError(f"Préparation en échec : {status['error']}")
+            if status.get("is_ready") and status.get("has_file") and status.get("download_url"):
+                return urljoin(self.base_url + "/", status["download_url"])
+            percent = (status.get("progress") or {}).get("percent")
+            log.info("Préparation en cours%s…", f" ({percent}%)" if percent is not None else "")
+            time.sleep(self.poll_interval)
+        raise ExportClientError(f"Préparation non terminée après {self.timeout}s")
+
+    def download(self, file_url: str, dest_dir: str, filename: Optional[str] = None) -> str:
+        """Écrit le fichier par blocs dans dest_dir ; il n'apparaît sous son nom qu'une fois complet."""
+        os.makedirs(dest_dir, exist_ok=True)
+        with self.session.get(file_url, stream=True, timeout=60) as response:
+            response.raise_for_status()
+            filename = filename or filename_from_response(response) or os.path.basename(file_url.rstrip("/"))
+            path = os.path.join(dest_dir, filename)
+            partial = path + ".part"
+            with open(partial, "wb") as f:
+                for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                    f.write(chunk)
+        os.replace(partial, path)
+        return path
+
+    def export(self, export_url: str, dest_dir: str, start_date: str = "2021-01-01", end_date: Optional[str] = None) -> str:
+        """Prépare, attend puis télécharge un export ; renvoie le chemin du fichier."""
+        info, download_id = self.prepare(export_url, start_date, end_date)
+        file_url = self.wait_until_ready(info, download_id)
+        path = self.download(file_url, dest_dir)
+        log.info("Export téléchargé par HTTP : %s (%.1f MB)", os.path.basename(path),
+                 os.path.getsize(path) / (1024 * 1024))
+        return path
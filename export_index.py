@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""
+Index des fichiers d'export d'un dossier de téléchargement
+
+Le dossier est lu une fois avec os.scandir ; chaque fichier .xlsx est rattaché
+à son export par une seule expression combinée (download_watcher.combine_patterns)
+et son stat est gardé en mémoire. L'index est ensuite tenu à jour fichier par
+fichier (add / discard) ou par un nouveau balayage qui ne traite que les noms nouveaux :
+existence, doublons et vérification deviennent des lectures de dictionnaire.
+"""
+
+import os
+import re
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from download_watcher import combine_patterns
+
+EXPORT_EXTENSION = ".xlsx"
+
+
+class ExportIndex:
+    """
+    Fichiers .xlsx d'un dossier, groupés par export
+
+    Args:
+        folder: Dossier de téléchargement
+        patterns: {base: motif compilé du nom de fichier du jour} ; sans motif,
+            les fichiers sont indexés sans être rattachés à un export
+
+    Exemple :
+        index = ExportIndex(DOWNLOAD_DIR, {b: build_pattern_with_today(b) for b in EXPECTED_BASES})
+        if index.has("household_child"):
+            ...
+    """
+
+    def __init__(self, folder: str, patterns: Optional[Dict[str, "re.Pattern"]] = None):
+        self.folder = os.path.abspath(folder)
+        self.bases = list(patterns or {})
+        self.pattern = combine_patterns(patterns) if self.bases else None
+        self.stats: Dict[str, os.stat_result] = {}
+        self.base_of: Dict[str, Optional[str]] = {}
+        self.by_base: Dict[str, List[str]] = {base: [] for base in self.bases}
+        self._lock = threading.RLock()
+        self.refresh()
+
+    # ---------- Rattachement d'un fichier à son export ----------
+    def classify(self, filename: str) -> Optional[str]:
+        """Export correspondant à un nom de fichier, ou None."""
+        match = self.pattern.match(filename) if self.pattern else None
+        return self.bases[int(match.lastgroup[1:])] if match else None
+
+    def _store(self, name: str, stat: os.stat_result) -> None:
+        if name not in self.base_of:
+            base = self.classify(name)
+            self.base_of[name] = base
+            if base is not None:
+                self.by_base[base].append(name)
+        self.stats[name] = stat
+        base = self.base_of[name]
+        if base is not None:
+            # Du plus ancien au plus récent
+            self.by_base[base].sort(key=lambda f: self.stats[f].st_mtime)
+
+    # ---------- Mise à jour ----------
+    def refresh(self, restat: bool = False) -> "ExportIndex":
+        """
+        Balaye le dossier une fois : seuls les noms nouveaux sont classés et lus (stat),
+        les fichiers disparus sont retirés. restat=True relit aussi le stat des fichiers connus.
+        """
+        os.makedirs(self.folder, exist_ok=True)
+        with self._lock:
+            seen = set()
+            with os.scandir(self.folder) as entries:
+                for entry in entries:
+                    if not entry.name.lower().endswith(EXPORT_EXTENSION) or not entry.is_file():
+                        continue
+                    seen.add(entry.name)
+                    if restat or entry.name not in self.stats:
+                        self._store(entry.name, entry.stat())
+            for name in set(self.stats) - seen:
+                self._forget(name)
+        return self
+
+    def add(self, path: str) -> Optional[str]:
+        """Indexe (ou relit) un fichier arrivé dans le dossier ; renvoie son export."""
+        name = os.path.basename(path)
+        with self._lock:
+            self._store(name, os.stat(os.path.join(self.folder, name)))
+            return self.base_of[name]
+
+    def _forget(self, name: str) -> None:
+        self.stats.pop(name, None)
+        base = self.base_of.pop(name, None)
+        if base is not None:
+            self.by_base[base].remove(name)
+
+    def discard(self, name: str) -> None:
+        """Retire un fichier supprimé ou déplacé hors du dossier."""
+        with self._lock:
+            self._forget(os.path.basename(name))
+
+    def remove(self, name: str) -> None:
+        """Supprime le fichier du disque et de l'index."""
+        name = os.path.basename(name)
+        os.remove(self.path(name))
+        self.discard(name)
+
+    # ---------- Lectures ----------
+    def path(self, name: str) -> str:
+        return os.path.join(self.folder, name)
+
+    def matches(self, base: str) -> List[str]:
+        """Fichiers du jour de l'export, du plus ancien au plus récent."""
+        with self._lock:
+            return list(self.by_base.get(base, []))
+
+    def has(self, base: str) -> bool:
+        return bool(self.by_base.get(base))
+
+    def latest(self, base: str) -> Optional[str]:
+        """Chemin du fichier le plus récent de l'export, ou None."""
+        with self._lock:
+            files = self.by_base.get(base)
+            return self.path(files[-1]) if files else None
+
+    def duplicates(self) -> Dict[str, List[str]]:
+        """{base: fichiers} pour les exports présents en plusieurs exemplaires."""
+        with self._lock:
+            return {base: list(files) for base, files in self.by_base.items() if len(files) > 1}
+
+    def files_of_day(self, day: Optional[str] = None) -> List[str]:
+        """Fichiers créés ou modifiés le jour `day` (YYYY-MM-DD, aujourd'hui par défaut), d'après le stat en cache."""
+        day = day or datetime.now().strftime("%Y-%m-%d")
+        with self._lock:
+            return [
+                name for name, st in self.stats.items()
+                if day in (datetime.fromtimestamp(st.st_ctime).strftime("%Y-%m-%d"),
+                           datetime.fromtimestamp(st.st_mtime).strftime("%Y-%m-%d"))
+            ]
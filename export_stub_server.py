@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+"""
+Serveur HTTP local qui simule les exports CommCare
+
+Reproduit le déroulé utilisé par export_client.CommCareExportClient :
+connexion (jeton CSRF puis cookie de session), préparation de l'export,
+suivi de la préparation puis téléchargement du fichier.
+Sert à faire tourner le client et les téléchargeurs hors ligne.
+
+Usage :
+    python export_stub_server.py    # démonstration complète dans un dossier temporaire
+"""
+
+import re
+import json
+import uuid
+import secrets
+import tempfile
+import threading
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from http.cookies import SimpleCookie
+from urllib.parse import parse_qs, urlparse, quote
+
+from export_client import LOGIN_PATH
+
+
+class StubCommCareServer:
+    """
+    Faux CommCare sur 127.0.0.1, démarré dans un thread
+
+    Args:
+        exports: {export_id: (nom du fichier sans la date, contenu en bytes)} ;
+            le fichier servi s'appelle "<nom> <date du jour>.xlsx", comme ceux de CommCare
+        username, password: Identifiants acceptés
+        polls_before_ready: Nombre d'interrogations répondant "en cours" avant que le fichier soit prêt
+        domain: Domaine CommCare simulé
+
+    Exemple :
+        with StubCommCareServer({"abc123": ("household_child", b"...")}) as server:
+            url = server.export_url("abc123", "case")
+    """
+
+    def __init__(self, exports, username="user@example.org", password="secret", polls_before_ready=2,
+                 domain="caris-test"):
+        self.exports = exports
+        self.username = username
+        self.password = password
+        self.polls_before_ready = polls_before_ready
+        self.domain = domain
+        self.sessions = set()
+        self.jobs = {}
+        self.lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.httpd.server_address[1]}"
+
+    def export_url(self, export_id: str, model: str = "case") -> str:
+        """URL de la page d'export, au format d'EXPORT_URLS."""
+        return f"{self.base_url}/a/{self.domain}/data/export/custom/new/{model}/download/{export_id}/"
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _cookies(self):
+                cookie = SimpleCookie(self.headers.get("Cookie", ""))
+                return {k: m.value for k, m in cookie.items()}
+
+            def _form(self):
+                length = int(self.headers.get("Content-Length", 0))
+                return {k: v[0] for k, v in parse_qs(self.rfile.read(length).decode("utf-8")).items()}
+
+            def _send(self, status, body=b"", content_type="text/html", headers=None):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _json(self, payload, status=200):
+                self._send(status, json.dumps(payload).encode("utf-8"), "application/json")
+
+            def _authenticated(self):
+                return self._cookies().get("sessionid") in server.sessions
+
+            def _redirect_login(self):
+                self._send(302, headers={"Location": LOGIN_PATH})
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                if url.path == LOGIN_PATH:
+                    token = secrets.token_hex(16)
+                    self._send(200, b"<form id='login'></form>", headers={"Set-Cookie": f"csrftoken={token}; Path=/"})
+                    return
+                if not self._authenticated():
+                    self._redirect_login()
+                    return
+                if url.path.endswith("/poll_custom_export_download/"):
+                    download_id = parse_qs(url.query).get("download_id", [""])[0]
+                    with server.lock:
+                        job = server.jobs.get(download_id)
+                        if job is None:
+                            self._json({"error": "unknown download_id"}, 404)
+                            return
+                        job["polls"] += 1
+                        ready = job["polls"] > server.polls_before_ready
+                    percent = 100 if ready else int(100 * job["polls"] / (server.polls_before_ready + 1))
+                    payload = {"is_ready": ready, "has_file": ready, "progress": {"percent": percent}}
+                    if ready:
+                        payload["download_url"] = f"/a/{server.domain}/data/export/custom/download_file/{download_id}/"
+                    self._json(payload)
+                    return
+                match = re.search(r"/download_file/([^/]+)/$", url.path)
+                if match and match.group(1) in server.jobs:
+                    name, content = server.exports[server.jobs[match.group(1)]["export_id"]]
+                    today = datetime.now().strftime("%Y-%m-%d")
+                    filename = f"{name} {today}.xlsx"
+                    self._send(200, content, "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                               {"Content-Disposition": f"attachment; filename*=UTF-8''{quote(filename)}"})
+                    return
+                if "/data/export/custom/new/" in url.path or url.path.endswith("/dashboard/"):
+                    self._send(200, b"<div id='download-export-form'></div>")
+                    return
+                self._send(404)
+
+            def do_POST(self):
+                url = urlparse(self.path)
+                form = self._form()
+                if url.path == LOGIN_PATH:
+                    if (form.get("csrfmiddlewaretoken") == self._cookies().get("csrftoken")
+                            and form.get("auth-username") == server.username
+                            and form.get("auth-password") == server.password):
+                        session_id = secrets.token_hex(16)
+                        server.sessions.add(session_id)
+                        self._send(302, headers={"Location": f"/a/{server.domain}/dashboard/",
+                                                 "Set-Cookie": f"sessionid={session_id}; Path=/"})
+                    else:
+                        self._send(200, b"<form id='login'>invalid</form>")
+                    return
+                if not self._authenticated():
+                    self._redirect_login()
+                    return
+                if url.path.endswith("/prepare_custom_export/"):
+                    if self.headers.get("X-CSRFToken") != self._cookies().get("csrftoken"):
+                        self._json({"error": "CSRF"}, 403)
+                        return
+                    export_id = json.loads(form.get("exports", "[{}]"))[0].get("export_id")
+                    if export_id not in server.exports:
+                        self._json({"success": False, "error": "unknown export"})
+                        return
+                    download_id = uuid.uuid4().hex
+                    with server.lock:
+                        server.jobs[download_id] = {"export_id": export_id, "polls": 0}
+                    self._json({"success": True, "download_id": download_id})
+                    return
+                self._send(404)
+
+            def do_HEAD(self):
+                self._send(200 if self._authenticated() else 302)
+
+        return Handler
+
+
+if __name__ == "__main__":
+    import os
+    from export_client import CommCareExportClient
+
+    with StubCommCareServer({"7d960d6c03d9d6c35a8d083c288e7c8d": ("Caris Health Agent - Enfant - Visite Enfant (created 2021-01-01)", b"x" * 3_000_000)},
+                            polls_before_ready=2) as stub:
+        client = CommCareExportClient(stub.base_url, poll_interval=0.1, timeout=10)
+        client.login(stub.username, stub.password)
+        out_dir = tempfile.mkdtemp()
+        path = client.export(stub.export_url("7d960d6c03d9d6c35a8d083c288e7c8d", "form"), out_dir)
+        print(f"{os.path.basename(path)} : {os.path.getsize(path)} octets")
@@ -0,0 +1,258 @@
+import re
+
+import numpy as np
+import pandas as pd
+
+# Exclusion rules of the mastersheet extracts, written once and used both in
+# MySQL (push_exclusions) and in pandas (apply_exclusions).
+# A rule is (column, op, value), every rule must hold for a row to be kept:
+#   'not_in'     column not in the value list (case-sensitive)
+#   'not_in_ci'  same, ignoring case
+#   'ne'         column != value (numeric)
+#   'between'    low <= column <= high (numeric), value = (low, high)
+#   'ge'         column >= value (numeric, or dates when value is a date)
+# Like the pandas filters, 'not_in', 'not_in_ci' and 'ne' keep the rows where the column is empty.
+# A column may be qualified with the alias of a subquery of the extract ('b.site')
+# when the name is ambiguous in SQL; pandas uses the part after the dot.
+
+EXCLUDED_OFFICES = ['BOM', 'PDP']
+EXCLUDED_NETWORKS = ['PIH', 'UGP', 'MSPP']
+OEV_EXCLUDED_SITES = ['PAP/CHAP', 'PAP/OBCG', 'PAP/OGRE', 'PEG/HNDP', 'PAP/SMFO', 'LEG/HSCL', 'PAP/HAHD', 'ARC/SADA']
+
+# Charges_virales_pediatriques.sql ('site' comes from both subqueries; pandas keeps
+# the first one, b.site, which is empty when the hospital is missing from the lookup)
+OEV_EXCLUSIONS = [
+    ('office', 'not_in', EXCLUDED_OFFICES),
+    ('network', 'not_in', EXCLUDED_NETWORKS),
+    ('age', 'between', (0, 17)),
+    ('b.site', 'not_in', OEV_EXCLUDED_SITES),
+    ('is_abandoned', 'ne', 1),
+]
+
+# Mastersheet PTME.sql rows kept by filter_ptme_data, completed at run time with closed_sites_rule
+PTME_EXCLUSIONS = [
+    ('office', 'not_in', EXCLUDED_OFFICES),
+    ('network', 'not_in', EXCLUDED_NETWORKS),
+    ('is_abandoned', 'ne', 1),
+]
+
+
+def closed_sites_rule(site_ferme, column='site'):
+    """Rule excluding the sites listed in sites_fermés.xlsx (column 'site')."""
+    return (column, 'not_in_ci', site_ferme['site'].dropna().tolist())
+
+
+def _compile_rule(rule, name):
+    """Return the SQL condition of one rule and its parameters."""
+    column, op, value = rule
+    if op in ('not_in', 'not_in_ci'):
+        values = [str(v).lower() for v in value] if op == 'not_in_ci' else list(value)
+        if not values:
+            return None, {}
+        params = {f"{name}_{i}": v for i, v in enumerate(values)}
+        placeholders = ", ".join(f"%({key})s" for key in params)
+        target = f"LOWER({column})" if op == 'not_in_ci' else column
+        return f"({column} IS NULL OR {target} NOT IN ({placeholders}))", params
+    if op == 'ne':
+        return f"({column} IS NULL OR {column} <> %({name})s)", {name: value}
+    if op == 'between':
+        low, high = value
+        return f"{column} BETWEEN %({name}_low)s AND %({name}_high)s", {f"{name}_low": low, f"{name}_high": high}
+    if op == 'ge':
+        return f"{column} >= %({name})s", {name: value}
+    raise ValueError(f"Unknown exclusion operator '{op}'")
+
+
+def compile_exclusions(rules):
+    """
+    Compile exclusion rules into one parameterized SQL condition
+
+    Returns:
+        tuple: (condition with pymysql %(name)s placeholders or None, parameters dict)
+    """
+    conditions = []
+    params = {}
+    for i, rule in enumerate(rules):
+        condition, rule_params = _compile_rule(rule, f"exclusion_{i}")
+        if condition is not None:
+            conditions.append(condition)
+            params.update(rule_params)
+    return ("\n    AND ".join(conditions) if conditions else None), params
+
+
+def _top_level_mask(sql):
+    """Copy of `sql` where strings, comments and parenthesized parts are blanked out."""
+    mask = list(sql)
+    depth = 0
+    i = 0
+    while i < len(sql):
+        char = sql[i]
+        if char in ("'", '"', '`'):
+            end = i + 1
+            while end < len(sql) and sql[end] != char:
+                end += 2 if sql[end] == '\\' else 1
+            mask[i:end + 1] = ' ' * (min(end, len(sql) - 1) - i + 1)
+            i = end + 1
+            continue
+        if sql.startswith('--', i) or char == '#':
+            end = sql.find('\n', i)
+            end = len(sql) if end == -1 else end
+            mask[i:end] = ' ' * (end - i)
+            i = end
+            continue
+        if sql.startswith('/*', i):
+            end = sql.find('*/', i)
+            end = len(sql) if end == -1 else end + 2
+            mask[i:end] = ' ' * (end - i)
+            i = end
+            continue
+        if char == '(':
+            depth += 1
+        if depth > 0:
+            mask[i] = ' '
+        if char == ')':
+            depth -= 1
+        i += 1
+    return ''.join(mask)
+
+
+def push_exclusions(sql, rules, params=None):
+    """
+    Add exclusion rules to the outer query of an extract
+
+    The rules are and-ed to the outer HAVING clause, or added as a new HAVING
+    clause before ORDER BY / LIMIT. HAVING (rather than a WHERE on a derived
+    table) lets the rules use the column aliases of the select list and works
+    with extracts that select duplicated column names (b.*, a.*).
+
+    Args:
+        sql (str): Text of the .sql extract
+        rules (list): Exclusion rules, see OEV_EXCLUSIONS
+        params (dict): Parameters already bound to the extract
+
+    Returns:
+        tuple: (SQL text, parameters dict) to pass to pd.read_sql_query
+    """
+    condition, rule_params = compile_exclusions(rules)
+    if condition is None:
+        return sql, params
+    sql = sql.rstrip().rstrip(';').rstrip()
+    if not params:
+        # With parameters pymysql formats the query with %: literal % must be doubled
+        sql = sql.replace('%', '%%')
+    mask = _top_level_mask(sql)
+    having = [m for m in re.finditer(r'\bHAVING\b', mask, re.IGNORECASE)]
+    start = having[-1].end() if having else 0
+    tail = re.search(r'\bORDER\s+BY\b|\bLIMIT\b', mask[start:], re.IGNORECASE)
+    tail_pos = start + tail.start() if tail else len(sql)
+    if having:
+        sql = f"{sql[:start]} ({sql[start:tail_pos].strip()})\n    AND {condition}\n{sql[tail_pos:]}"
+    else:
+        sql = f"{sql[:tail_pos].rstrip()}\nHAVING {condition}\n{sql[tail_pos:]}"
+    return sql, {**(params or {}), **rule_params}
+
+
+def rule_name(rule):
+    """Label of a rule in the exclusion reports, e.g. 'office not_in'."""
+    column, op, _ = rule
+    return f"{column.split('.')[-1]} {op}"
+
+
+def _is_date(value):
+    return isinstance(value, (str, pd.Timestamp, np.datetime64)) or hasattr(value, 'year')
+
+
+def _rule_values(df, rule):
+    """Column of a rule as compared by pandas (numbers or dates for the comparison operators)."""
+    column, op, value = rule
+    values = df[column.split('.')[-1]]
+    if op == 'ge' and _is_date(value):
+        return pd.to_datetime(values, errors='coerce')
+    if op in ('ne', 'between', 'ge'):
+        return pd.to_numeric(values, errors='coerce')
+    return values
+
+
+def rule_mask(df, rule):
+    """
+    Rows of df satisfying one rule, without copying the frame
+
+    Returns:
+        np.ndarray: Boolean mask in the row order of df
+    """
+    _, op, value = rule
+    values = _rule_values(df, rule)
+    if op == 'not_in':
+        kept = ~values.isin(value)
+    elif op == 'not_in_ci':
+        kept = ~values.str.lower().isin([str(v).lower() for v in value])
+    elif op == 'ne':
+        # Missing values are kept (NaN != value), also with nullable ints where the test gives <NA>
+        kept = (values != value).fillna(True)
+    elif op == 'between':
+        kept = values.between(*value).fillna(False)
+    elif op == 'ge':
+        kept = (values >= (pd.Timestamp(value) if _is_date(value) else value)).fillna(False)
+    else:
+        raise ValueError(f"Unknown exclusion operator '{op}'")
+    return np.asarray(kept, dtype=bool)
+
+
+def evaluate_exclusions(df, rules):
+    """
+    Evaluate every rule on the full frame and combine them into one mask
+
+    Args:
+        df (pd.DataFrame): Extract to filter
+        rules (list): Exclusion rules, see OEV_EXCLUSIONS
+
+    Returns:
+        tuple: (boolean mask of the rows kept by every rule,
+                pd.Series of the rows excluded by each rule, indexed by rule name)
+    """
+    keep = np.ones(len(df), dtype=bool)
+    excluded = {}
+    for rule in rules:
+        mask = rule_mask(df, rule)
+        name = rule_name(rule)
+        # A column may carry several rules: their counts are added up
+        excluded[name] = excluded.get(name, 0) + int((~mask).sum())
+        keep &= mask
+    return keep, pd.Series(excluded, dtype='int64', name='excluded')
+
+
+def apply_exclusions(df, rules, verbose=True, return_counts=False):
+    """
+    Evaluate exclusion rules in pandas (reference path, and check of the SQL pushdown)
+
+    The rules are evaluated on the input frame and and-ed into one mask; the
+    result is the only copy made. The counts printed for each rule are the
+    rows it excludes on its own, so a row failing two rules is counted twice.
+
+    Args:
+        df (pd.DataFrame): Extract to filter
+        rules (list): Exclusion rules, see OEV_EXCLUSIONS
+        verbose (bool): Print the number of rows excluded by each rule and the rows left
+        return_counts (bool): Also return the rows excluded by each rule, to report them
+            once when the rules run chunk by chunk (see print_exclusions)
+
+    Returns:
+        pd.DataFrame: Rows satisfying every rule; numeric rule columns are converted with pd.to_numeric
+            (pd.to_datetime for date comparisons). With return_counts, (frame, pd.Series of
+            the rows excluded by each rule, indexed by rule name)
+    """
+    keep, excluded = evaluate_exclusions(df, rules)
+    result = df[keep].copy()
+    for rule in rules:
+        if rule[1] in ('ne', 'between', 'ge'):
+            result[rule[0].split('.')[-1]] = _rule_values(result, rule)
+    if verbose:
+        print_exclusions(excluded, df.shape[0], result.shape[0])
+    return (result, excluded) if return_counts else result
+
+
+def print_exclusions(excluded, rows_in, rows_kept):
+    """Print the rows excluded by each rule and the rows left."""
+    for name, count in excluded.items():
+        print(f"Rule {name}: {count} observations excluded")
+    print(f"After all rules: {rows_kept} of {rows_in} observations kept")
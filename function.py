@@ -28,7 +28,10 @@ import pandas as pd
 from dotenv import load_dotenv
 
 # --- SQL (optionnel) ---
-from sqlalchemy import create_engine
+from sql_engine import execute_sql_query as _execute_sql_query
+from download_watcher import DownloadWatcher
+from export_index import ExportIndex
+from commcare_session import CommCareSession
 
 # --- Selenium ---
 from selenium import webdriver
@@ -45,6 +48,9 @@ from selenium.common.exceptions import TimeoutException, StaleElementReferenceEx
 # =========================
 DOWNLOAD_DIR = r"C:\Users\moise\Downloads\caris-dashboard-app\data"  # Corrigé: utilisé le bon répertoire
 ENV_FILE = "id_cc.env"  # doit contenir EMAIL / PASSWORD
+# Plage de dates des exports, la même par HTTP et dans le navigateur
+EXPORT_START_DATE = "2025-01-01"
+EXPORT_END_DATE = datetime.now().strftime("%Y-%m-%d")
 
 EXPORTS = [
     {
@@ -88,25 +94,8 @@ logging.basicConfig(
 # UTILITAIRES SQL (optionnel)
 # =========================
 def execute_sql_query(env_path: str, sql_file_path: str) -> pd.DataFrame:
-    """Exécute un fichier SQL et retourne un DataFrame."""
-    load_dotenv(env_path)
-    user = os.getenv('MYSQL_USER')
-    password = os.getenv('MYSQL_PASSWORD')
-    host = os.getenv('MYSQL_HOST')
-    db = os.getenv('MYSQL_DB')
-
-    if not all([user, password, host, db]):
-        raise RuntimeError("Variables SQL manquantes dans l'env.")
-
-    conn_text = f'mysql+pymysql://{user}:{password}@{host}/{db}'
-    engine = create_engine(conn_text)
-
-    with open(sql_file_path, 'r', encoding="utf-8") as f:
-        sql_query = f.read().replace('use caris_db;', '')
-
-    df = pd.read_sql_query(sql_query, engine)
-    engine.dispose()
-    return df
+    """Exécute un fichier SQL et retourne un DataFrame (moteur partagé, voir sql_engine.py)."""
+    return _execute_sql_query(env_path, sql_file_path)
 
 
 # =========================
@@ -140,70 +129,46 @@ def wait_for_download_complete(download_dir: str, before_files, timeout: int = 6
             except Exception as e:
                 logging.warning(f"Impossible de supprimer {crfile}: {e}")
     
-    # Attendre le nouveau téléchargement
-    last_check_time = start
-    consecutive_same_files = 0
-    
-    while True:
-        now_files = list_files(download_dir)
-        new_files = now_files - before_files
-        crdownload_files = [f for f in now_files if f.endswith(".crdownload")]
-        
-        current_time = time.time()
-        
-        # Si on a de nouveaux fichiers sans .crdownload, c'est terminé
-        if new_files and not crdownload_files:
-            latest = max(
-                (os.path.join(download_dir, f) for f in new_files if not f.endswith('.crdownload')),
-                key=lambda p: os.path.getmtime(p),
-            )
-            logging.info(f"Téléchargement terminé: {os.path.basename(latest)}")
-            return latest
-        
-        # Gestion des fichiers .crdownload qui traînent
-        if crdownload_files:
-            # Si les fichiers .crdownload n'ont pas changé pendant 2 minutes, on les supprime
-            if current_time - last_check_time > 120:
+    # Attendre le nouveau téléchargement : l'observateur signale le renommage .crdownload -> fichier final
+    with DownloadWatcher(download_dir, {}) as watcher:
+        while True:
+            remaining = timeout - (time.time() - start)
+            if remaining <= 0:
+                break
+            latest = watcher.wait_for_new(before_files, timeout=min(120, remaining))
+            if latest:
+                logging.info(f"Téléchargement terminé: {os.path.basename(latest)}")
+                return latest
+
+            # Gestion des fichiers .crdownload qui traînent (toutes les 2 minutes sans nouveau fichier)
+            crdownload_files = [f for f in list_files(download_dir) if f.endswith(".crdownload")]
+            if crdownload_files:
                 logging.warning(f"Fichiers .crdownload stagnants détectés: {crdownload_files}")
                 for crfile in crdownload_files:
                     try:
                         crpath = os.path.join(download_dir, crfile)
                         file_size = os.path.getsize(crpath)
                         logging.info(f"Taille du fichier {crfile}: {file_size} bytes")
-                        
+
                         # Si le fichier n'a pas changé de taille, le supprimer
-                        if file_size == 0 or current_time - os.path.getmtime(crpath) > 180:
+                        if file_size == 0 or time.time() - os.path.getmtime(crpath) > 180:
                             os.remove(crpath)
                             logging.info(f"Fichier .crdownload bloqué supprimé: {crfile}")
                     except Exception as e:
                         logging.warning(f"Erreur lors de la gestion de {crfile}: {e}")
-                
-                last_check_time = current_time
-        
-        # Timeout global
-        if current_time - start > timeout:
-            if crdownload_files:
-                logging.error(f"Timeout avec fichiers .crdownload persistants: {crdownload_files}")
-                # Dernier effort pour nettoyer
-                for crfile in crdownload_files:
-                    try:
-                        os.remove(os.path.join(download_dir, crfile))
-                    except:
-                        pass
-            
-            # Vérifier s'il y a quand même de nouveaux fichiers complets
-            complete_new_files = [f for f in new_files if not f.endswith('.crdownload')]
-            if complete_new_files:
-                latest = max(
-                    (os.path.join(download_dir, f) for f in complete_new_files),
-                    key=lambda p: os.path.getmtime(p),
-                )
-                logging.warning(f"Timeout mais fichier trouvé: {os.path.basename(latest)}")
-                return latest
-            
-            raise TimeoutException(f"Téléchargement trop long (> {timeout}s)")
 
-        time.sleep(5)  # Vérification toutes les 5 secondes
+    # Timeout global
+    crdownload_files = [f for f in list_files(download_dir) if f.endswith(".crdownload")]
+    if crdownload_files:
+        logging.error(f"Timeout avec fichiers .crdownload persistants: {crdownload_files}")
+        # Dernier effort pour nettoyer
+        for crfile in crdownload_files:
+            try:
+                os.remove(os.path.join(download_dir, crfile))
+            except:
+                pass
+
+    raise TimeoutException(f"Téléchargement trop long (> {timeout}s)")
 
 
 def check_files(expected_files, base_path=DOWNLOAD_DIR):
@@ -317,6 +282,14 @@ def unfreeze_interface(driver):
 
 
 def commcare_login(driver, email: str, password: str, first_export_url: str):
+    """
+    Connecte le navigateur avec la session CommCare enregistrée (voir commcare_session.py) ;
+    le formulaire n'est rempli (submit_login_form) que si cette session a expiré.
+    """
+    CommCareSession(email, password).login_driver(driver, first_export_url, form_login=submit_login_form)
+
+
+def submit_login_form(driver, email: str, password: str, first_export_url: str):
     """
     Ouvre la page d'export → redirection login → saisie credentials
     Clique sur le bouton SUBMIT du formulaire QUI CONTIENT le champ username.
@@ -360,7 +333,7 @@ def commcare_login(driver, email: str, password: str, first_export_url: str):
         raise RuntimeError(f"Échec d’authentification (toujours sur /login). Message éventuel: {err!r}")
 
 
-def set_date_range(driver, start_date="2025-01-01", end_date="2025-08-11"):
+def set_date_range(driver, start_date=EXPORT_START_DATE, end_date=EXPORT_END_DATE):
     """
     Définit la plage de dates dans le formulaire CommCare
     Gère le comportement figé du site en cliquant en dehors du champ
@@ -429,7 +402,29 @@ def set_date_range(driver, start_date="2025-01-01", end_date="2025-08-11"):
             pass
 
 
+# Session CommCare partagée par les exports HTTP du script (voir commcare_session.py)
+_commcare_session = None
+
+
+def get_commcare_session() -> CommCareSession:
+    global _commcare_session
+    if _commcare_session is None:
+        _commcare_session = CommCareSession(env_file=ENV_FILE)
+    return _commcare_session
+
+
 def trigger_and_download(driver, export_url: str) -> str:
+    """
+    Télécharge un export par HTTP (préparation, suivi, fichier en flux) ; le navigateur
+    (trigger_and_download_browser) ne prend le relais qu'en cas d'échec
+    """
+    return get_commcare_session().download_export(
+        export_url, DOWNLOAD_DIR, browser_download=lambda: trigger_and_download_browser(driver, export_url),
+        start_date=EXPORT_START_DATE, end_date=EXPORT_END_DATE,
+    )
+
+
+def trigger_and_download_browser(driver, export_url: str) -> str:
     """
     Version améliorée avec plus de diagnostics et robustesse
     """
@@ -467,7 +462,7 @@ def trigger_and_download(driver, export_url: str) -> str:
     # Définir la plage de dates avant de préparer l'export
     logging.info("📅 Définition de la plage de dates...")
     try:
-        set_date_range(driver, "2025-01-01", "2025-08-11")
+        set_date_range(driver, EXPORT_START_DATE, EXPORT_END_DATE)
     except Exception as e:
         logging.warning(f"Erreur lors de la définition des dates: {e}")
         # Continuer même si les dates ne peuvent pas être définies
@@ -664,6 +659,19 @@ def trigger_and_download(driver, export_url: str) -> str:
 # =========================
 # UTILITAIRES POUR VÉRIFICATION DES FICHIERS
 # =========================
+# Index par répertoire, partagé entre les appels (voir export_index.py)
+_export_indexes = {}
+
+
+def get_export_index(download_dir: str) -> ExportIndex:
+    """Index des .xlsx du répertoire ; chaque appel ne traite que les fichiers apparus ou disparus depuis."""
+    key = os.path.abspath(download_dir)
+    if key not in _export_indexes:
+        _export_indexes[key] = ExportIndex(key)
+        return _export_indexes[key]
+    return _export_indexes[key].refresh()
+
+
 def normalize_filename(name: str) -> str:
     """Normalise un nom de fichier pour la comparaison"""
     return re.sub(r'[^a-zA-Z0-9]', '', name.lower())
@@ -688,50 +696,40 @@ def check_file_exists_today(export_item: dict, download_dir: str) -> tuple:
             os.makedirs(download_dir, exist_ok=True)
             return False, "", f"Répertoire de téléchargement créé: {download_dir}"
         
-        # Obtenir tous les fichiers .xlsx du répertoire
-        all_files = [f for f in os.listdir(download_dir) if f.lower().endswith('.xlsx')]
+        # Index du répertoire : un seul balayage, stat lu une fois par fichier et gardé en cache
+        index = get_export_index(download_dir)
         
-        if not all_files:
+        if not index.stats:
             return False, "", f"Aucun fichier Excel trouvé dans {download_dir}"
         
         # Créer des mots-clés à partir du nom
         keywords = [word.lower() for word in re.findall(r'[a-zA-Z0-9]+', name) if len(word) > 2]
         
-        # Fichiers candidats pour cet export
+        # Exiger au moins 1 correspondance ou 50% des mots-clés
+        min_matches = max(1, len(keywords) // 2) if len(keywords) > 0 else 0
+        
+        # Fichiers candidats pour cet export, parmi les fichiers d'aujourd'hui (création OU modification)
         candidate_files = []
         
-        for file in all_files:
-            file_path = os.path.join(download_dir, file)
+        for file in index.files_of_day(today):
+            # Vérifier si le fichier correspond aux mots-clés
             file_normalized = normalize_filename(file)
+            match_count = sum(1 for keyword in keywords if keyword in file_normalized)
             
-            # Vérifier la date de création ET modification
-            file_creation_time = datetime.fromtimestamp(os.path.getctime(file_path))
-            file_modification_time = datetime.fromtimestamp(os.path.getmtime(file_path))
-            
-            file_creation_date = file_creation_time.strftime("%Y-%m-%d")
-            file_modification_date = file_modification_time.strftime("%Y-%m-%d")
-            
-            # Fichier d'aujourd'hui
-            is_today_file = (file_creation_date == today) or (file_modification_date == today)
-            
-            if is_today_file:
-                # Vérifier si le fichier correspond aux mots-clés
-                match_count = sum(1 for keyword in keywords if keyword in file_normalized)
-                
-                # Exiger au moins 1 correspondance ou 50% des mots-clés
-                min_matches = max(1, len(keywords) // 2) if len(keywords) > 0 else 0
-                
-                if match_count >= min_matches:
-                    candidate_files.append({
-                        'path': file_path,
-                        'name': file,
-                        'creation_date': file_creation_date,
-                        'modification_date': file_modification_date,
-                        'creation_time': file_creation_time,
-                        'modification_time': file_modification_time,
-                        'match_count': match_count,
-                        'file_size': os.path.getsize(file_path)
-                    })
+            if match_count >= min_matches:
+                st = index.stats[file]
+                file_creation_time = datetime.fromtimestamp(st.st_ctime)
+                file_modification_time = datetime.fromtimestamp(st.st_mtime)
+                candidate_files.append({
+                    'path': index.path(file),
+                    'name': file,
+                    'creation_date': file_creation_time.strftime("%Y-%m-%d"),
+                    'modification_date': file_modification_time.strftime("%Y-%m-%d"),
+                    'creation_time': file_creation_time,
+                    'modification_time': file_modification_time,
+                    'match_count': match_count,
+                    'file_size': st.st_size
+                })
         
         if not candidate_files:
             return False, "", f"Aucun fichier d'aujourd'hui trouvé pour '{name}'"
@@ -18,11 +18,14 @@ from webdriver_manager.chrome import ChromeDriverManager
 import time
 import os
 from dotenv import load_dotenv
+from commcare_session import CommCareSession
 
 #Connecting to Commcare
 load_dotenv('id_cc.env')
 email = os.getenv('EMAIL')
 password_cc = os.getenv('PASSWORD')
+# One session for the HTTP exports and the browser: at most one login
+commcare_session = CommCareSession(email, password_cc)
 
 # Set download directory
 download_dir = os.path.join(os.getcwd(), "downloads")
@@ -42,21 +45,28 @@ driver = webdriver.Chrome(options=options)
 driver.implicitly_wait(10)
 wait = WebDriverWait(driver, 30)
 
-def login_to_commcare():
-    """Login to CommCare once and reuse session"""
+def login_to_commcare(url):
+    """Log in with the saved CommCare session (commcare_session.py); the form is only used once it has expired"""
     try:
-        driver.find_element(By.XPATH, '//*[@id="id_auth-username"]').send_keys(email)
-        driver.find_element(By.XPATH, '//*[@id="id_auth-password"]').send_keys(password_cc)
-        driver.find_element(By.CSS_SELECTOR, 'button[type=submit]').click()
-        # Wait for login to complete
-        wait.until(EC.presence_of_element_located((By.TAG_NAME, "body")))
-        time.sleep(2)
+        commcare_session.login_driver(driver, url)
         print("Successfully logged in to CommCare")
     except Exception as e:
         print(f"Login failed: {e}")
 
-def download_file(download_name):
-    """Generic function to download files from CommCare"""
+def download_file(download_name, url):
+    """Download an export over HTTP, with the browser as fallback"""
+    try:
+        path = commcare_session.download_export(
+            url, download_dir, browser_download=lambda: download_file_browser(download_name, url))
+        if path:
+            print(f"Download completed for {download_name}: {os.path.basename(path)}")
+    except Exception as e:
+        print(f"Download failed for {download_name}: {e}")
+
+def download_file_browser(download_name, url):
+    """Generic function to download files from CommCare in the browser"""
+    # Login if not already logged in
+    login_to_commcare(url)
     try:
         # Click download button
         download_btn = wait.until(EC.element_to_be_clickable((By.XPATH, '//*[@id="download-export-form"]/form/div[2]/div/div[2]/div[1]/button/span[1]')))
@@ -78,13 +88,8 @@ def download_file(download_name):
 def commcare_household():
     """Download household count data"""
     try:
-        driver.get('https://www.commcarehq.org/a/caris-test/data/export/custom/new/form/download/091321e0524e3ae7f5d5c1d3f43dccca/')
-        
-        # Login if not already logged in
-        if "login" in driver.current_url.lower():
-            login_to_commcare()
-        
-        download_file("Household count")
+        url = 'https://www.commcarehq.org/a/caris-test/data/export/custom/new/form/download/091321e0524e3ae7f5d5c1d3f43dccca/'
+        download_file("Household count", url)
         
     except Exception as e:
         print(f"Error in commcare_household: {e}")
@@ -92,9 +97,8 @@ def commcare_household():
 def commcare_all_gardens():
     """Download all gardens data"""
     try:
-        driver.get('https://www.commcarehq.org/a/caris-test/data/export/custom/new/case/download/789629a97bddd10b4648d5138d17908e/')
-        
-        download_file("All gardens")
+        url = 'https://www.commcarehq.org/a/caris-test/data/export/custom/new/case/download/789629a97bddd10b4648d5138d17908e/'
+        download_file("All gardens", url)
         
     except Exception as e:
         print(f"Error in commcare_all_gardens: {e}")
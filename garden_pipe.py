@@ -5,6 +5,8 @@ import pandas as pd
 import os
 from datetime import datetime
 
+from export_cache import read_excel_cached
+
 def main():
     # Étape 1 : Définir le nom du fichier
     today_str = datetime.today().strftime('%Y-%m-%d')
@@ -16,7 +18,7 @@ def main():
         return
 
     # Étape 3 : Lecture du fichier Garden
-    df = pd.read_excel(garden_path)
+    df = read_excel_cached(garden_path)
 
     # Étape 4 : Renommer la colonne info.owner_name en username
     if 'info.owner_name' in df.columns:
@@ -30,7 +32,7 @@ def main():
         print("❌ Fichier site_info.xlsx introuvable dans le répertoire courant.")
         return
 
-    infos = pd.read_excel('site_info.xlsx', usecols=['site', 'status', 'network', 'commune', 'departement', 'office'])
+    infos = read_excel_cached('site_info.xlsx', usecols=['site', 'status', 'network', 'commune', 'departement', 'office'])
     infos['site'] = infos['site'].astype(str).str.strip()
 
     # Étape 6 : Nettoyage et préparation de df['site']
@@ -7,8 +7,13 @@ from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 
+from commcare_session import CommCareSession
+
+# Dossier où Chrome dépose les exports (dossier de téléchargement par défaut)
+DOWNLOAD_DIR = os.path.join(os.path.expanduser("~"), "Downloads")
+
 # Fonction générique pour lancer un export depuis une URL CommCare
-def download_commcare_export(export_url, email, password):
+def download_commcare_export(export_url, session):
     try:
         options = Options()
         options.add_argument("start-maximized")
@@ -16,11 +21,8 @@ def download_commcare_export(export_url, email, password):
         driver.implicitly_wait(10)
         wait = WebDriverWait(driver, 120)
 
-        # Accéder à la page d'exportation et se connecter
-        driver.get(export_url)
-        wait.until(EC.presence_of_element_located((By.ID, "id_auth-username"))).send_keys(email)
-        driver.find_element(By.ID, "id_auth-password").send_keys(password)
-        driver.find_element(By.CSS_SELECTOR, 'button[type=submit]').click()
+        # Accéder à la page d'exportation, connecté avec la session enregistrée
+        session.login_driver(driver, export_url)
 
         # Cliquer sur "Prepare export"
         prepare_btn_xpath = '//*[@id="download-export-form"]/form/div[2]/div/div[2]/div[1]/button'
@@ -58,8 +60,23 @@ def get_commcare_case():
         'https://www.commcarehq.org/a/caris-test/data/export/custom/new/form/download/9b22af972e065eda11f311ac0a1586e5/'
     ]
 
+    # Téléchargement par HTTP (session enregistrée, connexion seulement si elle a expiré), navigateur en repli
+    session = CommCareSession(email, password)
+    try:
+        client = session.export_client()
+    except Exception as e:
+        print(f"⚠️ Connexion HTTP impossible ({e}), téléchargement par le navigateur.")
+        client = None
+
     for url in export_urls:
-        download_commcare_export(url, email, password)
+        if client is not None:
+            try:
+                client.export(url, DOWNLOAD_DIR)
+                print(f"✅ Téléchargement HTTP depuis {url[:60]}... réussi.")
+                continue
+            except Exception as e:
+                print(f"⚠️ Export HTTP échoué pour {url[:60]}... : {e}")
+        download_commcare_export(url, session)
 
 # Exécution
 if __name__ == "__main__":
@@ -7,6 +7,8 @@ from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 
+from commcare_session import CommCareSession
+
 
 # Charger les identifiants
 load_dotenv('id_cc.env')
@@ -23,12 +25,10 @@ wait = WebDriverWait(driver, 120)
 
 # Fonction de connexion
 def commcare_login():
-    driver.get(
-        'https://www.commcarehq.org/a/caris-test/data/export/custom/new/case/download/3eb9f92d8d82501ebe5c8cb89b83dbba/'
+    # Session enregistrée réutilisée ; formulaire seulement si elle a expiré
+    CommCareSession(email, password_cc).login_driver(
+        driver, 'https://www.commcarehq.org/a/caris-test/data/export/custom/new/case/download/3eb9f92d8d82501ebe5c8cb89b83dbba/'
     )
-    wait.until(EC.presence_of_element_located((By.ID, "id_auth-username"))).send_keys(email)
-    driver.find_element(By.ID, "id_auth-password").send_keys(password_cc)
-    driver.find_element(By.CSS_SELECTOR, 'button[type=submit]').click()
 
 # Connexion
 commcare_login()
@@ -27,8 +27,11 @@ from webdriver_manager.chrome import ChromeDriverManager
 from dotenv import load_dotenv
 # import functions
 from utils import get_commcare_odata
+from download_watcher import DownloadWatcher
 # Download charges virales database from "Charges_virales_pediatriques.sql file"
 from caris_fonctions import execute_sql_query
+from export_cache import load_export, read_excel_cached
+from commcare_session import CommCareSession
 
 from datetime import date
 import pandas as pd
@@ -73,6 +76,11 @@ warnings.filterwarnings('ignore')
 load_dotenv("id_cc.env")
 EMAIL = os.getenv("EMAIL")
 PASSWORD = os.getenv("PASSWORD")
+# Une session pour les deux navigateurs du script : une connexion au plus
+commcare_session = CommCareSession(EMAIL, PASSWORD)
+
+# Dossier de téléchargement par défaut de Chrome, utilisé aussi par les exports HTTP
+DOWNLOAD_DIR = os.path.join(os.path.expanduser("~"), "Downloads")
 
 # Configuration du navigateur (sans dossier de téléchargement personnalisé)
 options = Options()
@@ -100,20 +108,20 @@ DOWNLOAD_LINKS = [
     }
 ]
 
-# 🔐 Connexion à CommCare
-def login_to_commcare():
-    print("🔐 Connexion à CommCare...")
-    driver.get(DOWNLOAD_LINKS[0]["url"])
-    WebDriverWait(driver, 30).until(EC.presence_of_element_located((By.ID, "id_auth-username")))
-    driver.find_element(By.ID, "id_auth-username").send_keys(EMAIL)
-    driver.find_element(By.ID, "id_auth-password").send_keys(PASSWORD)
-    driver.find_element(By.CSS_SELECTOR, 'button[type=submit]').click()
-    print("✅ Connexion réussie.")
-
-# 📥 Téléchargement d’un export CommCare
+# 📥 Téléchargement d’un export CommCare : par HTTP, le navigateur en repli
 def download_file(url, name):
     print(f"\n📄 Téléchargement de « {name} »...")
-    driver.get(url)
+    try:
+        path = commcare_session.download_export(url, DOWNLOAD_DIR, browser_download=lambda: download_file_browser(url))
+    except Exception as e:
+        print(f"❌ Échec du téléchargement : {e}")
+        return
+    if path:
+        print(f"✅ Fichier téléchargé par HTTP : {os.path.basename(path)}")
+
+def download_file_browser(url):
+    # Session enregistrée installée dans le navigateur ; formulaire seulement si elle a expiré
+    commcare_session.login_driver(driver, url)
 
     try:
         WebDriverWait(driver, 200).until(
@@ -136,8 +144,7 @@ def download_file(url, name):
 
 # 🧠 Fonction principale
 def main():
-    login_to_commcare()
-    
+    # Le navigateur ne se connecte (download_file_browser) que si un export HTTP échoue
     for doc in DOWNLOAD_LINKS:
         download_file(doc["url"], doc["name"])
 
@@ -168,11 +175,7 @@ driver.implicitly_wait(10)
 
 # === Login CommCare ===
 def commcare_login():
-    driver.get('https://www.commcarehq.org/a/caris-test/data/export/custom/new/case/download/f831c9c92760a38d24b3829df5621d20/')
-    WebDriverWait(driver, 90).until(EC.presence_of_element_located((By.ID, "id_auth-username")))
-    driver.find_element(By.ID, "id_auth-username").send_keys(email)
-    driver.find_element(By.ID, "id_auth-password").send_keys(password_cc)
-    driver.find_element(By.CSS_SELECTOR, 'button[type=submit]').click()
+    commcare_session.login_driver(driver, 'https://www.commcarehq.org/a/caris-test/data/export/custom/new/case/download/f831c9c92760a38d24b3829df5621d20/')
 
 commcare_login()
 
@@ -181,29 +184,36 @@ WebDriverWait(driver, 500).until(EC.element_to_be_clickable(
     (By.XPATH, '//*[@id="download-export-form"]/form/div[2]/div/div[2]/div[1]/button'))).click()
 
 # === Cliquer sur le lien de téléchargement ===
+# Observateur démarré avant le clic : aucun fichier terminé ne peut lui échapper
+before_files = set(os.listdir(download_dir))
+watcher = DownloadWatcher(download_dir, {}).start()
 WebDriverWait(driver, 2000).until(EC.element_to_be_clickable(
     (By.XPATH, '//*[@id="download-progress"]/div/div/div[2]/div[1]/form/a'))).click()
 
 # === Attendre que le fichier apparaisse complètement dans le dossier ===
-def wait_for_download(folder, extension, timeout):
-    seconds = 0
-    while seconds < timeout:
-        files = glob.glob(os.path.join(folder, f"*{extension}"))
-        if files:
-            if not any(f.endswith(".crdownload") or f.endswith(".part") for f in files):
-                print("✅ Téléchargement terminé :", os.path.basename(files[0]))
-                return
-        time.sleep(10)
-        seconds += 10
+def wait_for_download(watcher, before_files, extension, timeout):
+    end = time.time() + timeout
+    while time.time() < end:
+        path = watcher.wait_for_new(before_files, timeout=end - time.time())
+        if path is None:
+            break
+        if path.endswith(extension):
+            print("✅ Téléchargement terminé :", os.path.basename(path))
+            return path
+        # Autre fichier terminé entre-temps : on continue d'attendre le bon
+        before_files = before_files | {os.path.basename(path)}
     raise TimeoutError("⏰ Temps d'attente dépassé pour le téléchargement.")
 
-wait_for_download(download_dir, expected_extension, wait_timeout)
+try:
+    wait_for_download(watcher, before_files, expected_extension, wait_timeout)
+finally:
+    watcher.stop()
 #=================================== PHASE III ==============================
-muso_group = pd.read_excel(f"~/Downloads/muso_groupes (created 2025-03-25) {str(datetime.today().strftime('%Y-%m-%d'))}.xlsx", parse_dates = True)
-muso_ben = pd.read_excel(f"~/Downloads/muso_beneficiaries (created 2025-03-25) {str(datetime.today().strftime('%Y-%m-%d'))}.xlsx", parse_dates = True)
-muso_household = pd.read_excel(f"~/Downloads/muso_household_2022 (created 2025-03-25) {str(datetime.today().strftime('%Y-%m-%d'))}.xlsx", parse_dates = True)
-muso_ppi = pd.read_excel(f"~/Downloads/MUSO - Members - PPI Questionnaires (created 2025-04-23) {str(datetime.today().strftime('%Y-%m-%d'))}.xlsx", parse_dates = True)
-muso_actif = pd.read_excel(f"./group_muso_actif.xlsx", parse_dates = True)
+muso_group = load_export("muso_groupes (created 2025-03-25)", export_dir="~/Downloads", parse_dates = True)
+muso_ben = load_export("muso_beneficiaries (created 2025-03-25)", export_dir="~/Downloads", parse_dates = True)
+muso_household = load_export("muso_household_2022 (created 2025-03-25)", export_dir="~/Downloads", parse_dates = True)
+muso_ppi = load_export("MUSO - Members - PPI Questionnaires (created 2025-04-23)", export_dir="~/Downloads", parse_dates = True)
+muso_actif = read_excel_cached("./group_muso_actif.xlsx", parse_dates = True)
 
 # Ensure both DataFrames have the 'caseid' column and drop NA values before filtering
 if 'caseid' in muso_actif.columns and 'caseid' in muso_group.columns:
@@ -29,6 +29,8 @@ from dotenv import load_dotenv
 from utils import get_commcare_odata
 # Download charges virales database from "Charges_virales_pediatriques.sql file"
 from caris_fonctions import execute_sql_query
+from export_cache import load_export, read_excel_cached
+from commcare_session import CommCareSession
 
 # Load environment variables from .env file
 load_dotenv('dot.env')
@@ -70,11 +72,8 @@ DOWNLOAD_LINKS = [
 # 🔐 Connexion à CommCare
 def login_to_commcare():
     print("🔐 Connexion à CommCare...")
-    driver.get(DOWNLOAD_LINKS[0]["url"])
-    WebDriverWait(driver, 30).until(EC.presence_of_element_located((By.ID, "id_auth-username")))
-    driver.find_element(By.ID, "id_auth-username").send_keys(EMAIL)
-    driver.find_element(By.ID, "id_auth-password").send_keys(PASSWORD)
-    driver.find_element(By.CSS_SELECTOR, 'button[type=submit]').click()
+    # Session enregistrée réutilisée ; formulaire seulement si elle a expiré
+    CommCareSession(EMAIL, PASSWORD).login_driver(driver, DOWNLOAD_LINKS[0]["url"])
     print("✅ Connexion réussie.")
 
 # 📥 Téléchargement d’un export CommCare
@@ -118,47 +117,34 @@ if __name__ == "__main__":
 
 # In[2]:
 from utils import get_commcare_odata
-from ptme_fonction import creer_colonne_match_conditional
+from odata_sync import ODATA_STORE_DIR, FEED_COLUMNS, stream_commcare_odata_to_parquet
+from membership import flag_membership
+from extract_filters import PTME_EXCLUSIONS, apply_exclusions, closed_sites_rule
 # In[3]:
 
 def filter_ptme_data(
     df,
-    excluded_offices=['BOM', 'PDP'],
-    excluded_networks=['PIH', 'UGP', 'MSPP'],
+    exclusions=PTME_EXCLUSIONS,
     excluded_site=['GON/CSAR'],# à ajouter dans la base de données des sites fermés
     excluded_term=['Miscarriage'], # Exclude specific termination reasons
-    abandoned_flag=1,
     next_appointment_start='2025-05-01',
-    output_file='filtered_df2.xlsx'):
+    output_file=None):
     print(f"Initial dataset has {df.shape[0]} observations")
 
-    # Exclude specified offices
-    df = df[~df['office'].isin(excluded_offices)]
-    print(f"After excluding offices: {df.shape[0]} observations")
-
-    # Exclude specified networks
-    df = df[~df['network'].isin(excluded_networks)]
-    print(f"After excluding networks: {df.shape[0]} observations")
-    
-    # Exclude specified networks
-    df = df[~df['network'].isin(excluded_site)]
-    print(f"After excluding networks: {df.shape[0]} observations")
-    
-    # Exclude specified networks
-    df = df[~df['network'].isin(excluded_term)]
-    print(f"After excluding networks: {df.shape[0]} observations")
-
-    # Convert 'is_abandoned' to numeric and exclude abandoned
-    df['is_abandoned'] = pd.to_numeric(df['is_abandoned'], errors='coerce')
-    df = df[df['is_abandoned'] != abandoned_flag]
-    print(f"After excluding abandoned: {df.shape[0]} observations")
-
-    df = df[~df['site'].str.lower().isin(site_ferme['site'].str.lower())]
+    # Exclusion rules shared with the SQL extracts (extract_filters.PTME_EXCLUSIONS)
+    rules = list(exclusions) + [
+        # excluded_site and excluded_term are checked against 'network', as before
+        ('network', 'not_in', excluded_site),
+        ('network', 'not_in', excluded_term),
+        closed_sites_rule(site_ferme),
+    ]
+    # Un seul masque combiné, nombre d'exclusions affiché par règle
+    df = apply_exclusions(df, rules)
     df['site'] = df['site'].str.upper()
-    print(f"After excluding closed site: {df.shape[0]} observations")
-    # Export to Excel
-    df.to_excel(output_file, index=False)
-    print(f"Filtered data exported to {output_file}")
+    # Export Excel facultatif, une fois le filtrage terminé
+    if output_file:
+        df.to_excel(output_file, index=False)
+        print(f"Filtered data exported to {output_file}")
 
     return df
 
@@ -171,9 +157,11 @@ pregnancy_url ='https://www.commcarehq.org/a/caris-test/api/odata/cases/v1/8d0dd
 auth = (os.getenv('CC_USERNAME'), os.getenv('CC_PASSWORD'))
 # Define parameters to filter inactive, non-graduated groups
 params = {}
-pregnancy_woman = get_commcare_odata(pregnancy_url, auth, params)
-pregnancy_woman = pd.DataFrame(pregnancy_woman)
-pregnancy_woman.columns = [col.replace(' ', '_') for col in pregnancy_woman.columns]
+# Pages written to disk as they arrive, then only the columns used below are loaded
+pregnancy_feed = stream_commcare_odata_to_parquet(pregnancy_url, auth, params,
+                                                  os.path.join(ODATA_STORE_DIR, 'oev_pregnancy.parquet'),
+                                                  columns=FEED_COLUMNS['pregnancy'])
+pregnancy_woman = pregnancy_feed.to_table(columns=FEED_COLUMNS['pregnancy']).to_pandas()
 print(f'This Household dataset has {pregnancy_woman.shape[0]} observations')
 pregnancy_woman.head(2)
 
@@ -218,11 +206,15 @@ pregnancy.shape[0]
 
 
 # Download charges virales database from "Charges_virales_pediatriques.sql file"
-from caris_fonctions import execute_sql_query
+# Les deux extractions PTME sont indépendantes : elles tournent en parallèle
+from sql_engine import run_sql_files
 env_path = 'dot.env'
-sql_file_path = './PTME_Enceinte.sql'
 
-ptme_enceinte = execute_sql_query(env_path, sql_file_path)
+# Résultats mis en cache pour la journée : les relances du jour n'interrogent plus MySQL
+extracts = run_sql_files(env_path, ['./PTME_Enceinte.sql', './Mastersheet PTME.sql'], use_cache=True)
+ptme_enceinte = extracts['./PTME_Enceinte.sql']
+ptme = extracts['./Mastersheet PTME.sql']
+
 duplicates = ptme_enceinte.columns[ptme_enceinte.columns.duplicated()].tolist()
 if duplicates:
     print("Attention : des colonnes en double ont été trouvées dans le DataFrame.")
@@ -238,10 +230,6 @@ print(ptme_enceinte.head(2))
 # In[7]:
 
 
-env_path = 'dot.env'
-sql_file_path = './Mastersheet PTME.sql'
-
-ptme = execute_sql_query(env_path, sql_file_path)
 duplicates = ptme.columns[ptme.columns.duplicated()].tolist()
 if duplicates:
     print("Attention : des colonnes en double ont été trouvées dans le DataFrame.")
@@ -280,7 +268,7 @@ delinquency.to_excel("delinquency.xlsx", index=False)
 
 
 mapping_p = {'both': 'yes', 'left_only': 'no'}
-woman_in_ptme = creer_colonne_match_conditional(ptme_enceinte, ptme, on='patient_code', nouvelle_colonne='woman_found', mapping=mapping_p).drop_duplicates('patient_code', keep = 'first')
+woman_in_ptme = flag_membership(ptme_enceinte, ptme, on='patient_code', nouvelle_colonne='woman_found', mapping=mapping_p).drop_duplicates('patient_code', keep = 'first')
 woman_in_ptme.shape[0]
 print(woman_in_ptme['woman_found'].value_counts())
 woman_ptme = woman_in_ptme[woman_in_ptme['woman_found']=="yes"]
@@ -293,7 +281,7 @@ print(f"{woman_not_ptme.shape[0]} femmes à retrouver")
 # In[9]:
 
 
-site_ferme = pd.read_excel('sites_fermés.xlsx', engine='openpyxl')
+site_ferme = read_excel_cached('sites_fermés.xlsx', engine='openpyxl')
 # Ensure 'site' column is in uppercase for consistency
 site_ferme.rename(columns={'site_code': 'site'}, inplace=True)
 site_ferme['site'] = site_ferme['site'].str.upper()
@@ -305,7 +293,7 @@ ptme_enceinte['patient_code'] = ptme_enceinte['patient_code'].str.upper()
 # In[10]:
 
 
-ptme_enceinte = filter_ptme_data(ptme_enceinte)
+ptme_enceinte = filter_ptme_data(ptme_enceinte, output_file='filtered_df2.xlsx')
 
 delinquency = filter_ptme_data(delinquency)
 delinquency.to_excel("delinquency.xlsx",index=True)
@@ -358,8 +346,7 @@ ptme_not_in_club.to_excel('ptme_not_in_club.xlsx', index=False)
 # file_path_patient = first_part + 'PTME WITH PATIENT CODE ' + datetime.now().strftime("%Y-%m-%d") + ".xlsx"
     # Étape 2 : Charger le fichier téléchargé
 today_str = datetime.today().strftime('%Y-%m-%d')
-path = f"~/Downloads/PTME WITH PATIENT CODE {today_str}.xlsx"
-caseid = pd.read_excel(os.path.expanduser(path))
+caseid = load_export("PTME WITH PATIENT CODE", today_str, export_dir="~/Downloads")
 caseid = caseid.rename(columns={
     'caseid': 'case_id',
     'health_id': 'patient_code'
@@ -468,7 +455,7 @@ ptme_enceinte_merge.to_excel('ptme_enceinte_merge.xlsx', index=False)
 
 
 mapping_p = {'both': 'no', 'left_only': 'yes'}
-comptage = creer_colonne_match_conditional(pregnancy, woman_in_club, on='patient_code', nouvelle_colonne='menage', mapping=mapping_p).drop_duplicates('patient_code', keep = 'first')
+comptage = flag_membership(pregnancy, woman_in_club, on='patient_code', nouvelle_colonne='menage', mapping=mapping_p).drop_duplicates('patient_code', keep = 'first')
 comptage.shape[0]
 print(comptage['menage'].value_counts())
 ptme_comptage_yes = comptage[comptage['menage']=="yes"]
@@ -484,9 +471,10 @@ hh_ptme_url ='https://www.commcarehq.org/a/caris-test/api/odata/cases/v1/ee225c4
 auth = (os.getenv('CC_USERNAME'), os.getenv('CC_PASSWORD'))
 # Define parameters to filter inactive, non-graduated groups
 params = {}
-hh_ptme = get_commcare_odata(hh_ptme_url, auth, params)
-hh_ptme = pd.DataFrame(hh_ptme)
-hh_ptme.columns = [col.replace(' ', '_') for col in hh_ptme.columns]
+hh_ptme_feed = stream_commcare_odata_to_parquet(hh_ptme_url, auth, params,
+                                                os.path.join(ODATA_STORE_DIR, 'oev_hh_ptme.parquet'),
+                                                columns=FEED_COLUMNS['hh_ptme'])
+hh_ptme = hh_ptme_feed.to_table(columns=FEED_COLUMNS['hh_ptme']).to_pandas()
 print(f'This Household dataset has {hh_ptme.shape[0]} observations')
 hh_ptme.head(2)
 
@@ -25,6 +25,7 @@ print("="*50)
 from function import download_files
 import pandas as pd
 from datetime import datetime
+from export_cache import load_export
 
 # Vérification des fichiers attendus avant téléchargement
 today_date = datetime.today().date().strftime('%Y-%m-%d')
@@ -72,14 +73,14 @@ try:
     print("📊 Chargement des fichiers de données...")
     
     # Import dial dataset
-    Apel_ptme = pd.read_excel(f"{base_path}/Caris Health Agent - Femme PMTE  - APPELS PTME (created 2025-02-13) {today_date}.xlsx", parse_dates=True)
-    Apel_oev = pd.read_excel(f"{base_path}/Caris Health Agent - Enfant - APPELS OEV (created 2025-01-08) {today_date}.xlsx", parse_dates=True)
+    Apel_ptme = load_export("Caris Health Agent - Femme PMTE  - APPELS PTME (created 2025-02-13)", today_date, export_dir=base_path, parse_dates=True)
+    Apel_oev = load_export("Caris Health Agent - Enfant - APPELS OEV (created 2025-01-08)", today_date, export_dir=base_path, parse_dates=True)
     
     # Import visit dataset
-    Visite_ptme = pd.read_excel(f"{base_path}/Caris Health Agent - Femme PMTE  - Visite PTME (created 2025-02-13) {today_date}.xlsx", parse_dates=True)
-    Ration_ptme = pd.read_excel(f"{base_path}/Caris Health Agent - Femme PMTE  - Ration & Autres Visites (created 2025-02-18) {today_date}.xlsx", parse_dates=True)
-    Ration_oev = pd.read_excel(f"{base_path}/Caris Health Agent - Enfant - Ration et autres visites (created 2022-08-29) {today_date}.xlsx", parse_dates=True)
-    oev_visite = pd.read_excel(f"{base_path}/Caris Health Agent - Enfant - Visite Enfant (created 2025-07-30) {today_date}.xlsx", parse_dates=True)
+    Visite_ptme = load_export("Caris Health Agent - Femme PMTE  - Visite PTME (created 2025-02-13)", today_date, export_dir=base_path, parse_dates=True)
+    Ration_ptme = load_export("Caris Health Agent - Femme PMTE  - Ration & Autres Visites (created 2025-02-18)", today_date, export_dir=base_path, parse_dates=True)
+    Ration_oev = load_export("Caris Health Agent - Enfant - Ration et autres visites (created 2022-08-29)", today_date, export_dir=base_path, parse_dates=True)
+    oev_visite = load_export("Caris Health Agent - Enfant - Visite Enfant (created 2025-07-30)", today_date, export_dir=base_path, parse_dates=True)
     
     print("✅ Tous les fichiers ont été chargés avec succès!")
     print(f"📈 Nombre d'enregistrements:")
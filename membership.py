@@ -0,0 +1,148 @@
+import numpy as np
+import pandas as pd
+
+
+def _keys(series, case_insensitive=False):
+    """Join keys of a column, lowercased when the match ignores case."""
+    return series.str.lower() if case_insensitive else series
+
+
+def is_member(left, right, case_insensitive=False):
+    """
+    Boolean mask: which values of `left` appear in `right`
+
+    The keys of `right` are hashed once; `left` is scanned once. No row is
+    copied or multiplied, whatever the duplicates on either side.
+
+    Args:
+        left (pd.Series): Keys to test
+        right (pd.Series): Reference keys
+        case_insensitive (bool): Compare lowercased keys (text columns)
+
+    Returns:
+        pd.Series: Boolean mask aligned on left
+    """
+    right_keys = pd.Index(_keys(right, case_insensitive).unique())
+    return _keys(left, case_insensitive).isin(right_keys)
+
+
+def semi_join(df1, df2, on, case_insensitive=False):
+    """Rows of df1 whose `on` key appears in df2 (columns of df1 only)."""
+    return df1[is_member(df1[on], df2[on], case_insensitive)]
+
+
+def anti_join(df1, df2, on, case_insensitive=False):
+    """Rows of df1 whose `on` key does not appear in df2 (columns of df1 only)."""
+    return df1[~is_member(df1[on], df2[on], case_insensitive)]
+
+
+def flag_membership(df1, df2, on, nouvelle_colonne, mapping=None, case_insensitive=False, columns=None):
+    """
+    Add a yes/no column telling whether each row of df1 has a match in df2
+
+    Replaces creer_colonne_match_conditional: same mapping, but df1 keeps its
+    rows (no duplication when df2 repeats a key) and gets no column of df2
+    unless asked for in `columns`.
+
+    Args:
+        df1 (pd.DataFrame): Rows to flag
+        df2 (pd.DataFrame): Reference rows
+        on (str): Key column, present in both frames
+        nouvelle_colonne (str): Name of the flag column
+        mapping (dict): Values for matched ('both') and unmatched ('left_only') rows,
+            {'both': 'yes', 'left_only': 'no'} by default
+        case_insensitive (bool): Compare lowercased keys
+        columns (list): Columns of df2 to bring along, taken from the first df2 row of each key
+
+    Returns:
+        pd.DataFrame: Copy of df1 with the flag (and the requested columns)
+    """
+    if mapping is None:
+        mapping = {'both': 'yes', 'left_only': 'no'}
+    result = df1.copy()
+    matched = is_member(df1[on], df2[on], case_insensitive)
+    result[nouvelle_colonne] = matched.map({True: mapping['both'], False: mapping['left_only']})
+    if columns:
+        lookup = df2.assign(_key=_keys(df2[on], case_insensitive)).drop_duplicates('_key').set_index('_key')
+        left_keys = _keys(df1[on], case_insensitive)
+        for col in columns:
+            result[col] = left_keys.map(lookup[col])
+    return result
+
+
+def normalize_patient_code(series):
+    """
+    Canonical form of patient codes, used as join key between sources
+
+    Case is ignored, surrounding whitespace is removed, inner whitespace runs
+    become one space, and '\\' or spaces around a '/' separator are read as '/'
+    ('PAP/HFSC 00371', ' pap / hfsc  00371' and 'PAP\\HFSC 00371' give the same key).
+
+    Args:
+        series (pd.Series): Raw codes (text or numbers)
+
+    Returns:
+        pd.Series: Normalized codes as strings, missing values kept as <NA>
+    """
+    keys = series.astype('string').str.strip().str.lower()
+    keys = keys.str.replace(r'\s*[/\\]\s*', '/', regex=True)
+    return keys.str.replace(r'\s+', ' ', regex=True)
+
+
+class PatientKeys:
+    """
+    Normalized patient_code keys of one frame, computed once
+
+    Each distinct raw code is normalized once and the rows only keep an integer
+    code pointing to their key. Membership tests between two frames compare the
+    distinct keys of both sides (one hash lookup per distinct key), then spread
+    the answer to the rows with an integer take: no string is lowercased or
+    copied again, whatever the number of tests.
+
+    Missing codes never match.
+
+    Example:
+        club = PatientKeys(woman_in_club)
+        ptme_avec_comptage = woman_in_club[club.isin(PatientKeys(pregnancy))]
+    """
+
+    def __init__(self, df, column='patient_code'):
+        raw_codes, raw_uniques = pd.factorize(df[column])
+        canonical = normalize_patient_code(pd.Series(raw_uniques, dtype=object))
+        key_codes, self.uniques = pd.factorize(canonical)
+        self.index = df.index
+        self.codes = np.where(raw_codes >= 0, key_codes[raw_codes], -1) if len(raw_uniques) else raw_codes
+        self._key_set = None
+
+    @property
+    def key_set(self):
+        """Hashed distinct keys present in the frame, built on first use."""
+        if self._key_set is None:
+            present = np.unique(self.codes[self.codes >= 0])
+            self._key_set = pd.Index(self.uniques[present])
+        return self._key_set
+
+    def isin(self, other):
+        """
+        Boolean mask: which rows of this frame have their key in `other`
+
+        Args:
+            other (PatientKeys): Keys of the reference frame
+
+        Returns:
+            pd.Series: Boolean mask aligned on the frame's index
+        """
+        # Lookup of our distinct keys in the hash table of other's keys
+        found = np.append(other.key_set.get_indexer(self.uniques) >= 0, False)
+        # Missing codes (-1) read the trailing False
+        return pd.Series(found[self.codes], index=self.index)
+
+    def subset(self, mask):
+        """Keys of the rows of the frame selected by a boolean mask, without normalizing again."""
+        mask = np.asarray(mask, dtype=bool)
+        keys = object.__new__(PatientKeys)
+        keys.index = self.index[mask]
+        keys.codes = self.codes[mask]
+        keys.uniques = self.uniques
+        keys._key_set = None
+        return keys
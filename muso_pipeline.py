@@ -37,6 +37,7 @@ from dotenv import load_dotenv
 try:
     from utils import get_commcare_odata
     from caris_fonctions import execute_sql_query
+    from export_cache import load_export, read_excel_cached, read_excel_sheets_cached
 except ImportError as e:
     print(f"Warning: Could not import some functions: {e}")
 
@@ -56,28 +57,46 @@ def main():
         print("Chargement des données...")
         today_str = datetime.today().strftime('%Y-%m-%d')
         
+        # Colonnes conservées plus bas: seules celles-ci sont lues dans les exports
+        colonnes = [
+            "caseid", "is_graduated", "office", "graduation_date", "commune_name",
+            "code", "creation_date", "officer_name", "gps_date", "gps", "office_name", "adress",
+            "section_name", "departement_name", "name", "present", "credit", "balance", "absent",
+            "cotisation", "date_suivi", "date_prochain_suivi", "closed", "closed_by_username",
+            "last_modified_date", "username", "opened_date", "owner_name", "case_link"
+        ]
+
+        # Sélection des colonnes pour les bénéficiaires - SANS officer_fullname et officer_name
+        columns = [
+            "caseid", "household_number", "group_code", "dob", "patient_code",
+            "first_name", "group_commune", "phone", "is_inactive", "group_departement",
+            "inactive_date", "graduated", "abandoned_date", "is_abandoned", "last_name",
+            "graduation_date", "gender", "rank", "group_name", "address",
+            "is_pvvih", "is_caris_member", "name", "household_number_2022", "muso_start_date",
+            "patient_code_pv", "date_enquete_ppi", "score_total_ppi", "close_reason", "test",
+            "test_result", "date_du_test", "institution_ou_centre_hospitalier_qui_a_fait_le_test", 
+            "est_sous_arv", "proche_decede_du_vih", "hospitalisation_dans_les_3_derniers_mois", 
+            "lien_de_parent_avec_proche_decede_du_vih", "probleme_de_sante_regulier", "refere", 
+            "owner_id", "caseid_group", "closed", "last_modified_by_user_username", 
+            "last_modified_date", "opened_date", "owner_name"
+        ]
+
         # Chargement des fichiers Excel
-        muso_group = pd.read_excel(
-            f"~/Downloads/caris-dashboard-app/data/muso_groupes (created 2025-03-25) {today_str}.xlsx", 
-            parse_dates=True
+        muso_group = load_export(
+            "muso_groupes (created 2025-03-25)", today_str, parse_dates=True,
+            usecols=lambda col: col in colonnes or col == "opened_by_username"
         )
         
-        muso_ben = pd.read_excel(
-            f"~/Downloads/caris-dashboard-app/data/muso_beneficiaries (created 2025-03-25) {today_str}.xlsx", 
-            parse_dates=True
+        muso_ben = load_export(
+            "muso_beneficiaries (created 2025-03-25)", today_str, parse_dates=True,
+            usecols=lambda col: col in columns or col in ("indices.muso_groupes", "removing_date")
         )
         
-        muso_household = pd.read_excel(
-            f"~/Downloads/caris-dashboard-app/data/muso_household_2022 (created 2025-03-25) {today_str}.xlsx", 
-            parse_dates=True
-        )
+        muso_household = load_export("muso_household_2022 (created 2025-03-25)", today_str, parse_dates=True)
         
-        muso_ppi = pd.read_excel(
-            f"~/Downloads/caris-dashboard-app/data/MUSO - Members - PPI Questionnaires (created 2025-04-23) {today_str}.xlsx", 
-            parse_dates=True
-        )
+        muso_ppi = load_export("MUSO - Members - PPI Questionnaires (created 2025-04-23)", today_str, parse_dates=True)
         
-        muso_actif = pd.read_excel("./group_muso_actif.xlsx", parse_dates=True)
+        muso_actif = read_excel_cached("./group_muso_actif.xlsx", parse_dates=True)
         
         print("✓ Données chargées avec succès")
         
@@ -87,13 +106,6 @@ def main():
         muso_group_after = muso_group.copy(deep=True)
         muso_group_after = muso_group_after.rename(columns={"opened_by_username": "username"})
         
-        colonnes = [
-            "caseid", "is_graduated", "office", "graduation_date", "commune_name",
-            "code", "creation_date", "officer_name", "gps_date", "gps", "office_name", "adress",
-            "section_name", "departement_name", "name", "present", "credit", "balance", "absent",
-            "cotisation", "date_suivi", "date_prochain_suivi", "closed", "closed_by_username",
-            "last_modified_date", "username", "opened_date", "owner_name", "case_link"
-        ]
         muso_group_after = muso_group_after[colonnes].reset_index(drop=True)
         
         # Filtrage des groupes actifs
@@ -133,7 +145,7 @@ def main():
         muso_ben = muso_ben.rename(columns={"indices.muso_groupes": "caseid_group"})
         muso_group_final = muso_group_final.rename(columns={"caseid": "caseid_group"})
         print("Merge muso_ben_actif avec liste_muso...")
-        liste_muso = pd.read_excel("liste_muso.xlsx", sheet_name=0)
+        liste_muso = read_excel_cached("liste_muso.xlsx", sheet_name=0)
         muso_group_final = muso_group_final.merge(
             liste_muso[["caseid_group", "officer_fullname", "officer_name"]],
             on="caseid_group",
@@ -172,20 +184,6 @@ def main():
             muso_pvvih = muso_ben_actif[muso_ben_actif["is_pvvih"] == "1"]
             print(f"Nombre de PVVIH dans muso: {muso_pvvih.shape[0]}")
         
-        # Sélection des colonnes pour les bénéficiaires - SANS officer_fullname et officer_name
-        columns = [
-            "caseid", "household_number", "group_code", "dob", "patient_code",
-            "first_name", "group_commune", "phone", "is_inactive", "group_departement",
-            "inactive_date", "graduated", "abandoned_date", "is_abandoned", "last_name",
-            "graduation_date", "gender", "rank", "group_name", "address",
-            "is_pvvih", "is_caris_member", "name", "household_number_2022", "muso_start_date",
-            "patient_code_pv", "date_enquete_ppi", "score_total_ppi", "close_reason", "test",
-            "test_result", "date_du_test", "institution_ou_centre_hospitalier_qui_a_fait_le_test", 
-            "est_sous_arv", "proche_decede_du_vih", "hospitalisation_dans_les_3_derniers_mois", 
-            "lien_de_parent_avec_proche_decede_du_vih", "probleme_de_sante_regulier", "refere", 
-            "owner_id", "caseid_group", "closed", "last_modified_by_user_username", 
-            "last_modified_date", "opened_date", "owner_name"
-        ]
         
         # Garder seulement les colonnes qui existent
         columns_existantes = [col for col in columns if col in muso_ben_actif.columns]
@@ -216,10 +214,17 @@ def main():
                 # Prendre le premier fichier trouvé
                 liste_muso_file = liste_muso_files[0]
                 print(f"✓ Fichier trouvé: {liste_muso_file}")
+
+                # Les deux feuilles sont lues en une seule ouverture du classeur
+                try:
+                    feuilles = read_excel_sheets_cached(liste_muso_file, [0, 1])
+                except ValueError:
+                    # Pas de sheet2 dans ce fichier
+                    feuilles = {0: read_excel_cached(liste_muso_file, sheet_name=0)}
                 
                 # SHEET 1 - Lire les données liste_muso
                 try:
-                    liste_muso = pd.read_excel(liste_muso_file, sheet_name=0)  # sheet1
+                    liste_muso = feuilles[0]  # sheet1
                     print(f"Sheet1 - Dimensions liste_muso: {liste_muso.shape}")
                     
                     # Vérifier les colonnes nécessaires pour le merge
@@ -261,7 +266,7 @@ def main():
                 
                 # SHEET 2 - Lire les doublons et filtrer muso_ben_actif
                 try:
-                    doublon = pd.read_excel(liste_muso_file, sheet_name=1)  # sheet2
+                    doublon = feuilles[1]  # sheet2
                     print(f"Sheet2 - Dimensions doublon: {doublon.shape}")
                     
                     # Vérifier si la colonne caseid existe dans doublon
@@ -38,7 +38,11 @@ warnings.filterwarnings('ignore')
 
 # import personal functions
 from utils import get_commcare_odata
-from ptme_fonction import creer_colonne_match_conditional
+from odata_filters import apply_predicates, date_between
+from membership import flag_membership
+from export_cache import load_export, load_export_sheets
+from time_buckets import count_by_month
+from commcare_session import CommCareSession
 
 # configure date
 start_date = pd.to_datetime('2024-06-17')
@@ -55,11 +59,7 @@ def plot_monthly_data(df, date_column, plot_title):
         plot_title: The title of the plot.
     """
     df[date_column] = pd.to_datetime(df[date_column])
-    df['Month'] = df[date_column].dt.strftime('%B %Y')
-    monthly_counts = df.groupby('Month')['case_id'].count().reset_index()
-    months_order = ['January', 'February', 'March', 'April', 'May', 'June', 'July', 'August', 'September', 'October', 'November', 'December']
-    monthly_counts['Month'] = pd.Categorical(monthly_counts['Month'], categories=[f'{month} {year}' for year in sorted(monthly_counts['Month'].str.split(' ').str[1].unique()) for month in months_order if f'{month} {year}' in monthly_counts['Month'].unique()], ordered=True)
-    monthly_counts = monthly_counts.sort_values(by='Month')
+    monthly_counts = count_by_month(df, date_column, 'case_id')
     plt.figure(figsize=(14, 10))
     colors = list(mcolors.TABLEAU_COLORS.values())
     bars = plt.barh(monthly_counts['Month'], monthly_counts['case_id'], color=colors[:len(monthly_counts)])
@@ -122,6 +122,7 @@ def plot_beneficiaries_by_categorie(df, lo_department, set_title, set_xlabel, se
 load_dotenv('id_cc.env')
 email = os.getenv('EMAIL')
 password_cc = os.getenv('PASSWORD')
+commcare_session = CommCareSession(email, password_cc)
 #Defining the driver
 options = Options()
 options.add_argument("start-maximized")
@@ -130,12 +131,10 @@ driver.implicitly_wait(1000)
 
 #Creating login function
 def commcare_login():
-    driver.get(
-        'https://www.commcarehq.org/a/caris-test/data/export/custom/new/case/download/e557b6395b29e531d920e3dcd48028a4/'
+    # Session enregistrée réutilisée ; formulaire seulement si elle a expiré
+    commcare_session.login_driver(
+        driver, 'https://www.commcarehq.org/a/caris-test/data/export/custom/new/case/download/e557b6395b29e531d920e3dcd48028a4/'
     )
-    driver.find_element("xpath", '//*[@id="id_auth-username"]').send_keys(email)
-    driver.find_element("xpath", '//*[@id="id_auth-password"]').send_keys(password_cc)
-    driver.find_element(By.CSS_SELECTOR, 'button[type=submit]').click()
 
 commcare_login()
 
@@ -164,12 +163,10 @@ driver.implicitly_wait(1000)
 
 #Creating login function
 def commcare_login():
-    driver.get(
-        'https://www.commcarehq.org/a/caris-test/data/export/custom/new/case/download/a6a53d717d2d0bcb0724ae93a3cbfd9f/'
+    # Même session que le premier navigateur : pas de nouvelle connexion
+    commcare_session.login_driver(
+        driver, 'https://www.commcarehq.org/a/caris-test/data/export/custom/new/case/download/a6a53d717d2d0bcb0724ae93a3cbfd9f/'
     )
-    driver.find_element("xpath", '//*[@id="id_auth-username"]').send_keys(email)
-    driver.find_element("xpath", '//*[@id="id_auth-password"]').send_keys(password_cc)
-    driver.find_element(By.CSS_SELECTOR, 'button[type=submit]').click()
 
 commcare_login()
 
@@ -186,10 +183,10 @@ driver.quit()
 # In[11]:
 
 
-#Importing household nut file
-h_nut_0 = pd.read_excel('~/Downloads/household_nutrition (created 2025-06-25) ' + str(datetime.today().strftime('%Y-%m-%d')) + '.xlsx', 
-                    sheet_name = 'Cases'
-                    , parse_dates = True)
+#Importing household nut file: the case sheet and its parent sheet are read in one pass
+h_nut_sheets = load_export_sheets('household_nutrition (created 2025-06-25)', ['Cases', 'Parent Cases'],
+                    export_dir='~/Downloads', parse_dates = True)
+h_nut_0 = h_nut_sheets['Cases']
 
 # rename the column
 h_nut_0['number_1'] = h_nut_0['number']
@@ -200,10 +197,8 @@ h_nut_0.rename(columns = {'number' : 'number_x'}, inplace = True)
 # In[12]:
 
 
-#Importing household nut file
-h_nut_lookup = pd.read_excel('~/Downloads/household_nutrition (created 2025-06-25) ' + str(datetime.today().strftime('%Y-%m-%d')) + '.xlsx', 
-                    sheet_name = 'Parent Cases'
-                    , parse_dates = True)
+#Parent cases of the household nut file
+h_nut_lookup = h_nut_sheets['Parent Cases']
 # rename the column
 h_nut_lookup['number'] = pd.to_numeric(h_nut_lookup['number'], errors='coerce').astype('Int64')
 h_nut_lookup.rename(columns = {'number__0' : 'number_x'}, inplace = True)
@@ -219,7 +214,7 @@ h_nut = h_nut_0.merge(h_nut_lookup, on = 'number_x', how = 'left')
 
 # In[14]:
 
-nutrition_case = pd.read_excel(f"~/Downloads/Nutrition (created 2025-04-25) {str(datetime.today().strftime('%Y-%m-%d'))}.xlsx", parse_dates = True)
+nutrition_case = load_export("Nutrition (created 2025-04-25)", export_dir='~/Downloads', parse_dates = True)
 
 # In[15]:
 
@@ -340,37 +335,12 @@ enrole.to_excel("enrole.xlsx",index=True)
 #enrole.to_excel(f"enrole_{str(datetime.today().strftime('%Y-%m-%d'))}.xlsx", index = False)
 
 
-
-def creer_colonne_match_conditional(df1, df2, on, nouvelle_colonne, mapping):
-    """
-    Crée une colonne dans df1 en fonction des correspondances avec df2, conditionnées par un mapping.
-
-    :param df1: Le premier DataFrame
-    :param df2: Le second DataFrame
-    :param on: La colonne utilisée pour le merge
-    :param nouvelle_colonne: Le nom de la nouvelle colonne à créer
-    :param mapping: Un dictionnaire pour définir les valeurs de la colonne 'match'
-    :return: df1 avec la nouvelle colonne ajoutée
-    """
-    # Merge gauche avec indicateur de correspondance
-    merged_df = df1.merge(df2, on=on, how='left', indicator=True)
-
-    # Création de la nouvelle colonne 'match' avec un mapping conditionnel
-    merged_df[nouvelle_colonne] = merged_df['_merge'].map(mapping)
-
-    # Suppression de la colonne '_merge'
-    merged_df.drop(columns=['_merge'], inplace=True)
-
-    # Retourner seulement les colonnes originales de df1 avec la nouvelle colonne
-    return merged_df
-
-
 # In[37]:
 
 
 h_ovc_nut_j =enrole[['case_id','commune','office']]
 mapping_p = {'both': 'yes', 'left_only': 'no'}
-comptage = creer_colonne_match_conditional(enrole, h_nut, on='case_id', nouvelle_colonne='comptage', mapping=mapping_p).drop_duplicates('case_id', keep = 'first')
+comptage = flag_membership(enrole, h_nut, on='case_id', nouvelle_colonne='comptage', mapping=mapping_p).drop_duplicates('case_id', keep = 'first')
 comptage.shape[0]
 print(comptage['comptage'].value_counts())
 # Filtrage des lignes où la colonne 'testing' vaut "yes"
@@ -390,7 +360,8 @@ nut_sans_comptage.to_excel("nut_sans_comptage.xlsx",index=True)
 
 h_ovc_nut_j =enrole[['case_id','commune','office']]
 mapping_p = {'both': 'yes', 'left_only': 'no'}
-testing = creer_colonne_match_conditional(h_nut, enrole, on='case_id', nouvelle_colonne='testing', mapping=mapping_p)
+# commune et office viennent de enrole (h_ovc_nut_j)
+testing = flag_membership(h_nut, h_ovc_nut_j, on='case_id', nouvelle_colonne='testing', mapping=mapping_p, columns=['commune', 'office'])
 testing.shape[0]
 print(testing['testing'].value_counts())
 # Filtrage des lignes où la colonne 'testing' vaut "yes"
@@ -449,7 +420,8 @@ print(f"Nombre de menage non encore dépisté : {nut_sans_testing.shape[0]}")
 end_date_week = pd.to_datetime('today')
 # Date de début = 7 jours avant
 start_date_week = end_date_week - timedelta(days=7)
-depistage_nut_week = nutrition_depistage[(nutrition_depistage['date_de_depistage'] >= start_date_week) & (nutrition_depistage['date_de_depistage'] <= end_date_week)]
+# Le cas Nutrition vient d'un export Excel : la fenêtre est appliquée localement (odata_filters)
+depistage_nut_week = apply_predicates(nutrition_depistage, [date_between('date_de_depistage', start_date_week, end_date_week)])
 print(f"Nombre de dépistages pour la semaine : {depistage_nut_week.shape[0]}")
 
 
@@ -466,7 +438,7 @@ print(f"Nombre de dépistages pour la semaine : {depistage_nut_week.shape[0]}")
 # In[60]:
 
 
-visite_nut_week = nutrition_visite[(nutrition_visite['date_de_visite'] >= start_date_week) & (nutrition_visite['date_de_visite'] <= end_date_week)]
+visite_nut_week = apply_predicates(nutrition_visite, [date_between('date_de_visite', start_date_week, end_date_week)])
 print(f"Nombre de visites pour la semaine : {visite_nut_week.shape[0]}")
 
 
@@ -501,7 +473,7 @@ print(f"Nombre de visites pour la semaine : {visite_nut_week.shape[0]}")
 # In[63]:
 
 
-comptage_nut_week = nutrition_case[(nutrition_case['household_collection_date'] >= start_date_week) & (nutrition_case['household_collection_date'] <= end_date_week)]
+comptage_nut_week = apply_predicates(nutrition_case, [date_between('household_collection_date', start_date_week, end_date_week)])
 print(f"Nombre de comptages pour la semaine : {comptage_nut_week.shape[0]}")
 
 
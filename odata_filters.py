@@ -0,0 +1,182 @@
+from datetime import date, datetime
+
+import pandas as pd
+
+# Longest value list compiled into the OData URL, longer lists are evaluated locally
+MAX_PUSHDOWN_VALUES = 50
+
+
+class ODataPredicate:
+    """
+    One filter condition on a CommCare OData feed
+
+    Build predicates with date_between, equals, not_equals, is_in and local_filter
+    rather than with this class directly.
+    """
+
+    def __init__(self, field: str, op: str, value=None, func=None, description: str = None, typed: bool = False):
+        self.field = field
+        self.op = op
+        self.value = value
+        self.func = func
+        self.typed = typed
+        self.description = description or f"{field} {op} {value!r}"
+
+    def __repr__(self):
+        return f"ODataPredicate({self.description})"
+
+
+def date_between(field: str, start=None, end=None, typed: bool = False) -> ODataPredicate:
+    """
+    Keep records whose date `field` falls in [start, end] (either bound may be None)
+
+    CommCare case properties are published as text: by default the bounds are
+    compared as 'YYYY-MM-DD' strings, which also leaves out the "---" placeholders.
+    Use typed=True for real Edm.DateTimeOffset fields such as last_modified_date.
+    """
+    start = pd.to_datetime(start) if start is not None else None
+    end = pd.to_datetime(end) if end is not None else None
+    return ODataPredicate(field, 'between', (start, end), typed=typed,
+                          description=f"{field} between {start} and {end}")
+
+
+def equals(field: str, value) -> ODataPredicate:
+    """Keep records where `field` == value."""
+    return ODataPredicate(field, 'eq', value)
+
+
+def not_equals(field: str, value) -> ODataPredicate:
+    """Keep records where `field` != value."""
+    return ODataPredicate(field, 'ne', value)
+
+
+def is_in(field: str, values) -> ODataPredicate:
+    """Keep records where `field` is one of `values`."""
+    return ODataPredicate(field, 'in', list(values), description=f"{field} in {list(values)!r}")
+
+
+def local_filter(field: str, func, description: str) -> ODataPredicate:
+    """Arbitrary condition func(Series) -> boolean mask, always evaluated in pandas."""
+    return ODataPredicate(field, 'local', func=func, description=description)
+
+
+def _odata_literal(value, typed=False):
+    """Format a Python value as an OData literal."""
+    if isinstance(value, (datetime, date, pd.Timestamp)):
+        value = pd.Timestamp(value)
+        if typed:
+            # Edm.DateTimeOffset literal in UTC: an aware bound is converted, a naive one is taken as UTC
+            if value.tzinfo is not None:
+                value = value.tz_convert('UTC')
+            return value.strftime('%Y-%m-%dT%H:%M:%SZ')
+        # Text dates are local days: the day of the bound, in its own timezone
+        return f"'{value.strftime('%Y-%m-%d')}'"
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, (int, float)):
+        return str(value)
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def _compile_predicate(predicate: ODataPredicate):
+    """Return the OData expression of a predicate, or the reason it cannot be pushed down."""
+    if predicate.op == 'local':
+        return None, "custom Python condition"
+    if ' ' in predicate.field:
+        return None, "field name contains a space"
+    if predicate.op in ('eq', 'ne'):
+        return f"{predicate.field} {predicate.op} {_odata_literal(predicate.value)}", None
+    if predicate.op == 'in':
+        if not predicate.value:
+            return None, "empty value list"
+        if len(predicate.value) > MAX_PUSHDOWN_VALUES:
+            return None, f"more than {MAX_PUSHDOWN_VALUES} values"
+        # 'in' is OData 4.01 only: spell it out as a chain of 'or' for the CommCare feed
+        return "(" + " or ".join(f"{predicate.field} eq {_odata_literal(v)}" for v in predicate.value) + ")", None
+    if predicate.op == 'between':
+        start, end = predicate.value
+        parts = []
+        if start is not None:
+            parts.append(f"{predicate.field} ge {_odata_literal(start, predicate.typed)}")
+        if end is not None:
+            if predicate.typed:
+                parts.append(f"{predicate.field} le {_odata_literal(end, predicate.typed)}")
+            else:
+                # Text dates may carry a time part: compare with the day after the end bound
+                parts.append(f"{predicate.field} lt {_odata_literal(end + pd.Timedelta(days=1))}")
+        if not parts:
+            return None, "no bound given"
+        return " and ".join(parts), None
+    return None, f"unsupported operator '{predicate.op}'"
+
+
+def compile_odata_filter(predicates):
+    """
+    Compile predicates into one OData $filter expression
+
+    Args:
+        predicates (list): ODataPredicate objects, all of which must hold
+
+    Returns:
+        tuple: ($filter string or None, list of predicates to evaluate locally)
+    """
+    expressions = []
+    local = []
+    for predicate in predicates:
+        expression, reason = _compile_predicate(predicate)
+        if expression is None:
+            print(f"Filter '{predicate.description}' cannot be sent to CommCare ({reason}), it will be applied locally")
+            local.append(predicate)
+        else:
+            expressions.append(expression)
+    odata_filter = " and ".join(f"({e})" for e in expressions) if expressions else None
+    return odata_filter, local
+
+
+def odata_filter_params(predicates, filter_params=None):
+    """
+    Add the pushable predicates to the OData request parameters
+
+    Returns:
+        tuple: (parameters for get_commcare_odata, predicates to evaluate locally)
+    """
+    params = dict(filter_params or {})
+    odata_filter, local = compile_odata_filter(predicates)
+    if odata_filter:
+        params['$filter'] = f"({params['$filter']}) and {odata_filter}" if params.get('$filter') else odata_filter
+    return params, local
+
+
+def apply_predicates(df, predicates):
+    """
+    Evaluate predicates on a DataFrame whose columns use '_' instead of ' '
+
+    Returns:
+        pd.DataFrame: Rows satisfying every predicate
+    """
+    mask = pd.Series(True, index=df.index)
+    for predicate in predicates:
+        column = df[predicate.field.replace(' ', '_')]
+        if predicate.op == 'local':
+            mask &= predicate.func(column)
+        elif predicate.op == 'eq':
+            mask &= column == predicate.value
+        elif predicate.op == 'ne':
+            mask &= column != predicate.value
+        elif predicate.op == 'in':
+            mask &= column.isin(predicate.value)
+        elif predicate.op == 'between':
+            start, end = (None if bound is None else pd.Timestamp(bound) for bound in predicate.value)
+            # Exports mix plain days and days with a time: every value is parsed on its own
+            dates = pd.to_datetime(column, errors='coerce', utc=predicate.typed, format='mixed')
+            if predicate.typed:
+                start = start.tz_localize('UTC') if start is not None and start.tzinfo is None else start
+                end = end.tz_localize('UTC') if end is not None and end.tzinfo is None else end
+            else:
+                dates = dates.dt.normalize()
+            if start is not None:
+                mask &= dates >= start
+            if end is not None:
+                mask &= dates <= end
+    return df[mask]
+
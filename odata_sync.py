@@ -0,0 +1,278 @@
+import os
+import json
+import hashlib
+from datetime import datetime
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from utils import get_commcare_odata, iter_commcare_odata_pages
+
+# Local columnar copy of the CommCare OData feeds, one Parquet file per feed
+ODATA_STORE_DIR = os.path.join('data', 'odata_store')
+WATERMARKS_FILE = 'watermarks.json'
+
+# Properties actually used by the pipelines for each feed, requested with $select.
+# Feeds not listed here are downloaded with all their properties.
+FEED_COLUMNS = {
+    # ptme_pipeline.py
+    'pregnancy': [
+        'birth_place_plan', 'case_link', 'caseid', 'club_name', 'date_of_visit',
+        'date_of_visit_ratio_other', 'ddr', 'delivery_date', 'dpa', 'health_id',
+        'household_collection_date', 'household_number', 'id_patient',
+        'is_benficiary_present_ratio_other', 'is_currently_pregnant',
+        'is_this_girl_belong_to_a_club', 'last_modified_by_user_username',
+        'last_modified_date', 'mobile_phone_number', 'mother_phone_number',
+        'mother_plans_to_get_child_tested', 'mother_secondary_number',
+        'mother_secondary_phone_number', 'nbr_call'
+    ],
+    'hh_ptme': [
+        'patient_code', 'age_in_year', 'ptme_relationship', 'full_code_patient_menage',
+        'hiv_test', 'hiv_test_result', 'caseid', 'non_consent_reason', 'last_modified_date'
+    ],
+    # oev_pipeline.py ('main_infant_code' becomes 'patient_code')
+    'hh_child': [
+        'first_name', 'last_name', 'name', 'age_in_year', 'caregiver_yes_no', 'caseid',
+        'dob', 'full_code_patient_menage', 'gender', 'hiv_test', 'hiv_test_date',
+        'hiv_test_result', 'household_collection_date', 'indices_child',
+        'infant_relationship', 'is_accepted', 'is_caris_beneficiary', 'last_modified_date',
+        'main_infant_code', 'non_consent_reason', 'not_accepted_reason',
+        'opened_by_username', 'opened_date'
+    ],
+    # run_odata_hh_garden.py
+    'garden_household': [
+        'indices_Garden', 'age_in_year', 'gender', 'gardining_member_relationship',
+        'hiv_test', 'hiv_test_date', 'hiv_test_result', 'is_on_arv', 'risk_level',
+        'referred_for_a_test', 'test_institution', 'caseid', 'last_modified_date'
+    ],
+}
+
+
+def load_watermarks(store_dir=ODATA_STORE_DIR):
+    """
+    Read the per-feed high-water marks of the local store
+
+    Args:
+        store_dir (str): Folder holding the feed snapshots
+
+    Returns:
+        dict: {feed name: last seen modification timestamp (ISO string)}
+    """
+    path = os.path.join(store_dir, WATERMARKS_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r') as file:
+        return json.load(file)
+
+
+def save_watermark(feed_name, watermark, store_dir=ODATA_STORE_DIR):
+    """Record the high-water mark of one feed in the store."""
+    watermarks = load_watermarks(store_dir)
+    watermarks[feed_name] = watermark
+    with open(os.path.join(store_dir, WATERMARKS_FILE), 'w') as file:
+        json.dump(watermarks, file, indent=2, sort_keys=True)
+
+
+def feed_key(feed_name, filter_params=None):
+    """
+    Name of a feed's snapshot and watermark in the store
+
+    A snapshot only holds the records matching the query it was built with, so
+    the query parameters ($filter, ...) are part of the key: changing them starts
+    a new snapshot with a full download instead of reusing records of another query.
+
+    Args:
+        feed_name (str): Name of the feed
+        filter_params (dict): Parameters passed to the OData API
+
+    Returns:
+        str: feed_name, followed by a digest of filter_params when there are any
+    """
+    if not filter_params:
+        return feed_name
+    signature = json.dumps(filter_params, sort_keys=True, default=str)
+    return f"{feed_name}_{hashlib.sha1(signature.encode('utf-8')).hexdigest()[:10]}"
+
+
+def _prepare_for_parquet(df):
+    """Normalize column names and stringify mixed object columns so Parquet can store them."""
+    df = df.copy()
+    df.columns = [col.replace(' ', '_') for col in df.columns]
+    for col in df.columns[df.dtypes == object]:
+        mask = df[col].notna()
+        df.loc[mask, col] = df.loc[mask, col].astype(str)
+    return df
+
+
+def _max_watermark(df, column):
+    """Return the latest value of the watermark column as an OData datetime literal."""
+    if column not in df.columns:
+        print(f"Warning: column '{column}' not found, the feed will be fully downloaded next time")
+        return None
+    values = pd.to_datetime(df[column], errors='coerce', utc=True).dropna()
+    if values.empty:
+        return None
+    return values.max().strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+
+def sync_commcare_odata(url, auth_credentials, feed_name, key='caseid',
+                        watermark_column='last_modified_date', filter_params=None,
+                        full_refresh=False, store_dir=ODATA_STORE_DIR, max_workers=4, columns=None):
+    """
+    Incrementally sync a CommCare OData feed into the local store
+
+    Only the records modified since the last run are requested (OData $filter on
+    the watermark column); they are upserted on `key` into the feed snapshot and
+    the merged snapshot is returned. The first run, or `full_refresh=True`,
+    downloads the whole feed. Deleted cases are only dropped by a full refresh.
+
+    Args:
+        url (str): The OData API URL
+        auth_credentials (tuple): Username and password tuple (username, password)
+        feed_name (str): Name of the feed in the store (e.g. 'pregnancy', 'hh_ptme');
+            the snapshot is keyed by this name and filter_params, see feed_key
+        key (str): Unique record id, 'caseid' for case feeds and 'formid' for form feeds
+        watermark_column (str): Modification timestamp used as high-water mark
+            ('last_modified_date' for cases, 'received_on' for forms)
+        filter_params (dict): Extra parameters passed to the OData API
+        full_refresh (bool): Ignore the stored snapshot and pull the whole feed
+        store_dir (str): Folder holding the feed snapshots
+        max_workers (int): Concurrent page fetches, see get_commcare_odata
+        columns (list): Properties to download, defaults to FEED_COLUMNS[feed_name].
+            The key and watermark columns are always added
+
+    Returns:
+        pd.DataFrame: Full, up-to-date snapshot of the feed (columns with '_' instead of ' ')
+
+    Raises:
+        ODataFetchError: A page could not be retrieved; the snapshot and watermark are left unchanged
+    """
+    os.makedirs(store_dir, exist_ok=True)
+    store_key = feed_key(feed_name, filter_params)
+    snapshot_path = os.path.join(store_dir, f'{store_key}.parquet')
+    watermark = load_watermarks(store_dir).get(store_key)
+    incremental = not full_refresh and watermark is not None and os.path.exists(snapshot_path)
+
+    columns = columns if columns is not None else FEED_COLUMNS.get(feed_name)
+    if columns:
+        columns = list(dict.fromkeys(list(columns) + [key, watermark_column]))
+        stored_columns = set(pq.read_schema(snapshot_path).names) if incremental else set()
+        if incremental and not {col.replace(' ', '_') for col in columns} <= stored_columns:
+            # The column spec grew since the snapshot was built: rebuild it
+            print(f"[{feed_name}] Column spec changed, falling back to a full download")
+            incremental = False
+
+    params = dict(filter_params or {})
+    if incremental:
+        since = f"{watermark_column} ge {watermark}"
+        params['$filter'] = f"({params['$filter']}) and {since}" if params.get('$filter') else since
+        print(f"[{feed_name}] Incremental sync of records modified since {watermark}")
+    else:
+        print(f"[{feed_name}] Full download of the feed")
+
+    start = datetime.now()
+    # strict: a failed page raises, so a partial download never reaches the snapshot nor moves the watermark
+    records = get_commcare_odata(url, auth_credentials, params, max_workers=max_workers, columns=columns, strict=True)
+    changes = _prepare_for_parquet(pd.DataFrame(records))
+
+    if incremental:
+        snapshot = pd.read_parquet(snapshot_path)
+        if changes.empty:
+            print(f"[{feed_name}] No change since last sync ({snapshot.shape[0]} records)")
+            return snapshot
+        # Upsert: the freshly downloaded version of a record replaces the stored one
+        snapshot = pd.concat([snapshot, changes], ignore_index=True)
+        snapshot = snapshot.drop_duplicates(subset=key, keep='last').reset_index(drop=True)
+    else:
+        snapshot = changes
+
+    if snapshot.empty:
+        return snapshot
+    snapshot.to_parquet(snapshot_path, index=False)
+    new_watermark = _max_watermark(snapshot, watermark_column)
+    if new_watermark is not None:
+        save_watermark(store_key, new_watermark, store_dir)
+
+    elapsed = (datetime.now() - start).total_seconds()
+    print(f"[{feed_name}] {changes.shape[0]} records downloaded, snapshot has {snapshot.shape[0]} records ({elapsed:.1f}s)")
+    return snapshot
+
+
+def _page_to_table(records, schema):
+    """Build an Arrow table of text columns from one page of OData records."""
+    columns = {}
+    for field in schema:
+        raw_name = field.metadata[b'odata_name'].decode()
+        columns[field.name] = [None if record.get(raw_name) is None else str(record.get(raw_name)) for record in records]
+    return pa.Table.from_pydict(columns, schema=schema)
+
+
+def stream_commcare_odata_to_parquet(url, auth_credentials, filter_params, output_path,
+                                     max_workers=4, page_size=1000, columns=None):
+    """
+    Stream a CommCare OData feed page by page into a Parquet file
+
+    Each page is written as its own row group as soon as it arrives, so no
+    list of all records nor full DataFrame is ever built and peak memory
+    does not grow with the size of the feed. Column names are normalized like
+    the pipelines do (' ' replaced by '_') and values are stored as text, as in
+    the CommCare exports. The file is written next to output_path and only
+    replaces it once every page has arrived: a failed run keeps the previous file.
+
+    Args:
+        url (str): The OData API URL
+        auth_credentials (tuple): Username and password tuple (username, password)
+        filter_params (dict): Parameters to filter the data
+        output_path (str): Parquet file to write
+        max_workers (int): Concurrent page fetches, see get_commcare_odata
+        page_size (int): Number of records requested per page in concurrent mode
+        columns (list): Properties to download ($select), None for all of them
+
+    Returns:
+        pyarrow.dataset.Dataset: Lazy view of output_path, nothing is read yet. Load only
+            what is needed, e.g. .to_table(columns=[...]).to_pandas(), or iterate
+            .to_batches(); None when the feed is empty
+
+    Raises:
+        ODataFetchError: A page could not be retrieved; output_path is left untouched
+    """
+    partial = output_path + '.part'
+    writer = None
+    schema = None
+    total = 0
+    complete = False
+    try:
+        for records in iter_commcare_odata_pages(url, auth_credentials, filter_params, max_workers, page_size, columns,
+                                                 strict=True):
+            if not records:
+                continue
+            if writer is None:
+                # The OData feed has a fixed set of properties: the first page gives the schema
+                raw_names = list(dict.fromkeys(name for record in records for name in record))
+                schema = pa.schema([
+                    pa.field(name.replace(' ', '_'), pa.string(), metadata={'odata_name': name})
+                    for name in raw_names
+                ])
+                directory = os.path.dirname(output_path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                writer = pq.ParquetWriter(partial, schema)
+            writer.write_table(_page_to_table(records, schema))
+            total += len(records)
+            print(f"Written {len(records)} records to {output_path}. Total: {total}")
+        complete = True
+    finally:
+        if writer is not None:
+            writer.close()
+            if complete:
+                os.replace(partial, output_path)
+            else:
+                os.remove(partial)
+
+    if writer is None:
+        print("No record retrieved, nothing written")
+        return None
+    print(f"Total records written: {total}")
+    return ds.dataset(output_path, format='parquet')
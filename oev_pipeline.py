@@ -27,31 +27,43 @@ from webdriver_manager.chrome import ChromeDriverManager
 from dotenv import load_dotenv
 # import functions
 from utils import get_commcare_odata
+from odata_sync import sync_commcare_odata
 # Download charges virales database from "Charges_virales_pediatriques.sql file"
-from caris_fonctions import execute_sql_query
+from sql_cache import cached_sql_chunks, sql_cache_stats
+from extract_filters import OEV_EXCLUSIONS, apply_exclusions, print_exclusions
+from dtype_registry import apply_dtypes, uncategorize
+from membership import PatientKeys
+from export_cache import load_export
 
+# Règles d'exclusion évaluées par MySQL (False : tout est filtré dans pandas, comme avant)
+SQL_PUSHDOWN = True
 
 
 # ========== FILTRAGE OEV ==========
-def filter_oev_data(df):
+def filter_oev_rows(df, report):
+    # Filtres ligne à ligne : applicables à chaque bloc de la requête SQL.
+    # Avec SQL_PUSHDOWN, MySQL a déjà appliqué ces règles et ce passage ne retire plus rien (vérification)
+    # Les lignes lues et exclues par règle s'additionnent dans report, affiché une fois par filter_oev_data
+    kept, excluded = apply_exclusions(df, OEV_EXCLUSIONS, verbose=False, return_counts=True)
+    report['rows'] = report.get('rows', 0) + df.shape[0]
+    report['excluded'] = excluded if 'excluded' not in report else report['excluded'].add(excluded, fill_value=0)
+    return kept
+
+
+def filter_oev_data(df, report=None, output_file=None):
+    # Les exclusions ligne à ligne sont déjà appliquées bloc par bloc (filter_oev_rows) : il ne reste que les doublons
+    if report and 'excluded' in report:
+        if SQL_PUSHDOWN:
+            print("Règles appliquées par MySQL ; comptes de la vérification dans pandas (0 attendu) :")
+        print_exclusions(report['excluded'].astype('int64'), report['rows'], df.shape[0])
     print(f"Initial dataset: {df.shape[0]} rows")
 
-    df = df[~df['office'].isin(['BOM', 'PDP'])]
-    df = df[~df['network'].isin(['PIH', 'UGP', 'MSPP'])]
-    df['age'] = pd.to_numeric(df['age'], errors='coerce')
-    df = df[df['age'].between(0, 17)]
-
-    sites_to_exclude = ['PAP/CHAP', 'PAP/OBCG', 'PAP/OGRE', 'PEG/HNDP', 'PAP/SMFO', 'LEG/HSCL', 'PAP/HAHD', 'ARC/SADA']
-    df = df[~df['site'].isin(sites_to_exclude)]
-
-    df['is_abandoned'] = pd.to_numeric(df['is_abandoned'], errors='coerce')
-    df = df[df['is_abandoned'] != 1]
-
-
     df = df.drop_duplicates(subset='patient_code', keep='last')
 
     print(f"Filtered dataset: {df.shape[0]} rows")
-    df.to_excel("TX_CURR.xlsx", index=False)
+    # Export Excel facultatif, une fois le filtrage terminé
+    if output_file:
+        df.to_excel(output_file, index=False)
     return df
 
 
@@ -93,17 +105,22 @@ def main():
 
     # Étape 2 : Charger le fichier téléchargé
     today_str = datetime.today().strftime('%Y-%m-%d')
-    path = f"~/Downloads/caris-dashboard-app/data/All_child_PatientCode_CaseID {today_str}.xlsx"
-    caseid = pd.read_excel(os.path.expanduser(path))
-
-    # Étape 3 : Charger la base de données charges virales
-    oev_data = execute_sql_query('dot.env', './Charges_virales_pediatriques.sql')
-
-    # Étape 4 : Nettoyer les doublons
-    oev_data = oev_data.loc[:, ~oev_data.columns.duplicated()]
+    caseid = load_export("All_child_PatientCode_CaseID", today_str)
+
+    # Étape 3 : Charger la base de données charges virales, bloc par bloc
+    # Étape 4 : Nettoyer les doublons de colonnes et écarter les lignes hors périmètre au fil de l'eau
+    exclusion_report = {}
+    oev_data = pd.concat(
+        [filter_oev_rows(chunk.loc[:, ~chunk.columns.duplicated()], exclusion_report)
+         for chunk in cached_sql_chunks('dot.env', './Charges_virales_pediatriques.sql', freshness='daily',
+                                        exclusions=OEV_EXCLUSIONS if SQL_PUSHDOWN else None)],
+        ignore_index=True
+    )
+    # Types fixés une fois pour toutes (catégories, entiers nullables, dates)
+    oev_data = apply_dtypes(oev_data, 'sql_charges_virales')
 
     # Étape 5 : Filtrage
-    filtered_df = filter_oev_data(oev_data)
+    filtered_df = filter_oev_data(oev_data, exclusion_report, output_file='TX_CURR.xlsx')
     filtered_df['sex'] = filtered_df['sex'].str.replace('0', 'F').str.replace('3', 'F')
 
     # Étape 6 : Analyse club
@@ -134,9 +151,9 @@ def main():
     # Lire le fichier avec pd.read_excel
 
     # Extraction depuis CommCare OData
-    ajout = pd.DataFrame(get_commcare_odata(ajout_url, auth, params))
-    child = pd.DataFrame(get_commcare_odata(child_url, auth, params))
-    hh_child = pd.DataFrame(get_commcare_odata(hh_child_url, auth, params))
+    ajout = sync_commcare_odata(ajout_url, auth, 'ajout_oev', key='formid', watermark_column='received_on', filter_params=params)
+    child = sync_commcare_odata(child_url, auth, 'child', filter_params=params)
+    hh_child = sync_commcare_odata(hh_child_url, auth, 'hh_child', filter_params=params)
 
     # Nettoyage des colonnes
     ajout.columns = ajout.columns.str.replace(' ', '_').str.replace('form_', '', regex=False)
@@ -148,7 +165,7 @@ def main():
         print("❌ Colonne 'caseid' non trouvée dans le DataFrame 'ajout'.")
 
     # Fusion des données avec contrôle et affichage
-    ajout_comptage = pd.merge(oev_in_club, caseid, on='patient_code', how='left').drop_duplicates('patient_code').fillna(0)
+    ajout_comptage = pd.merge(uncategorize(oev_in_club), caseid, on='patient_code', how='left').drop_duplicates('patient_code').fillna(0)
     
     print(f"✅ Le jeu de données fusionné comptage_ajout contient {ajout_comptage.shape[0]} observations.")
     ajout_comptage.to_excel("ajout_comptage.xlsx", index=False)
@@ -167,6 +184,7 @@ def main():
     'is_accepted', 'is_caris_beneficiary', 'last_modified_date',
     'patient_code', 'non_consent_reason', 'not_accepted_reason',
     'opened_by_username', 'opened_date']]
+    hh_child = apply_dtypes(hh_child, 'odata_hh_child')
     
     print(f'This hh_child Household dataset has {hh_child.shape[0]} observations')
 
@@ -182,25 +200,27 @@ def main():
     ajout.to_excel("new_ajout.xlsx", index=False)
 
     # Comptage des OEV en club avec ou sans ajout dans CommCare
-    oev_avec_comptage = oev_in_club[
-        oev_in_club['patient_code'].str.lower().isin(merged_df_ajout_child['patient_code'].astype(str).str.lower())
-    ].drop_duplicates('patient_code', keep='first')
+    # Clés patient_code normalisées, calculées une seule fois par DataFrame
+    club_keys = PatientKeys(oev_in_club)
+    ajout_keys = PatientKeys(merged_df_ajout_child)
+    oev_avec_comptage = oev_in_club[club_keys.isin(ajout_keys)].drop_duplicates('patient_code', keep='first')
     oev_avec_comptage['patient_code'] = oev_avec_comptage['patient_code'].str.upper()
     print(f"OEV avec comptage: {oev_avec_comptage.shape[0]}")
 
-    oev_sans_comptage = oev_in_club[
-        ~oev_in_club['patient_code'].str.lower().isin(merged_df_ajout_child['patient_code'].astype(str).str.lower())
-    ].drop_duplicates('patient_code', keep='first')
+    oev_sans_comptage = oev_in_club[~club_keys.isin(ajout_keys)].drop_duplicates('patient_code', keep='first')
     oev_sans_comptage['patient_code'] = oev_sans_comptage['patient_code'].str.upper()
     print(f"OEV sans comptage: {oev_sans_comptage.shape[0]}")
 
     oev_avec_comptage.to_excel("oev_avec_comptage.xlsx", index=False)
     oev_sans_comptage.to_excel("oev_sans_comptage.xlsx", index=False)
     
-    hhm_club = hh_child[hh_child['patient_code'].str.lower().isin(oev_in_club['patient_code'].str.lower())]
+    hhm_club = hh_child[PatientKeys(hh_child).isin(club_keys)]
     hhm_club['patient_code'] = hhm_club['patient_code'].str.upper()
     hhm_club.to_excel('hhm_club.xlsx', index=False)
 
+    # Extraction servie par le cache du jour ou relue depuis MySQL
+    sql_cache_stats()
+
 if __name__ == "__main__":
     main()
     print("✅ Pipeline exécuté avec succès.")
@@ -1,25 +1,11 @@
 import os
 from dotenv import load_dotenv
-from sqlalchemy import create_engine
 import pandas as pd
+from sql_engine import execute_sql_query as _execute_sql_query
 
 def execute_sql_query(env_path: str, sql_file_path: str) -> pd.DataFrame:
-    load_dotenv(env_path)
-    user = os.getenv('MYSQL_USER')
-    password = os.getenv('MYSQL_PASSWORD')
-    host = os.getenv('MYSQL_HOST')
-    db = os.getenv('MYSQL_DB')
-
-    conn_text = f'mysql+pymysql://{user}:{password}@{host}/{db}'
-    engine = create_engine(conn_text)
-
-    with open(sql_file_path, 'r') as file:
-        sql_query = file.read().replace('use caris_db;', '')
-
-    df = pd.read_sql_query(sql_query, engine)
-    engine.dispose()
-
-    return df
+    # Pooled engine shared by the whole run, see sql_engine.py
+    return _execute_sql_query(env_path, sql_file_path)
 
 #===========================================================================================================================
 #========================================================================================================================= 
@@ -30,6 +16,7 @@ from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.common.by import By
 import time
 from datetime import datetime
+from commcare_session import CommCareSession
 
 def download_files():
     load_dotenv('id_cc.env')
@@ -46,10 +33,9 @@ def download_files():
 
     def commcare_login():
         try:
-            driver.get('https://www.commcarehq.org/a/caris-test/data/export/custom/new/case/download/f6ddce2133f8d233d9fbd9341220ed6f/')
-            driver.find_element(By.XPATH, '//*[@id="id_auth-username"]').send_keys(email)
-            driver.find_element(By.XPATH, '//*[@id="id_auth-password"]').send_keys(password_cc)
-            driver.find_element(By.CSS_SELECTOR, 'button[type=submit]').click()
+            # Session enregistrée (commcare_session.py), formulaire seulement si elle a expiré
+            CommCareSession(email, password_cc).login_driver(
+                driver, 'https://www.commcarehq.org/a/caris-test/data/export/custom/new/case/download/f6ddce2133f8d233d9fbd9341220ed6f/')
         except Exception as e:
             print(f"An error occurred during login: {e}")
 
@@ -148,6 +134,7 @@ import pandas as pd
 def creer_colonne_match_conditional(df1, df2, on, nouvelle_colonne, mapping):
     """
     Crée une colonne dans df1 en fonction des correspondances avec df2, conditionnées par un mapping.
+    Pour un simple drapeau oui/non, préférer membership.flag_membership (pas de merge ni de doublons).
     
     :param df1: Le premier DataFrame
     :param df2: Le second DataFrame
@@ -436,45 +423,38 @@ def plot_age_pyramid(df, age_col='age', sex_col='sex', id_col='patient_code',
     fig.show()
 #===========================================================================================================================
 import pandas as pd
+from extract_filters import EXCLUDED_OFFICES, EXCLUDED_NETWORKS, OEV_EXCLUDED_SITES, apply_exclusions
 
 def filter_oev_data(
     df,
-    excluded_offices=['BOM', 'PDP'],
-    excluded_networks=['PIH', 'UGP', 'MSPP'],
-    excluded_sites=['PAP/CHAP', 'PAP/OBCG', 'PAP/OGRE', 'PEG/HNDP', 'PAP/SMFO', 'LEG/HSCL', 'PAP/HAHD', 'ARC/SADA'],
+    excluded_offices=EXCLUDED_OFFICES,
+    excluded_networks=EXCLUDED_NETWORKS,
+    excluded_sites=OEV_EXCLUDED_SITES,
     abandoned_flag=1,
-    output_file='TX_CURR.xlsx'
+    output_file=None
 ):
     print(f"Initial dataset has {df.shape[0]} observations")
 
-    df = df[~df['office'].isin(excluded_offices)]
-    print(f"After excluding offices: {df.shape[0]} observations")
-
-    df = df[~df['network'].isin(excluded_networks)]
-    print(f"After excluding networks: {df.shape[0]} observations")
-
-    df['age'] = pd.to_numeric(df['age'], errors='coerce')
-    df = df[df['age'].between(0, 17)]
-    print(f"After filtering age between 0-17: {df.shape[0]} observations")
-
-    df = df[~df['site'].isin(excluded_sites)]
-    print(f"After excluding sites: {df.shape[0]} observations")
-
-    df['is_abandoned'] = pd.to_numeric(df['is_abandoned'], errors='coerce')
-    df = df[df['is_abandoned'] != abandoned_flag]
-    print(f"After excluding abandoned: {df.shape[0]} observations")
-
     next_appointment_date_max = pd.to_datetime('today')
     first_day_this_month = next_appointment_date_max.replace(day=1)
     next_appointment_date_min = first_day_this_month - pd.DateOffset(months=1)
 
-    df['next_appointment_date'] = pd.to_datetime(df['next_appointment_date'], errors='coerce')
-    df = df[df['next_appointment_date'] >= next_appointment_date_min]
+    # Same rules as extract_filters.OEV_EXCLUSIONS (which can run in MySQL instead),
+    # plus the appointment date, evaluated into one combined mask
+    df = apply_exclusions(df, [
+        ('office', 'not_in', excluded_offices),
+        ('network', 'not_in', excluded_networks),
+        ('age', 'between', (0, 17)),
+        ('site', 'not_in', excluded_sites),
+        ('is_abandoned', 'ne', abandoned_flag),
+        ('next_appointment_date', 'ge', next_appointment_date_min),
+    ])
     df = df.drop_duplicates(subset=['patient_code'], keep='last')
     print(f"After filtering by next appointment date ≥ {next_appointment_date_min.date()}: {df.shape[0]} observations")
 
-    df.to_excel(output_file, index=False)
-    print(f"Filtered data exported to {output_file}")
+    if output_file:
+        df.to_excel(output_file, index=False)
+        print(f"Filtered data exported to {output_file}")
 
     return df
 
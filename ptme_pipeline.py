@@ -32,47 +32,36 @@ from caris_fonctions import execute_sql_query
 
 # In[2]:
 from utils import get_commcare_odata
-from ptme_fonction import creer_colonne_match_conditional
+from odata_sync import sync_commcare_odata
+from odata_filters import odata_filter_params, not_equals
+from export_cache import load_export, read_excel_cached
+from extract_filters import PTME_EXCLUSIONS, apply_exclusions, closed_sites_rule
+from membership import flag_membership, PatientKeys
 # In[3]:
 
 def filter_ptme_data(
     df,
-    excluded_offices=['BOM', 'PDP'],
-    excluded_networks=['PIH', 'UGP', 'MSPP'],
+    exclusions=PTME_EXCLUSIONS,
     excluded_site=['GON/CSAR'],# à ajouter dans la base de données des sites fermés
     excluded_term=['Miscarriage'], # Exclude specific termination reasons
-    abandoned_flag=1,
     next_appointment_start='2025-05-01',
-    output_file='filtered_df2.xlsx'):
+    output_file=None):
     print(f"Initial dataset has {df.shape[0]} observations")
 
-    # Exclude specified offices
-    df = df[~df['office'].isin(excluded_offices)]
-    print(f"After excluding offices: {df.shape[0]} observations")
-
-    # Exclude specified networks
-    df = df[~df['network'].isin(excluded_networks)]
-    print(f"After excluding networks: {df.shape[0]} observations")
-    
-    # Exclude specified networks
-    df = df[~df['network'].isin(excluded_site)]
-    print(f"After excluding networks: {df.shape[0]} observations")
-    
-    # Exclude specified networks
-    df = df[~df['network'].isin(excluded_term)]
-    print(f"After excluding networks: {df.shape[0]} observations")
-
-    # Convert 'is_abandoned' to numeric and exclude abandoned
-    df['is_abandoned'] = pd.to_numeric(df['is_abandoned'], errors='coerce')
-    df = df[df['is_abandoned'] != abandoned_flag]
-    print(f"After excluding abandoned: {df.shape[0]} observations")
-
-    df = df[~df['site'].str.lower().isin(site_ferme['site'].str.lower())]
+    # Exclusion rules shared with the SQL extracts (extract_filters.PTME_EXCLUSIONS)
+    rules = list(exclusions) + [
+        # excluded_site and excluded_term are checked against 'network', as before
+        ('network', 'not_in', excluded_site),
+        ('network', 'not_in', excluded_term),
+        closed_sites_rule(site_ferme),
+    ]
+    # Un seul masque combiné, nombre d'exclusions affiché par règle
+    df = apply_exclusions(df, rules)
     df['site'] = df['site'].str.upper()
-    print(f"After excluding closed site: {df.shape[0]} observations")
-    # Export to Excel
-    df.to_excel(output_file, index=False)
-    print(f"Filtered data exported to {output_file}")
+    # Export Excel facultatif, une fois le filtrage terminé
+    if output_file:
+        df.to_excel(output_file, index=False)
+        print(f"Filtered data exported to {output_file}")
 
     return df
 
@@ -83,9 +72,9 @@ def filter_ptme_data(
 pregnancy_url ='https://www.commcarehq.org/a/caris-test/api/odata/cases/v1/8d0dd8d8adef91a238920cad1db6cfd1/feed'
 # Define the headers for the request
 auth = (os.getenv('CC_USERNAME'), os.getenv('CC_PASSWORD'))
-# Define parameters to filter inactive, non-graduated groups
-params = {}
-pregnancy_woman = get_commcare_odata(pregnancy_url, auth, params)
+# Only the women with a household count are used: let CommCare drop the "---" placeholders
+params, _ = odata_filter_params([not_equals('household_collection_date', '---')])
+pregnancy_woman = sync_commcare_odata(pregnancy_url, auth, 'pregnancy', filter_params=params)
 pregnancy_woman = pd.DataFrame(pregnancy_woman)
 pregnancy_woman.columns = [col.replace(' ', '_') for col in pregnancy_woman.columns]
 print(f'This Household dataset has {pregnancy_woman.shape[0]} observations')
@@ -132,11 +121,15 @@ pregnancy.shape[0]
 
 
 # Download charges virales database from "Charges_virales_pediatriques.sql file"
-from caris_fonctions import execute_sql_query
+# Les deux extractions PTME sont indépendantes : elles tournent en parallèle
+from sql_engine import run_sql_files
 env_path = 'dot.env'
-sql_file_path = './PTME_Enceinte.sql'
 
-ptme_enceinte = execute_sql_query(env_path, sql_file_path)
+# Résultats mis en cache pour la journée : les relances du jour n'interrogent plus MySQL
+extracts = run_sql_files(env_path, ['./PTME_Enceinte.sql', './Mastersheet PTME.sql'], use_cache=True)
+ptme_enceinte = extracts['./PTME_Enceinte.sql']
+ptme = extracts['./Mastersheet PTME.sql']
+
 duplicates = ptme_enceinte.columns[ptme_enceinte.columns.duplicated()].tolist()
 if duplicates:
     print("Attention : des colonnes en double ont été trouvées dans le DataFrame.")
@@ -152,10 +145,6 @@ print(ptme_enceinte.head(2))
 # In[7]:
 
 
-env_path = 'dot.env'
-sql_file_path = './Mastersheet PTME.sql'
-
-ptme = execute_sql_query(env_path, sql_file_path)
 duplicates = ptme.columns[ptme.columns.duplicated()].tolist()
 if duplicates:
     print("Attention : des colonnes en double ont été trouvées dans le DataFrame.")
@@ -194,7 +183,7 @@ delinquency.to_excel("delinquency.xlsx", index=False)
 
 
 mapping_p = {'both': 'yes', 'left_only': 'no'}
-woman_in_ptme = creer_colonne_match_conditional(ptme_enceinte, ptme, on='patient_code', nouvelle_colonne='woman_found', mapping=mapping_p).drop_duplicates('patient_code', keep = 'first')
+woman_in_ptme = flag_membership(ptme_enceinte, ptme, on='patient_code', nouvelle_colonne='woman_found', mapping=mapping_p).drop_duplicates('patient_code', keep = 'first')
 woman_in_ptme.shape[0]
 print(woman_in_ptme['woman_found'].value_counts())
 woman_ptme = woman_in_ptme[woman_in_ptme['woman_found']=="yes"]
@@ -207,19 +196,21 @@ print(f"{woman_not_ptme.shape[0]} femmes à retrouver")
 # In[9]:
 
 
-site_ferme = pd.read_excel('sites_fermés.xlsx', engine='openpyxl')
+site_ferme = read_excel_cached('sites_fermés.xlsx', engine='openpyxl')
 # Ensure 'site' column is in uppercase for consistency
 site_ferme.rename(columns={'site_code': 'site'}, inplace=True)
 site_ferme['site'] = site_ferme['site'].str.upper()
 
-ptme_enceinte = ptme[ptme['patient_code'].str.lower().isin(ptme_enceinte['patient_code'].str.lower())]
+# Clés patient_code normalisées, calculées une seule fois par DataFrame
+ptme_keys = PatientKeys(ptme)
+ptme_enceinte = ptme[ptme_keys.isin(PatientKeys(ptme_enceinte))]
 ptme_enceinte['patient_code'] = ptme_enceinte['patient_code'].str.upper()
 
 
 # In[10]:
 
 
-ptme_enceinte = filter_ptme_data(ptme_enceinte)
+ptme_enceinte = filter_ptme_data(ptme_enceinte, output_file='filtered_df2.xlsx')
 
 delinquency = filter_ptme_data(delinquency)
 delinquency.to_excel("delinquency.xlsx",index=True)
@@ -228,7 +219,7 @@ delinquency.to_excel("delinquency.xlsx",index=True)
 
 
 # Assure-toi que les colonnes patient_code existent dans ptme et ptme_enceinte avant
-ptme_enceinte = ptme[ptme['patient_code'].str.lower().isin(ptme_enceinte['patient_code'].str.lower())].copy()
+ptme_enceinte = ptme[ptme_keys.isin(PatientKeys(ptme_enceinte))].copy()
 
 # Mets patient_code en majuscules
 ptme_enceinte['patient_code'] = ptme_enceinte['patient_code'].str.upper()
@@ -243,11 +234,11 @@ ptme_enceinte["is_in_club"] = np.where(
 )
 
 # DataFrames filtrés selon la présence dans le club
-woman_in_club = ptme_enceinte[
-    (ptme_enceinte['is_actually_in_club'] == "yes") | 
-    (ptme_enceinte['in_club'] == "yes")
-]
-ptme_not_in_club = ptme_enceinte[~ptme_enceinte['patient_code'].str.lower().isin(woman_in_club['patient_code'].str.lower())]
+enceinte_keys = PatientKeys(ptme_enceinte)
+in_club = (ptme_enceinte['is_actually_in_club'] == "yes") | (ptme_enceinte['in_club'] == "yes")
+woman_in_club = ptme_enceinte[in_club]
+club_keys = enceinte_keys.subset(in_club)
+ptme_not_in_club = ptme_enceinte[~enceinte_keys.isin(club_keys)]
 ptme_not_in_club['patient_code'] = ptme_not_in_club['patient_code'].str.upper()
 print(f'{woman_in_club.shape[0]} femmes enceintes font partie du Programme PTME pour cette période')
 print(f'{ptme_not_in_club.shape[0]} femmes non en club')
@@ -272,8 +263,7 @@ ptme_not_in_club.to_excel('ptme_not_in_club.xlsx', index=False)
 # file_path_patient = first_part + 'PTME WITH PATIENT CODE ' + datetime.now().strftime("%Y-%m-%d") + ".xlsx"
     # Étape 2 : Charger le fichier téléchargé
 today_str = datetime.today().strftime('%Y-%m-%d')
-path = f"~/Downloads/caris-dashboard-app/data/PTME WITH PATIENT CODE {today_str}.xlsx"
-caseid = pd.read_excel(os.path.expanduser(path))
+caseid = load_export("PTME WITH PATIENT CODE", today_str)
 caseid = caseid.rename(columns={
     'caseid': 'case_id',
     'health_id': 'patient_code'
@@ -290,7 +280,7 @@ ajout_url ='https://www.commcarehq.org/a/caris-test/api/odata/forms/v1/9387f1f83
 auth = (os.getenv('CC_USERNAME'), os.getenv('CC_PASSWORD'))
 # Define parameters to filter inactive, non-graduated groups
 params = {}
-ajout = get_commcare_odata(ajout_url, auth, params)
+ajout = sync_commcare_odata(ajout_url, auth, 'ajout_ptme', key='formid', watermark_column='received_on', filter_params=params)
 ajout = pd.DataFrame(ajout)
 ajout.columns = [col.replace(' ', '_') for col in ajout.columns]
 # Assuming 'df' is your DataFrame
@@ -330,7 +320,8 @@ print(f'The merged dataset has {woman_in_club_with_casied.shape[0]} observations
 woman_in_club_with_casied.head(2)
 
 
-ptme_sans_comptage = woman_in_club[~woman_in_club['patient_code'].str.lower().isin(pregnancy['patient_code'].str.lower())]
+pregnancy_keys = PatientKeys(pregnancy)
+ptme_sans_comptage = woman_in_club[~club_keys.isin(pregnancy_keys)]
 ptme_sans_comptage['patient_code'] = ptme_sans_comptage['patient_code'].str.upper()
 ptme_sans_comptage.shape[0]
 
@@ -340,7 +331,7 @@ ptme_sans_comptage.to_excel('ptme_sans_comptage.xlsx', index=False)
 # In[36]:
 
 
-ptme_avec_comptage = woman_in_club[woman_in_club['patient_code'].str.lower().isin(pregnancy['patient_code'].str.lower())]
+ptme_avec_comptage = woman_in_club[club_keys.isin(pregnancy_keys)]
 ptme_avec_comptage['patient_code'] = ptme_avec_comptage['patient_code'].str.upper()
 ptme_avec_comptage.shape[0]
 
@@ -362,7 +353,7 @@ ptme_not_in_club.to_excel('ptme_not_in_club.xlsx', index=False)
 # In[40]:
 
 
-comptage = pregnancy[pregnancy['patient_code'].str.lower().isin(woman_in_club['patient_code'].str.lower())]
+comptage = pregnancy[pregnancy_keys.isin(club_keys)]
 comptage['patient_code'] = comptage['patient_code'].str.upper()
 
 # Jointure interne sur le code patient en minuscules
@@ -382,7 +373,7 @@ ptme_enceinte_merge.to_excel('ptme_enceinte_merge.xlsx', index=False)
 
 
 mapping_p = {'both': 'no', 'left_only': 'yes'}
-comptage = creer_colonne_match_conditional(pregnancy, woman_in_club, on='patient_code', nouvelle_colonne='menage', mapping=mapping_p).drop_duplicates('patient_code', keep = 'first')
+comptage = flag_membership(pregnancy, woman_in_club, on='patient_code', nouvelle_colonne='menage', mapping=mapping_p).drop_duplicates('patient_code', keep = 'first')
 comptage.shape[0]
 print(comptage['menage'].value_counts())
 ptme_comptage_yes = comptage[comptage['menage']=="yes"]
@@ -398,7 +389,7 @@ hh_ptme_url ='https://www.commcarehq.org/a/caris-test/api/odata/cases/v1/ee225c4
 auth = (os.getenv('CC_USERNAME'), os.getenv('CC_PASSWORD'))
 # Define parameters to filter inactive, non-graduated groups
 params = {}
-hh_ptme = get_commcare_odata(hh_ptme_url, auth, params)
+hh_ptme = sync_commcare_odata(hh_ptme_url, auth, 'hh_ptme', filter_params=params)
 hh_ptme = pd.DataFrame(hh_ptme)
 hh_ptme.columns = [col.replace(' ', '_') for col in hh_ptme.columns]
 print(f'This Household dataset has {hh_ptme.shape[0]} observations')
@@ -421,7 +412,8 @@ print(hh_ptme.head(2))
 
 
 # Assure-toi que les colonnes patient_code existent dans ptme et ptme_enceinte avant
-hh_depistage = hh_ptme[hh_ptme['patient_code'].str.lower().isin(woman_in_club['patient_code'].str.lower())]
+hh_ptme_keys = PatientKeys(hh_ptme)
+hh_depistage = hh_ptme[hh_ptme_keys.isin(club_keys)]
 # Mets patient_code en majuscules
 hh_depistage.shape[0]
 
@@ -436,7 +428,7 @@ hh_depistage.to_excel('hh_depistage.xlsx', index=False)
 
 
 # Assure-toi que les colonnes patient_code existent dans ptme et ptme_enceinte avant
-ptme_depistage = woman_in_club[woman_in_club['patient_code'].str.lower().isin(hh_ptme['patient_code'].str.lower())].drop_duplicates('patient_code', keep = 'first')
+ptme_depistage = woman_in_club[club_keys.isin(hh_ptme_keys)].drop_duplicates('patient_code', keep = 'first')
 # Mets patient_code en majuscules
 ptme_depistage.shape[0]
 
@@ -445,7 +437,7 @@ ptme_depistage.shape[0]
 
 
 # Assure-toi que les colonnes patient_code existent dans ptme et ptme_enceinte avant
-ptme_no_depistage = woman_in_club[~woman_in_club['patient_code'].str.lower().isin(hh_ptme['patient_code'].str.lower())].drop_duplicates('patient_code', keep = 'first')
+ptme_no_depistage = woman_in_club[~club_keys.isin(hh_ptme_keys)].drop_duplicates('patient_code', keep = 'first')
 # Mets patient_code en majuscules
 ptme_no_depistage.shape[0]
 
@@ -586,3 +578,10 @@ save_dataframes_excel(
 	sheet_names=['FEMMES ENCEINTES', 'FE en club', 'FE non club', 'FE sans comptage']
 )
 
+
+# In[55]:
+
+
+# Extractions PTME servies par le cache du jour ou relues depuis MySQL
+from sql_cache import sql_cache_stats
+sql_cache_stats()
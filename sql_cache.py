@@ -0,0 +1,154 @@
+import os
+import re
+import glob
+import time
+import hashlib
+from datetime import date
+
+import pandas as pd
+import pyarrow.parquet as pq
+
+from export_cache import _write_cache
+from sql_engine import _connection_text, execute_sql_query, iter_sql_chunks, read_sql_file, write_chunks_to_parquet
+
+# Results of the MySQL extracts, next to the pipelines
+SQL_CACHE_DIR = os.path.join("data", ".sql_cache")
+
+# Hits and misses of the current run, see sql_cache_stats
+_stats = {'hits': 0, 'misses': 0}
+
+
+def normalize_sql(sql: str) -> str:
+    """Query text used in the cache key: whitespace runs collapsed and trailing ';' removed."""
+    return re.sub(r'\s+', ' ', sql).strip().rstrip(';').strip()
+
+
+def _cache_base(env_path, sql_file_path, options, cache_dir):
+    """Cache file name (without extension) of one query run with `options` on one database."""
+    signature = f"{_connection_text(env_path)}|{normalize_sql(read_sql_file(sql_file_path))}|{options!r}"
+    digest = hashlib.sha1(signature.encode('utf-8')).hexdigest()[:16]
+    stem = os.path.splitext(os.path.basename(sql_file_path))[0].replace(' ', '_')
+    return os.path.join(cache_dir, f"{stem}_{digest}")
+
+
+def _is_fresh(path, freshness):
+    """
+    Whether a cached result can still be used
+
+    freshness: 'daily' (computed today), a number of seconds (TTL) or 'never' (never expires)
+    """
+    mtime = os.path.getmtime(path)
+    if freshness == 'never':
+        return True
+    if freshness == 'daily':
+        return date.fromtimestamp(mtime) == date.today()
+    if isinstance(freshness, (int, float)) and not isinstance(freshness, bool):
+        return time.time() - mtime < freshness
+    raise ValueError(f"Unknown freshness policy: {freshness!r} ('daily', 'never' or a number of seconds)")
+
+
+def _find_fresh(cache_base, freshness):
+    """Return the cached file of `cache_base` if it is still fresh, else None."""
+    for cached in (cache_base + '.parquet', cache_base + '.pkl'):
+        if os.path.exists(cached) and _is_fresh(cached, freshness):
+            return cached
+    return None
+
+
+def cached_sql_query(env_path: str, sql_file_path: str, params=None, exclusions=None, freshness='daily',
+                     cache_dir: str = SQL_CACHE_DIR) -> pd.DataFrame:
+    """
+    execute_sql_query with a result cache
+
+    Results are keyed on the database, the normalized query text and its
+    parameters. While a stored result is fresh, it is loaded from disk and
+    the database is not contacted.
+
+    Args:
+        env_path (str): Env file with MYSQL_USER, MYSQL_PASSWORD, MYSQL_HOST, MYSQL_DB
+        sql_file_path (str): .sql file to run
+        params (dict | list): Parameters bound to the query
+        exclusions (list): Exclusion rules evaluated by MySQL, see extract_filters.push_exclusions
+        freshness: 'daily' (once per day), a TTL in seconds, or 'never' (until invalidated)
+        cache_dir (str): Folder holding the stored results
+
+    Returns:
+        pd.DataFrame: Same result as execute_sql_query
+    """
+    cache_base = _cache_base(env_path, sql_file_path, ('query', params, exclusions), cache_dir)
+    cached = _find_fresh(cache_base, freshness)
+    if cached is not None:
+        _stats['hits'] += 1
+        df = pd.read_parquet(cached) if cached.endswith('.parquet') else pd.read_pickle(cached)
+        print(f"SQL cache hit: {os.path.basename(sql_file_path)} ({df.shape[0]} rows)")
+        return df
+
+    _stats['misses'] += 1
+    start = time.perf_counter()
+    df = execute_sql_query(env_path, sql_file_path, params=params, exclusions=exclusions)
+    os.makedirs(cache_dir, exist_ok=True)
+    # Extracts with duplicated column names cannot go to Parquet: _write_cache falls back to pickle.
+    # The new file replaces the old one atomically; only a copy in the other format is left to drop
+    written = _write_cache(df, cache_base)
+    for stale in glob.glob(cache_base + '.*'):
+        if stale != written:
+            os.remove(stale)
+    print(f"SQL cache miss: {os.path.basename(sql_file_path)} run in {time.perf_counter() - start:.1f}s and cached")
+    return df
+
+
+def cached_sql_chunks(env_path: str, sql_file_path: str, chunksize: int = 50000, dtype=None, parse_dates=None,
+                      exclusions=None, freshness='daily', cache_dir: str = SQL_CACHE_DIR):
+    """
+    iter_sql_chunks with a result cache
+
+    On a miss the chunks are streamed from MySQL and appended to the cache file
+    as they are yielded; the file only becomes visible once the query has been
+    read to the end. On a hit the chunks are read back from the Parquet file.
+    Duplicated column names keep their first occurrence.
+
+    Yields:
+        pd.DataFrame: Consecutive chunks of the result
+    """
+    cache_base = _cache_base(env_path, sql_file_path, ('chunks', dtype, parse_dates, exclusions), cache_dir)
+    cached = _find_fresh(cache_base, freshness)
+    if cached is not None:
+        _stats['hits'] += 1
+        print(f"SQL cache hit: {os.path.basename(sql_file_path)}")
+        for batch in pq.ParquetFile(cached).iter_batches(batch_size=chunksize):
+            yield batch.to_pandas()
+        return
+
+    _stats['misses'] += 1
+    chunks = iter_sql_chunks(env_path, sql_file_path, chunksize, dtype, parse_dates, exclusions)
+    yield from write_chunks_to_parquet(chunks, cache_base + '.parquet', dtype)
+    print(f"SQL cache miss: {os.path.basename(sql_file_path)} streamed and cached")
+
+
+def invalidate_sql_cache(sql_file_path: str = None, cache_dir: str = SQL_CACHE_DIR):
+    """
+    Drop stored results so the next run queries MySQL again
+
+    Args:
+        sql_file_path (str): Only drop the results of this .sql file; None drops everything
+        cache_dir (str): Folder holding the stored results
+    """
+    if sql_file_path is None:
+        pattern = '*'
+    else:
+        pattern = os.path.splitext(os.path.basename(sql_file_path))[0].replace(' ', '_') + '_*'
+    removed = glob.glob(os.path.join(cache_dir, pattern))
+    for cached in removed:
+        os.remove(cached)
+    print(f"{len(removed)} cached SQL result(s) removed")
+
+
+def sql_cache_stats(reset: bool = False) -> dict:
+    """Print and return the cache hits and misses of the current run."""
+    stats = dict(_stats)
+    total = stats['hits'] + stats['misses']
+    print(f"SQL cache: {stats['hits']} hit(s), {stats['misses']} miss(es)"
+          + (f" ({stats['hits'] / total:.0%} hits)" if total else ""))
+    if reset:
+        _stats.update(hits=0, misses=0)
+    return stats
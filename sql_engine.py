@@ -0,0 +1,281 @@
+import os
+import time
+import atexit
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from dotenv import load_dotenv
+from sqlalchemy import create_engine
+
+from extract_filters import push_exclusions
+
+# One engine (and connection pool) per database, shared by every query of the run
+_engines = {}
+_engines_lock = threading.Lock()
+
+
+def _connection_text(env_path: str) -> str:
+    """Build the MySQL URL from the env file."""
+    load_dotenv(env_path)
+    user = os.getenv('MYSQL_USER')
+    password = os.getenv('MYSQL_PASSWORD')
+    host = os.getenv('MYSQL_HOST')
+    db = os.getenv('MYSQL_DB')
+    if not all([user, password, host, db]):
+        raise RuntimeError("Variables SQL manquantes dans l'env.")
+    return f'mysql+pymysql://{user}:{password}@{host}/{db}'
+
+
+def get_engine(env_path: str = 'dot.env'):
+    """
+    Return the pooled SQLAlchemy engine of the database described in `env_path`
+
+    The engine is created on first use and then reused for the whole process:
+    connections are kept open between queries, checked with a ping before
+    reuse (pool_pre_ping) and recycled after an hour so the RDS server never
+    hands back a stale one.
+    """
+    conn_text = _connection_text(env_path)
+    with _engines_lock:
+        engine = _engines.get(conn_text)
+        if engine is None:
+            engine = create_engine(conn_text, pool_size=5, max_overflow=5, pool_pre_ping=True, pool_recycle=3600)
+            _engines[conn_text] = engine
+    return engine
+
+
+@atexit.register
+def dispose_engines():
+    """Close every pooled connection (called automatically at exit)."""
+    with _engines_lock:
+        for engine in _engines.values():
+            engine.dispose()
+        _engines.clear()
+
+
+def read_sql_file(sql_file_path: str) -> str:
+    """Read a .sql extract, without its 'use caris_db;' line."""
+    with open(sql_file_path, 'r', encoding="utf-8") as f:
+        return f.read().replace('use caris_db;', '')
+
+
+def execute_sql_query(env_path: str, sql_file_path: str, connection=None, params=None, exclusions=None) -> pd.DataFrame:
+    """
+    Exécute un fichier SQL et retourne un DataFrame.
+
+    Args:
+        env_path (str): Fichier env avec MYSQL_USER, MYSQL_PASSWORD, MYSQL_HOST, MYSQL_DB
+        sql_file_path (str): Fichier .sql à exécuter
+        connection: Connexion ouverte par sql_session; sinon une connexion du pool est empruntée
+        params (dict | list): Paramètres liés à la requête (style pymysql, %(nom)s)
+        exclusions (list): Règles d'exclusion évaluées par MySQL (voir extract_filters.OEV_EXCLUSIONS)
+    """
+    sql_query = read_sql_file(sql_file_path)
+    if exclusions:
+        sql_query, params = push_exclusions(sql_query, exclusions, params)
+    if connection is not None:
+        return pd.read_sql_query(sql_query, connection, params=params)
+    with get_engine(env_path).connect() as conn:
+        return pd.read_sql_query(sql_query, conn, params=params)
+
+
+@contextmanager
+def sql_session(env_path: str = 'dot.env'):
+    """
+    Run several .sql files over one database connection
+
+    Usage:
+        with sql_session('dot.env') as run:
+            ptme_enceinte = run('./PTME_Enceinte.sql')
+            ptme = run('./Mastersheet PTME.sql')
+    """
+    with get_engine(env_path).connect() as conn:
+        yield lambda sql_file_path: execute_sql_query(env_path, sql_file_path, connection=conn)
+
+
+def run_sql_files(env_path: str, sql_file_paths, max_workers: int = 4, use_cache: bool = False,
+                  freshness='daily') -> dict:
+    """
+    Run independent .sql files concurrently on the pooled engine
+
+    Each file gets its own pooled connection, so the extract phase lasts as
+    long as the slowest query instead of the sum of all of them.
+
+    Args:
+        env_path (str): Env file with MYSQL_USER, MYSQL_PASSWORD, MYSQL_HOST, MYSQL_DB
+        sql_file_paths (list): .sql files to run
+        max_workers (int): Queries running at the same time (at most the pool size)
+        use_cache (bool): Go through the result cache (see sql_cache.cached_sql_query)
+            instead of always querying MySQL
+        freshness: Policy of the cache when use_cache is set: 'daily', a TTL in
+            seconds or 'never' (kept until invalidated)
+
+    Returns:
+        dict: {sql_file_path: pd.DataFrame}, in the order of sql_file_paths
+    """
+    get_engine(env_path)  # create the engine once, before the threads race for it
+
+    def timed(sql_file_path):
+        start = time.perf_counter()
+        if not use_cache:
+            df = execute_sql_query(env_path, sql_file_path)
+        else:
+            from sql_cache import cached_sql_query  # sql_cache builds on this module
+            df = cached_sql_query(env_path, sql_file_path, freshness=freshness)
+        print(f"{os.path.basename(sql_file_path)}: {df.shape[0]} rows in {time.perf_counter() - start:.1f}s")
+        return df
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(sql_file_paths)))) as executor:
+        futures = {path: executor.submit(timed, path) for path in sql_file_paths}
+        results = {path: future.result() for path, future in futures.items()}
+    print(f"{len(results)} SQL extract(s) done in {time.perf_counter() - start:.1f}s")
+    return results
+
+
+def iter_sql_chunks(env_path: str, sql_file_path: str, chunksize: int = 50000, dtype=None, parse_dates=None,
+                    exclusions=None):
+    """
+    Stream the result of a .sql file chunk by chunk
+
+    The query runs on an unbuffered server-side cursor (stream_results, i.e.
+    pymysql's SSCursor): rows stay on the MySQL server until pandas asks for
+    the next chunk, so memory holds one chunk at a time and the caller can
+    start working before the query has returned every row.
+
+    Args:
+        env_path (str): Env file with MYSQL_USER, MYSQL_PASSWORD, MYSQL_HOST, MYSQL_DB
+        sql_file_path (str): .sql file to run
+        chunksize (int): Rows per chunk
+        dtype (dict): Column types applied to every chunk, e.g. {'age': 'Int64'}
+        parse_dates (list): Columns converted to datetime64 in every chunk
+        exclusions (list): Exclusion rules evaluated by MySQL, see extract_filters.push_exclusions
+
+    Yields:
+        pd.DataFrame: Consecutive chunks of the result
+    """
+    sql_query = read_sql_file(sql_file_path)
+    params = None
+    if exclusions:
+        sql_query, params = push_exclusions(sql_query, exclusions)
+    with get_engine(env_path).connect() as conn:
+        conn = conn.execution_options(stream_results=True, max_row_buffer=chunksize)
+        yield from pd.read_sql_query(sql_query, conn, params=params, chunksize=chunksize, dtype=dtype,
+                                     parse_dates=parse_dates)
+
+
+def _declared_type(dtype):
+    """Arrow type of a pandas dtype given in dtype=, or None when it says nothing (object)."""
+    if isinstance(dtype, pd.CategoricalDtype) or (isinstance(dtype, str) and dtype == 'category'):
+        # Wide indices: later chunks may bring many more labels than the first one
+        return pa.dictionary(pa.int32(), pa.string())
+    empty = pd.DataFrame({'column': pd.Series([], dtype=dtype)})
+    arrow_type = pa.Schema.from_pandas(empty, preserve_index=False).field('column').type
+    return None if pa.types.is_null(arrow_type) else arrow_type
+
+
+def _chunk_schema(table, dtype=None):
+    """
+    Schema of the whole file, from the first chunk and the declared column types
+
+    Columns listed in dtype get the declared type, whatever the first chunk holds.
+    The others take the type of the first chunk; those that are entirely empty
+    there have no type yet and are stored as text.
+    """
+    declared = {}
+    if isinstance(dtype, dict):
+        declared = {col: _declared_type(col_dtype) for col, col_dtype in dtype.items()}
+    fields, untyped = [], []
+    for field in table.schema:
+        arrow_type = declared.get(field.name)
+        if arrow_type is None and pa.types.is_null(field.type):
+            arrow_type = pa.string()
+            untyped.append(field.name)
+        fields.append(pa.field(field.name, arrow_type or field.type))
+    if untyped:
+        print(f"Empty in the first chunk, stored as text (declare them in dtype= if not): {', '.join(untyped)}")
+    return pa.schema(fields)
+
+
+def write_chunks_to_parquet(chunks, output_path: str, dtype=None):
+    """
+    Append chunks to a Parquet file while passing them on to the caller
+
+    Each chunk becomes a row group. Duplicated column names (frequent in the
+    mastersheet extracts) keep their first occurrence, as the pipelines do
+    after loading. The file is written next to output_path and only replaces
+    it once every chunk has been read; a read stopped early leaves nothing behind.
+
+    Args:
+        chunks: Iterable of DataFrames, e.g. iter_sql_chunks(...)
+        output_path (str): Parquet file to write
+        dtype (dict): Declared column types, see _chunk_schema. Columns that
+            may be empty in the first chunk should be listed here
+
+    Yields:
+        pd.DataFrame: The chunks, without their duplicated columns
+    """
+    partial = output_path + '.part'
+    writer = None
+    complete = False
+    try:
+        for chunk in chunks:
+            chunk = chunk.loc[:, ~chunk.columns.duplicated()]
+            table = pa.Table.from_pandas(chunk, preserve_index=False)
+            if writer is None:
+                directory = os.path.dirname(output_path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                writer = pq.ParquetWriter(partial, _chunk_schema(table, dtype))
+            writer.write_table(table.cast(writer.schema))
+            yield chunk
+        complete = True
+    finally:
+        if writer is not None:
+            writer.close()
+            if complete:
+                os.replace(partial, output_path)
+            else:
+                os.remove(partial)
+
+
+def stream_sql_to_parquet(env_path: str, sql_file_path: str, output_path: str, chunksize: int = 50000,
+                          dtype=None, parse_dates=None):
+    """
+    Write the result of a .sql file to Parquet without holding it in memory
+
+    Chunks of iter_sql_chunks are written one by one, see write_chunks_to_parquet.
+    Nothing is read back: the returned dataset loads only the columns and
+    rows that are asked for.
+
+    Args:
+        env_path (str): Env file with MYSQL_USER, MYSQL_PASSWORD, MYSQL_HOST, MYSQL_DB
+        sql_file_path (str): .sql file to run
+        output_path (str): Parquet file to write
+        chunksize (int): Rows per chunk / row group
+        dtype (dict): Column types, see iter_sql_chunks. They also fix the
+            types of the file: give them for columns that may be empty in the first chunk
+        parse_dates (list): Columns converted to datetime64
+
+    Returns:
+        pyarrow.dataset.Dataset: Lazy view of output_path, e.g.
+            .to_table(columns=[...]).to_pandas() or .to_batches();
+            None when the query returns no row
+    """
+    total = 0
+    start = time.perf_counter()
+    chunks = iter_sql_chunks(env_path, sql_file_path, chunksize, dtype, parse_dates)
+    for chunk in write_chunks_to_parquet(chunks, output_path, dtype):
+        total += len(chunk)
+        print(f"Written {len(chunk)} rows to {output_path}. Total: {total}")
+
+    if not total:
+        print(f"{os.path.basename(sql_file_path)} returned no row, nothing written")
+        return None
+    print(f"{os.path.basename(sql_file_path)}: {total} rows streamed in {time.perf_counter() - start:.1f}s")
+    return ds.dataset(output_path, format='parquet')
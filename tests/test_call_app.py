@@ -0,0 +1,75 @@
+import importlib.util
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+for module in ("matplotlib", "plotly", "pymysql", "selenium", "webdriver_manager"):
+    pytest.importorskip(module)
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(scope="module")
+def call_app():
+    spec = importlib.util.spec_from_file_location("call_app", os.path.join(ROOT, "call-app.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def reference_pivot(df, value_column, mois_ordre):
+    """Layout of the per-table pd.pivot_table calls the cube replaced."""
+    # object dtype: with pandas' str dtype, an empty margin cannot be filled with 0
+    df = df.astype({value_column: object})
+    pivot_table = pd.pivot_table(
+        df, values=value_column, index=['mois'], columns=['commune', 'Trouvé'],
+        aggfunc=lambda x: len(x), margins=True, margins_name='Total', observed=True,
+    ).fillna(0)
+    pivot_table = pivot_table.reindex(mois_ordre).fillna(0)
+    return pivot_table[(pivot_table != 0).any(axis=1)]
+
+
+# One large fixture, and small sparse ones where some (commune, Trouvé) pairs are
+# missing from a slice: unstack then yields the columns out of order
+@pytest.fixture(scope="module", params=[(19, 3000), (2, 30), (3, 30), (5, 30), (8, 30)], ids=lambda p: f"seed{p[0]}-n{p[1]}")
+def forms(call_app, request):
+    seed, n = request.param
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        'mois': rng.choice(call_app.mois_ordre + [None], n),
+        'commune': rng.choice(['Cap', 'Anse', 'Borgne', None], n),
+        'Trouvé': rng.choice(['Oui', 'Non'], n),
+        'Programme': rng.choice(['OEV', 'PTME'], n),
+        'Type': rng.choice(['Appel', 'Visite'], n),
+        'patient_code': rng.choice(['A1', 'B2', None], n),
+        'formid': rng.choice(['f1', 'f2', None], n, p=[0.45, 0.45, 0.1]),
+    })
+    # Rows sorted so that communes first appear out of alphabetical order
+    return df.sort_values('Programme', kind='stable').reset_index(drop=True)
+
+
+@pytest.mark.parametrize("value_column,programme,types", [
+    ('formid', None, ['Visite']),
+    ('patient_code', None, ['Appel']),
+    ('patient_code', None, ['Visite']),
+    ('patient_code', None, ['Appel', 'Visite']),
+    ('patient_code', 'OEV', ['Visite']),
+    ('patient_code', 'PTME', ['Visite']),
+    ('patient_code', 'PTME', ['Appel']),
+    ('patient_code', 'OEV', ['Appel']),
+])
+def test_pivot_from_cube_matches_pivot_table(call_app, forms, value_column, programme, types):
+    cube = call_app.build_performance_cube(forms)
+    subset = forms[forms['Type'].isin(types)]
+    if programme is not None:
+        subset = subset[subset['Programme'] == programme]
+
+    expected = reference_pivot(subset, value_column, call_app.mois_ordre)
+    result = call_app.pivot_from_cube(cube, value_column, programme=programme, types=types)
+
+    # Same columns in the same order, then same values
+    assert list(result.columns) == list(expected.columns)
+    assert list(result.index) == list(expected.index)
+    np.testing.assert_array_equal(result.to_numpy(dtype=float), expected.to_numpy(dtype=float))
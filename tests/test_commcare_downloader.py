@@ -0,0 +1,42 @@
+import os
+import time
+
+import pytest
+
+pytest.importorskip("selenium")
+
+import commcare_downloader
+from commcare_downloader import build_pattern_with_today, today_str
+from export_index import ExportIndex
+
+VISITE = "Caris Health Agent - Enfant - Visite Enfant"
+
+
+@pytest.mark.parametrize("base, stem", [
+    (VISITE, f"{VISITE} (created 2021-01-01)"),
+    ("household_child", "household_child"),
+    ("muso_groupes", "muso_groupes (created 2025-03-25)"),
+])
+def test_browser_duplicates_match_every_kind_of_export(base, stem):
+    pattern = build_pattern_with_today(base)
+    today = today_str()
+
+    assert pattern.match(f"{stem} {today}.xlsx")
+    assert pattern.match(f"{stem} {today} (1).xlsx")
+    assert pattern.match(f"{stem} {today} (12).xlsx")
+    assert not pattern.match(f"{stem} {today} (copy).xlsx")
+    assert not pattern.match(f"{stem} 2001-01-01.xlsx")
+
+
+def test_duplicate_of_a_created_export_is_indexed(tmp_path):
+    first = tmp_path / f"{VISITE} (created 2021-01-01) {today_str()}.xlsx"
+    second = tmp_path / f"{VISITE} (created 2021-01-01) {today_str()} (1).xlsx"
+    first.write_bytes(b"first")
+    second.write_bytes(b"second")
+    # The browser saves the second copy later
+    os.utime(first, (time.time() - 60, time.time() - 60))
+
+    index = ExportIndex(str(tmp_path), {b: build_pattern_with_today(b) for b in commcare_downloader.EXPECTED_BASES})
+
+    assert index.latest(VISITE) == str(second)
+    assert index.duplicates() == {VISITE: [first.name, second.name]}
@@ -0,0 +1,84 @@
+import os
+import subprocess
+import sys
+
+import pandas as pd
+import pytest
+
+from export_cache import _cache_prefix, _write_cache
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_cache_is_written_without_leftovers(tmp_path):
+    base = str(tmp_path / 'export')
+    df = pd.DataFrame({'caseid': ['a', 'b'], 'age': [3, 4]})
+
+    assert _write_cache(df, base) == base + '.parquet'
+    assert os.listdir(tmp_path) == ['export.parquet']
+    pd.testing.assert_frame_equal(pd.read_parquet(base + '.parquet'), df)
+
+
+def test_pickle_fallback(tmp_path):
+    base = str(tmp_path / 'export')
+    # Duplicated headers cannot go to Parquet
+    df = pd.DataFrame([[1, 2]], columns=['site', 'site'])
+
+    assert _write_cache(df, base) == base + '.pkl'
+    assert os.listdir(tmp_path) == ['export.pkl']
+    pd.testing.assert_frame_equal(pd.read_pickle(base + '.pkl'), df)
+
+
+def test_interrupted_write_keeps_the_previous_file(tmp_path, monkeypatch):
+    base = str(tmp_path / 'export')
+    previous = pd.DataFrame({'caseid': ['a']})
+    _write_cache(previous, base)
+
+    def fail_midway(self, path, **kwargs):
+        with open(path, 'wb') as f:
+            f.write(b'PAR1 half written')
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(pd.DataFrame, 'to_parquet', fail_midway)
+    with pytest.raises(KeyboardInterrupt):
+        _write_cache(pd.DataFrame({'caseid': ['a', 'b']}), base)
+
+    assert os.listdir(tmp_path) == ['export.parquet']
+    pd.testing.assert_frame_equal(pd.read_parquet(base + '.parquet'), previous)
+
+
+KEY_SCRIPT = """
+from export_cache import _cache_prefix
+wanted = {'caseid', 'dob', 'gender'}
+print(_cache_prefix('export.xlsx', {'usecols': lambda col: col in wanted or any(c.isdigit() for c in col),
+                                    'sheet_name': 0}))
+"""
+
+
+def cache_key_in_new_interpreter(hash_seed):
+    env = {**os.environ, 'PYTHONHASHSEED': str(hash_seed)}
+    return subprocess.run([sys.executable, '-c', KEY_SCRIPT], cwd=REPO_DIR, env=env,
+                          capture_output=True, text=True, check=True).stdout.strip()
+
+
+def test_callable_options_give_the_same_key_in_every_run():
+    keys = {cache_key_in_new_interpreter(seed) for seed in (0, 1, 2)}
+    assert len(keys) == 1
+
+
+def test_callable_options_are_told_apart():
+    def key(usecols):
+        return _cache_prefix('export.xlsx', {'usecols': usecols})
+
+    assert key(lambda col: col.startswith('a')) == key(lambda col: col.startswith('a'))
+    assert key(lambda col: col.startswith('a')) != key(lambda col: col.startswith('b'))
+    assert key(lambda col: any(c == 'a' for c in col)) != key(lambda col: any(c == 'b' for c in col))
+
+
+def test_objects_without_a_stable_repr_are_rejected():
+    class Columns:
+        def __call__(self, col):
+            return True
+
+    with pytest.raises(TypeError):
+        _cache_prefix('export.xlsx', {'usecols': Columns()})
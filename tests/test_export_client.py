@@ -0,0 +1,121 @@
+import os
+from datetime import datetime
+
+import pytest
+
+from commcare_session import CommCareSession
+from export_client import CommCareExportClient, ExportClientError
+from export_stub_server import StubCommCareServer
+
+VISITE_ENFANT = "7d960d6c03d9d6c35a8d083c288e7c8d"
+HOUSEHOLD_CHILD = "abc123"
+MISNAMED = "def456"
+# Larger than export_client.CHUNK_SIZE: the file arrives in several blocks
+CONTENT = os.urandom(3 * 1024 * 1024 + 17)
+
+
+@pytest.fixture
+def stub():
+    exports = {
+        VISITE_ENFANT: ("Caris Health Agent - Enfant - Visite Enfant (created 2021-01-01)", CONTENT),
+        HOUSEHOLD_CHILD: ("household_child", b"household"),
+        MISNAMED: ("Rapport sans rapport", b"other"),
+    }
+    with StubCommCareServer(exports, polls_before_ready=2) as server:
+        yield server
+
+
+def session_of(stub, tmp_path, password=None):
+    return CommCareSession(stub.username, password or stub.password, base_url=stub.base_url,
+                           session_file=str(tmp_path / "cookies.json"))
+
+
+def today_name(name):
+    return f"{name} {datetime.now().strftime('%Y-%m-%d')}.xlsx"
+
+
+def test_login_requires_the_csrf_token_and_credentials(stub):
+    client = CommCareExportClient(stub.base_url)
+    with pytest.raises(ExportClientError):
+        client.login(stub.username, "wrong")
+
+    client.login(stub.username, stub.password)
+    assert client.is_authenticated(stub.base_url + "/a/caris-test/dashboard/")
+    assert len(stub.sessions) == 1
+
+
+def test_export_is_prepared_polled_and_streamed(stub, tmp_path):
+    client = CommCareExportClient(stub.base_url, poll_interval=0.01, timeout=10)
+    client.login(stub.username, stub.password)
+
+    path = client.export(stub.export_url(VISITE_ENFANT, "form"), str(tmp_path))
+
+    assert os.path.basename(path) == today_name("Caris Health Agent - Enfant - Visite Enfant (created 2021-01-01)")
+    with open(path, "rb") as f:
+        assert f.read() == CONTENT
+    assert os.listdir(tmp_path) == [os.path.basename(path)]
+    [job] = stub.jobs.values()
+    assert job["polls"] == stub.polls_before_ready + 1
+
+
+def test_unknown_export_is_refused(stub, tmp_path):
+    client = CommCareExportClient(stub.base_url, poll_interval=0.01, timeout=10)
+    client.login(stub.username, stub.password)
+
+    with pytest.raises(ExportClientError):
+        client.export(stub.export_url("0badc0de", "case"), str(tmp_path))
+
+
+def test_saved_session_is_reused(stub, tmp_path):
+    session_of(stub, tmp_path).http_session()
+    assert len(stub.sessions) == 1
+    assert os.path.exists(tmp_path / "cookies.json")
+
+    # A later run: the saved cookies are still valid, no new login
+    session_of(stub, tmp_path, password="not used").http_session()
+    assert len(stub.sessions) == 1
+
+
+def test_browser_fallback_when_http_fails(stub, tmp_path):
+    session = session_of(stub, tmp_path)
+    calls = []
+
+    path = session.download_export(stub.export_url("0badc0de", "case"), str(tmp_path),
+                                   browser_download=lambda: calls.append("browser") or "from-browser")
+
+    assert calls == ["browser"]
+    assert path == "from-browser"
+    with pytest.raises(ExportClientError):
+        session.download_export(stub.export_url("0badc0de", "case"), str(tmp_path))
+
+
+def test_download_exports_http_classifies_the_files(stub, tmp_path, monkeypatch):
+    pytest.importorskip("selenium")
+    import commcare_downloader
+
+    visite, household = "Caris Health Agent - Enfant - Visite Enfant", "household_child"
+    misnamed, unknown = "Caris Health Agent - Enfant - APPELS OEV", "All Gardens"
+    monkeypatch.setattr(commcare_downloader, "EXPORT_URLS", {
+        visite: stub.export_url(VISITE_ENFANT, "form"),
+        household: stub.export_url(HOUSEHOLD_CHILD, "case"),
+        misnamed: stub.export_url(MISNAMED, "form"),
+        unknown: stub.export_url("0badc0de", "case"),
+    })
+    download_dir = str(tmp_path / "exports")
+    session = session_of(stub, tmp_path)
+    monkeypatch.setattr(session, "export_client",
+                        lambda **kwargs: CommCareExportClient(stub.base_url, session=session.http_session(),
+                                                              poll_interval=0.01, timeout=10))
+
+    remaining = commcare_downloader.download_exports_http([visite, household, misnamed, unknown], session,
+                                                          download_dir)
+
+    assert remaining == [misnamed, unknown]
+    index = commcare_downloader.get_export_index(download_dir)
+    assert os.path.basename(index.latest(visite)) == today_name(
+        "Caris Health Agent - Enfant - Visite Enfant (created 2021-01-01)")
+    assert os.path.basename(index.latest(household)) == today_name("household_child")
+    # The misnamed file was removed so that the browser can download the export again
+    assert sorted(os.listdir(download_dir)) == sorted([today_name(
+        "Caris Health Agent - Enfant - Visite Enfant (created 2021-01-01)"), today_name("household_child")])
+    commcare_downloader.drop_export_index(download_dir)
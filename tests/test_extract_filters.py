@@ -0,0 +1,51 @@
+import os
+
+import pandas as pd
+
+from extract_filters import OEV_EXCLUDED_SITES, OEV_EXCLUSIONS, apply_exclusions, push_exclusions
+from sql_engine import read_sql_file
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def oev_extract():
+    """Rows as returned by SELECT b.*, a.* once the duplicated columns are dropped."""
+    b = pd.DataFrame({'site': ['PAP/CHAP', None, 'CAP/HUJ'], 'hospital_name': ['HCH', None, 'HUJ']})
+    a = pd.DataFrame({'site': ['PAP/CHAP', 'PAP/CHAP', 'CAP/HUJ'], 'office': ['PAP', 'PAP', 'CAP'],
+                      'network': ['CARIS'] * 3, 'age': [4, 9, 12], 'is_abandoned': [0, 0, 0]})
+    df = pd.concat([b, a], axis=1)
+    return df.loc[:, ~df.columns.duplicated()]
+
+
+def test_site_rule_targets_the_column_pandas_keeps():
+    sql, params = push_exclusions(read_sql_file(os.path.join(REPO_DIR, 'Charges_virales_pediatriques.sql')),
+                                  OEV_EXCLUSIONS)
+    site_params = [key for key, value in params.items() if value == OEV_EXCLUDED_SITES[0]]
+
+    assert site_params
+    assert f"(b.site IS NULL OR b.site NOT IN (%({site_params[0]})s" in sql
+    assert 'a.site NOT IN' not in sql
+
+
+def test_pandas_path_keeps_the_same_rows():
+    # b.site is empty when the hospital is missing from the lookup: MySQL keeps the row, and so does pandas
+    kept = apply_exclusions(oev_extract(), OEV_EXCLUSIONS, verbose=False)
+
+    assert kept['age'].tolist() == [9, 12]
+
+
+def test_counts_added_up_over_chunks_match_one_pass():
+    df = pd.concat([oev_extract()] * 3, ignore_index=True)
+    df.loc[[1, 4], 'office'] = 'BOM'
+    df.loc[[2, 7], 'age'] = 19
+
+    _, whole = apply_exclusions(df, OEV_EXCLUSIONS, verbose=False, return_counts=True)
+    chunks = [apply_exclusions(df.iloc[i:i + 4], OEV_EXCLUSIONS, verbose=False, return_counts=True)
+              for i in range(0, len(df), 4)]
+    added = chunks[0][1]
+    for _, counts in chunks[1:]:
+        added = added.add(counts, fill_value=0)
+
+    assert added.astype('int64').to_dict() == whole.to_dict()
+    assert whole['office not_in'] == 2 and whole['age between'] == 2
+    assert sum(len(kept) for kept, _ in chunks) == len(apply_exclusions(df, OEV_EXCLUSIONS, verbose=False))
@@ -0,0 +1,59 @@
+import os
+
+import pandas as pd
+import pytest
+
+import utils
+from utils import beneficiary_activity, groupe_activity
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
+START, END = '2024-10-01', '2025-09-30'
+
+CASES = {
+    'beneficiaries': ('muso_beneficiaries.csv', beneficiary_activity, utils.is_beneficiary_active,
+                      ['closed_date', 'creation_date', 'graduation_date', 'abandoned_date', 'inactive_date']),
+    'groups': ('muso_groups.csv', groupe_activity, utils.is_groupe_active,
+               ['closed_date', 'creation_date', 'graduation_date', 'inactive_date']),
+}
+
+
+def load_fixture(name, tz=None):
+    filename, _, _, date_columns = CASES[name]
+    df = pd.read_csv(os.path.join(DATA_DIR, filename), keep_default_na=False, na_values=[''])
+    for col in date_columns:
+        df[col] = pd.to_datetime(df[col])
+        if tz:
+            df[col] = df[col].dt.tz_localize(tz)
+    return df
+
+
+def row_wise(name, df, monkeypatch, tz=None):
+    """Status given by the row-wise function, which reads the period from module globals."""
+    _, _, rule, _ = CASES[name]
+    monkeypatch.setattr(utils, 'start_date', pd.Timestamp(START, tz=tz), raising=False)
+    monkeypatch.setattr(utils, 'end_date', pd.Timestamp(END, tz=tz), raising=False)
+    return df.apply(rule, axis=1).tolist()
+
+
+@pytest.mark.parametrize('name', list(CASES))
+@pytest.mark.parametrize('tz', [None, 'UTC', 'America/Port-au-Prince'])
+def test_vectorized_status_matches_row_wise(name, tz, monkeypatch):
+    df = load_fixture(name, tz)
+    vectorized = CASES[name][1]
+
+    status = vectorized(df, START, END)
+
+    assert status.index.equals(df.index)
+    assert list(status.cat.categories) == ['no', 'yes']
+    assert status.astype(str).tolist() == row_wise(name, df, monkeypatch, tz) == df['expected'].tolist()
+
+
+@pytest.mark.parametrize('name', list(CASES))
+def test_text_dates_and_timestamps_bounds(name):
+    filename, vectorized, _, _ = CASES[name]
+    # Dates left as text, as in the exports, and bounds given as Timestamps
+    df = pd.read_csv(os.path.join(DATA_DIR, filename), keep_default_na=False, na_values=[''])
+
+    status = vectorized(df, pd.Timestamp(START, tz='UTC'), pd.Timestamp(END, tz='UTC'))
+
+    assert status.astype(str).tolist() == df['expected'].tolist()
@@ -0,0 +1,98 @@
+import pandas as pd
+import pytest
+
+from odata_filters import (MAX_PUSHDOWN_VALUES, apply_predicates, compile_odata_filter, date_between, equals, is_in,
+                           local_filter, not_equals, odata_filter_params)
+
+
+def test_literals_are_quoted():
+    odata_filter, local = compile_odata_filter([
+        not_equals('household_collection_date', '---'),
+        equals('office', "L'Asile"),
+        equals('age', 12),
+        equals('is_active', True),
+    ])
+
+    assert local == []
+    assert odata_filter == ("(household_collection_date ne '---') and (office eq 'L''Asile') "
+                            "and (age eq 12) and (is_active eq true)")
+
+
+def test_text_date_bounds_include_the_whole_last_day():
+    odata_filter, _ = compile_odata_filter([date_between('date_de_visite', '2025-08-04', '2025-08-10')])
+
+    assert odata_filter == "(date_de_visite ge '2025-08-04' and date_de_visite lt '2025-08-11')"
+
+
+def test_open_ended_and_missing_bounds():
+    assert compile_odata_filter([date_between('dob', start='2020-01-01')])[0] == "(dob ge '2020-01-01')"
+    assert compile_odata_filter([date_between('dob', end='2020-01-31')])[0] == "(dob lt '2020-02-01')"
+    odata_filter, local = compile_odata_filter([date_between('dob')])
+    assert odata_filter is None and len(local) == 1
+
+
+def test_typed_bounds_are_sent_in_utc():
+    window = date_between('last_modified_date', pd.Timestamp('2025-08-04 00:00', tz='America/Port-au-Prince'),
+                          pd.Timestamp('2025-08-10 12:30'), typed=True)
+
+    odata_filter, _ = compile_odata_filter([window])
+
+    # Port-au-Prince is UTC-4 in August; a naive bound is read as UTC
+    assert odata_filter == "(last_modified_date ge 2025-08-04T04:00:00Z and last_modified_date le 2025-08-10T12:30:00Z)"
+
+
+def test_in_is_expanded_and_long_lists_stay_local():
+    odata_filter, local = compile_odata_filter([is_in('office', ['PAP', 'CAP'])])
+    assert odata_filter == "((office eq 'PAP' or office eq 'CAP'))"
+    assert local == []
+
+    too_many = is_in('caseid', [f'c{i}' for i in range(MAX_PUSHDOWN_VALUES + 1)])
+    assert compile_odata_filter([too_many]) == (None, [too_many])
+
+
+def test_unpushable_predicates_are_reported_and_kept_local(capsys):
+    custom = local_filter('name', lambda s: s.str.len() > 3, 'long names')
+    spaced = equals('household number', '12')
+
+    odata_filter, local = compile_odata_filter([custom, spaced, equals('office', 'PAP')])
+
+    assert odata_filter == "(office eq 'PAP')"
+    assert local == [custom, spaced]
+    out = capsys.readouterr().out
+    assert "'long names' cannot be sent to CommCare (custom Python condition)" in out
+    assert "(field name contains a space)" in out
+
+
+def test_existing_filter_is_kept():
+    params, _ = odata_filter_params([not_equals('dob', '---')], {'$filter': "office eq 'PAP'", '$top': 10})
+
+    assert params == {'$filter': "(office eq 'PAP') and (dob ne '---')", '$top': 10}
+
+
+@pytest.fixture
+def visits():
+    return pd.DataFrame({
+        'household_number': ['1', '2', '3', '4', '5'],
+        'office': ['PAP', 'CAP', 'PAP', 'GON', 'PAP'],
+        'date_de_visite': ['2025-08-03', '2025-08-04', '2025-08-10 17:45', '---', '2025-08-11'],
+        'last_modified_date': ['2025-08-04T03:59:00Z', '2025-08-04T04:00:00Z', '2025-08-10T12:30:00Z',
+                               '2025-08-10T12:31:00Z', None],
+    })
+
+
+def test_local_fallback_matches_the_pushed_down_window(visits):
+    kept = apply_predicates(visits, [date_between('date_de_visite', '2025-08-04', '2025-08-10')])
+
+    # Same days as "ge '2025-08-04' and lt '2025-08-11'"; '---' is left out
+    assert kept['household_number'].tolist() == ['2', '3']
+
+
+def test_local_fallback_of_typed_in_and_custom_predicates(visits):
+    kept = apply_predicates(visits, [
+        date_between('last_modified_date', pd.Timestamp('2025-08-04 00:00', tz='America/Port-au-Prince'),
+                     '2025-08-10 12:30', typed=True),
+        is_in('office', ['PAP', 'CAP']),
+        local_filter('household number', lambda s: s != '3', 'not household 3'),
+    ])
+
+    assert kept['household_number'].tolist() == ['2']
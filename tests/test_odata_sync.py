@@ -0,0 +1,120 @@
+import os
+
+import pandas as pd
+import pyarrow.dataset
+import pyarrow.parquet as pq
+import pytest
+
+import utils
+from odata_sync import feed_key, load_watermarks, stream_commcare_odata_to_parquet, sync_commcare_odata
+from utils import ODataFetchError
+
+
+class FakeResponse:
+    def __init__(self, status_code, payload=None):
+        self.status_code = status_code
+        self._payload = payload
+
+    def json(self):
+        return self._payload
+
+
+class FakeFeed:
+    """OData feed of `records` served by pages of `page_size`; pages listed in `failing` return 500."""
+
+    def __init__(self, records, page_size=2, failing=()):
+        self.records = records
+        self.page_size = page_size
+        self.failing = set(failing)
+
+    def get(self, url, params=None):
+        params = params or {}
+        skip = int(params.get('$skip', 0))
+        if url.startswith('next:'):
+            skip = int(url.split(':')[1])
+        if skip // self.page_size in self.failing:
+            return FakeResponse(500)
+        page = self.records[skip:skip + self.page_size]
+        payload = {'value': page, '@odata.count': len(self.records)}
+        if skip + self.page_size < len(self.records):
+            payload['@odata.nextLink'] = f"next:{skip + self.page_size}"
+        return FakeResponse(200, payload)
+
+
+def make_records(n, day='2025-01-01'):
+    return [{'caseid': f'c{i}', 'value': str(i), 'last_modified_date': f'{day}T00:00:{i:02d}Z'} for i in range(n)]
+
+
+@pytest.fixture
+def serve(monkeypatch):
+    def install(feed):
+        monkeypatch.setattr(utils, 'get_odata_session', lambda *args, **kwargs: feed)
+    return install
+
+
+@pytest.mark.parametrize('max_workers', [1, 4])
+def test_strict_fetch_raises_on_missing_page(serve, max_workers):
+    serve(FakeFeed(make_records(7), failing={2}))
+    assert len(utils.get_commcare_odata('feed', None, {}, max_workers=max_workers, page_size=2)) < 7
+    with pytest.raises(ODataFetchError):
+        utils.get_commcare_odata('feed', None, {}, max_workers=max_workers, page_size=2, strict=True)
+
+
+def test_failed_sync_keeps_snapshot_and_watermark(serve, tmp_path):
+    store = str(tmp_path)
+    serve(FakeFeed(make_records(5)))
+    first = sync_commcare_odata('feed', None, 'cases', store_dir=store, max_workers=1)
+    assert first.shape[0] == 5
+    watermark = load_watermarks(store)['cases']
+
+    serve(FakeFeed(make_records(9, day='2025-02-01'), failing={1}))
+    with pytest.raises(ODataFetchError):
+        sync_commcare_odata('feed', None, 'cases', store_dir=store, max_workers=1)
+
+    assert load_watermarks(store)['cases'] == watermark
+    assert pd.read_parquet(os.path.join(store, 'cases.parquet')).shape[0] == 5
+
+
+def test_changing_filter_starts_a_new_snapshot(serve, tmp_path):
+    store = str(tmp_path)
+    serve(FakeFeed(make_records(5)))
+    sync_commcare_odata('feed', None, 'pregnancy', store_dir=store, max_workers=1)
+
+    feed = FakeFeed(make_records(3))
+    requested = []
+    original_get = feed.get
+    feed.get = lambda url, params=None: requested.append(dict(params or {})) or original_get(url, params)
+    serve(feed)
+    filtered = sync_commcare_odata('feed', None, 'pregnancy', filter_params={'$filter': "x ne '---'"},
+                                   store_dir=store, max_workers=1)
+
+    # Full download with the new filter only: no watermark clause, no record of the unfiltered snapshot
+    assert requested[0]['$filter'] == "x ne '---'"
+    assert filtered.shape[0] == 3
+    assert feed_key('pregnancy', {'$filter': "x ne '---'"}) in load_watermarks(store)
+    assert 'pregnancy' in load_watermarks(store)
+
+
+def test_stream_returns_a_lazy_dataset(serve, tmp_path):
+    serve(FakeFeed(make_records(5)))
+    path = str(tmp_path / 'cases.parquet')
+    feed = stream_commcare_odata_to_parquet('feed', None, {}, path, max_workers=1)
+
+    assert isinstance(feed, pyarrow.dataset.Dataset)
+    assert pq.ParquetFile(path).num_row_groups == 3
+    df = feed.to_table(columns=['caseid', 'value']).to_pandas()
+    assert list(df.columns) == ['caseid', 'value']
+    assert df['value'].tolist() == [str(i) for i in range(5)]
+
+
+def test_failed_stream_keeps_the_previous_file(serve, tmp_path):
+    path = str(tmp_path / 'cases.parquet')
+    serve(FakeFeed(make_records(5)))
+    stream_commcare_odata_to_parquet('feed', None, {}, path, max_workers=1)
+
+    serve(FakeFeed(make_records(9), failing={2}))
+    with pytest.raises(ODataFetchError):
+        stream_commcare_odata_to_parquet('feed', None, {}, path, max_workers=1)
+
+    assert os.listdir(tmp_path) == ['cases.parquet']
+    assert pq.read_table(path).num_rows == 5
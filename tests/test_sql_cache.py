@@ -0,0 +1,26 @@
+import os
+import time
+
+import pytest
+
+from sql_cache import _is_fresh
+
+
+@pytest.fixture
+def cached(tmp_path):
+    path = tmp_path / 'extract.parquet'
+    path.write_bytes(b'')
+    two_hours_ago = time.time() - 7200
+    os.utime(path, (two_hours_ago, two_hours_ago))
+    return str(path)
+
+
+@pytest.mark.parametrize('freshness, fresh', [('never', True), (3 * 3600, True), (3600, False)])
+def test_freshness_policies(cached, freshness, fresh):
+    assert _is_fresh(cached, freshness) is fresh
+
+
+@pytest.mark.parametrize('freshness', [None, 'weekly', True])
+def test_unknown_policy_is_rejected(cached, freshness):
+    with pytest.raises(ValueError):
+        _is_fresh(cached, freshness)
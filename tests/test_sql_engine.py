@@ -0,0 +1,77 @@
+import os
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset
+import pyarrow.parquet as pq
+
+import sql_engine
+from sql_engine import stream_sql_to_parquet, write_chunks_to_parquet
+
+
+def make_chunks(n_chunks, size=3):
+    for i in range(n_chunks):
+        rows = range(i * size, (i + 1) * size)
+        chunk = pd.DataFrame({'site': [f's{r}' for r in rows], 'age': list(rows)})
+        # Same column twice, as in the mastersheet extracts
+        yield pd.concat([chunk, chunk[['site']]], axis=1)
+
+
+def test_chunks_are_written_and_passed_on(tmp_path):
+    path = str(tmp_path / 'extract.parquet')
+    seen = []
+    for chunk in write_chunks_to_parquet(make_chunks(3), path):
+        assert not os.path.exists(path)
+        seen.append(chunk)
+
+    assert [list(chunk.columns) for chunk in seen] == [['site', 'age']] * 3
+    stored = pd.read_parquet(path)
+    pd.testing.assert_frame_equal(stored, pd.concat(seen, ignore_index=True), check_dtype=False)
+    assert os.listdir(tmp_path) == ['extract.parquet']
+
+
+def test_stopped_read_leaves_nothing(tmp_path):
+    path = str(tmp_path / 'extract.parquet')
+    chunks = write_chunks_to_parquet(make_chunks(3), path)
+    next(chunks)
+    chunks.close()
+
+    assert os.listdir(tmp_path) == []
+
+
+def test_stream_returns_a_lazy_dataset(tmp_path, monkeypatch):
+    monkeypatch.setattr(sql_engine, 'iter_sql_chunks', lambda *args: make_chunks(2))
+    path = str(tmp_path / 'extract.parquet')
+
+    extract = stream_sql_to_parquet('dot.env', 'extract.sql', path)
+
+    assert isinstance(extract, pyarrow.dataset.Dataset)
+    assert extract.to_table(columns=['age']).column('age').to_pylist() == list(range(6))
+
+
+def test_stream_of_an_empty_result(tmp_path, monkeypatch):
+    monkeypatch.setattr(sql_engine, 'iter_sql_chunks', lambda *args: iter(()))
+
+    assert stream_sql_to_parquet('dot.env', 'extract.sql', str(tmp_path / 'extract.parquet')) is None
+
+
+def test_declared_types_fix_the_schema(tmp_path):
+    path = str(tmp_path / 'extract.parquet')
+    first = pd.DataFrame({'age': pd.array([None, None], dtype='Int16'), 'note': [None, None],
+                          'office': pd.Categorical(['PAP', 'CAP'])})
+    second = pd.DataFrame({'age': pd.array([4, 12], dtype='Int16'), 'note': [None, 'ok'],
+                           'office': pd.Categorical(['JER', 'GON'])})
+    # More labels than an int8 dictionary index can hold
+    third = pd.DataFrame({'age': pd.array([1] * 300, dtype='Int16'), 'note': ['x'] * 300,
+                          'office': pd.Categorical([f'office {i}' for i in range(300)])})
+
+    list(write_chunks_to_parquet([first, second, third], path, dtype={'age': 'Int16', 'office': 'category'}))
+
+    schema = pq.read_schema(path)
+    assert schema.field('age').type == pa.int16()
+    assert schema.field('note').type == pa.string()
+    assert schema.field('office').type == pa.dictionary(pa.int32(), pa.string())
+    stored = pd.read_parquet(path)
+    assert stored['age'].isna().tolist()[:3] == [True, True, False]
+    assert stored['age'].sum() == 316
+    assert stored['office'].nunique() == 304
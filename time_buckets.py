@@ -0,0 +1,82 @@
+import numpy as np
+import pandas as pd
+
+# Month names by language, looked up from month numbers instead of strftime('%B'),
+# whose output depends on the locale of the machine running the report.
+MONTH_LABELS = {
+    'en': ['January', 'February', 'March', 'April', 'May', 'June', 'July', 'August', 'September', 'October',
+           'November', 'December'],
+    'fr': ['Janvier', 'Février', 'Mars', 'Avril', 'Mai', 'Juin', 'Juillet', 'Août', 'Septembre', 'Octobre',
+           'Novembre', 'Décembre'],
+}
+
+
+def month_labels(lang='fr'):
+    """Month names of `lang` in calendar order ('fr' or 'en')."""
+    return list(MONTH_LABELS[lang])
+
+
+def time_buckets(dates, lang='fr'):
+    """
+    Week, month and year of each date, computed in one vectorized pass
+
+    The month number and year are integers; the labels come from lookup tables
+    applied to the distinct months only, as ordered categoricals, so sorting
+    and grouping on them follow the calendar.
+
+    Args:
+        dates (pd.Series): Dates (anything pd.to_datetime accepts; unparseable values become NaT)
+        lang (str): Language of the labels, key of MONTH_LABELS
+
+    Returns:
+        pd.DataFrame: Aligned on dates, with columns
+            week_start (datetime64, Monday of the week), year (Int16), month (Int8, 1-12),
+            mois (category, month name, the 12 months as categories),
+            month_year (category, 'Août 2025', categories limited to the months present, in order)
+    """
+    dates = pd.to_datetime(dates, errors='coerce')
+    if getattr(dates.dt, 'tz', None) is not None:
+        dates = dates.dt.tz_localize(None)
+    missing = dates.isna().to_numpy()
+    days = dates.to_numpy().astype('datetime64[D]').astype('int64')
+    # Day 0 (1970-01-01) is a Thursday: (days + 3) % 7 is the weekday, Monday = 0
+    week_start = (days - (days + 3) % 7).astype('datetime64[D]')
+    week_start[missing] = np.datetime64('NaT')
+
+    years = dates.dt.year.to_numpy(dtype='float64', na_value=np.nan)
+    months = dates.dt.month.to_numpy(dtype='float64', na_value=np.nan)
+    labels = month_labels(lang)
+
+    # Months counted from year 0: one integer per (year, month), in calendar order
+    periods = np.where(missing, -1, np.nan_to_num(years) * 12 + np.nan_to_num(months) - 1).astype('int64')
+    present = np.unique(periods[periods >= 0])
+    period_codes = np.where(missing, -1, np.searchsorted(present, periods))
+    month_codes = np.where(missing, -1, np.nan_to_num(months) - 1).astype('int64')
+
+    return pd.DataFrame({
+        'week_start': pd.Series(week_start, index=dates.index).astype('datetime64[ns]'),
+        'year': pd.array(np.where(missing, None, years), dtype='Int16'),
+        'month': pd.array(np.where(missing, None, months), dtype='Int8'),
+        'mois': pd.Categorical.from_codes(month_codes, categories=labels, ordered=True),
+        'month_year': pd.Categorical.from_codes(
+            period_codes, categories=[f"{labels[p % 12]} {p // 12}" for p in present], ordered=True),
+    }, index=dates.index)
+
+
+def count_by_month(df, date_column, count_column, lang='fr'):
+    """
+    Number of non-empty `count_column` values per month, in calendar order
+
+    Args:
+        df (pd.DataFrame): Data to count
+        date_column (str): Date column
+        count_column (str): Column whose filled values are counted
+        lang (str): Language of the month labels
+
+    Returns:
+        pd.DataFrame: Columns 'Month' ('Août 2025', ordered categorical) and count_column,
+            one row per month present
+    """
+    months = time_buckets(df[date_column], lang)['month_year']
+    counts = df[count_column].groupby(months, observed=True).count()
+    return counts.rename_axis('Month').reset_index()
@@ -1,5 +1,10 @@
 import requests
 import json
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import numpy as np
 import pandas as pd
 from dotenv import load_dotenv
 import os
@@ -9,43 +14,184 @@ import time
 import re
 load_dotenv()
 
-def get_commcare_odata(url, auth_credentials, filter_params):
+# One pooled HTTP session per set of credentials, shared by every feed of a run
+_odata_sessions = {}
+
+
+def get_odata_session(auth_credentials, pool_size=8):
     """
-    Fetch active muso groups from CommCare using OData API
-    
+    Return a pooled requests.Session for the CommCare OData API
+
     Args:
-        url (str): The OData API URL
         auth_credentials (tuple): Username and password tuple (username, password)
-        filter_params (dict): Parameters to filter the data
-        
+        pool_size (int): Maximum number of keep-alive connections kept in the pool
+
     Returns:
-        list: List of muso group records
+        requests.Session: Session reused across calls with the same credentials
     """
-    # Make the initial request to the OData API
-    response = requests.get(url, auth=auth_credentials, params=filter_params)
+    key = (tuple(auth_credentials) if auth_credentials else None, pool_size)
+    session = _odata_sessions.get(key)
+    if session is None:
+        session = requests.Session()
+        session.auth = auth_credentials
+        retries = Retry(total=3, backoff_factor=1, status_forcelist=[429, 500, 502, 503, 504])
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retries)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        _odata_sessions[key] = session
+    return session
+
+
+def _select_fields(records, wanted, kept):
+    """Drop the properties of each record that are not in `wanted` (names compared with ' ' as '_')."""
+    if wanted is None:
+        return records
+
+    def keep(name):
+        # Decide once per property name, the answer is cached in `kept` for the next pages
+        if name not in kept:
+            kept[name] = name.replace(' ', '_') in wanted
+        return kept[name]
+
+    return [{name: value for name, value in record.items() if keep(name)} for record in records]
+
+
+class ODataFetchError(RuntimeError):
+    """A page of an OData feed could not be retrieved, the records fetched so far are incomplete."""
+
 
-    # Check if the request was successful
+def _fetch_odata_page(session, url, params=None):
+    """Fetch one OData page and parse its JSON body once. Returns None on failure."""
+    response = session.get(url, params=params)
     if response.status_code != 200:
-        print(f"Error: API request failed with status code {response.status_code}")
-        return []
+        print(f"Error: Failed to retrieve page: {response.status_code}")
+        return None
+    return response.json()
+
+
+def iter_commcare_odata_pages(url, auth_credentials, filter_params, max_workers=1, page_size=1000, columns=None,
+                              strict=False):
+    """
+    Yield the records of a CommCare OData feed one page at a time
+
+    Only the pages being downloaded and the page handed to the caller are held
+    in memory, so a consumer that writes each page away keeps memory flat.
+
+    Args:
+        url (str): The OData API URL
+        auth_credentials (tuple): Username and password tuple (username, password)
+        filter_params (dict): Parameters to filter the data
+        max_workers (int): Number of pages fetched concurrently. With 1 the
+            "@odata.nextLink" chain is followed page by page; above 1 the
+            remaining pages are requested in parallel with $skip/$top
+        page_size (int): Number of records requested per page in concurrent mode
+        columns (list): Properties to keep. They are requested with $select and any
+            other property still sent by the server is dropped while parsing
+        strict (bool): Raise ODataFetchError when a page fails or fewer records than
+            "@odata.count" were received, instead of stopping silently
+
+    Yields:
+        list: Records of one page, in feed order
+    """
+    session = get_odata_session(auth_credentials, pool_size=max(max_workers, 1))
+    params = dict(filter_params or {})
+    if max_workers > 1:
+        params.setdefault('$top', page_size)
+    if max_workers > 1 or strict:
+        # "@odata.count" drives the parallel pages and the completeness check
+        params['$count'] = 'true'
+    wanted = None
+    kept = {}
+    if columns:
+        params['$select'] = ','.join(columns)
+        wanted = {name.replace(' ', '_') for name in columns}
+
+    # Make the initial request to the OData API
+    payload = _fetch_odata_page(session, url, params)
+    if payload is None and '$select' in params:
+        print("Warning: $select refused by the server, unneeded columns will be dropped while parsing")
+        del params['$select']
+        payload = _fetch_odata_page(session, url, params)
+    if payload is None:
+        if strict:
+            raise ODataFetchError(f"First page of {url} could not be retrieved")
+        return
     # Get initial data
-    data = response.json()['value']
+    first_page = _select_fields(payload['value'], wanted, kept)
+    next_link = payload.get("@odata.nextLink")
+    total = payload.get("@odata.count")
+    received = len(first_page)
+    yield first_page
+
+    if max_workers > 1 and next_link and total is not None and first_page:
+        # The server told us how many records exist: request the remaining pages in parallel
+        step = len(first_page)
+        skips = list(range(step, int(total), step))
+        print(f"Fetching {len(skips)} additional pages with {max_workers} workers ({total} records)")
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # Keep at most 2 pages per worker in flight and hand them back in request order
+            in_flight = deque()
+            for skip in skips:
+                in_flight.append(executor.submit(_fetch_odata_page, session, url, {**params, '$skip': skip, '$top': step}))
+                if len(in_flight) >= 2 * max_workers:
+                    page = in_flight.popleft().result()
+                    if page is None:
+                        break
+                    received += len(page['value'])
+                    yield _select_fields(page['value'], wanted, kept)
+            else:
+                while in_flight:
+                    page = in_flight.popleft().result()
+                    if page is None:
+                        break
+                    received += len(page['value'])
+                    yield _select_fields(page['value'], wanted, kept)
+            for future in in_flight:
+                future.cancel()
+        if strict and received < int(total):
+            raise ODataFetchError(f"Only {received} of {total} records of {url} were retrieved")
+        return
+
     # Follow pagination links if they exist
-    while "@odata.nextLink" in response.json():
-        next_link = response.json()["@odata.nextLink"]
+    while next_link:
         print(f"Following next link: {next_link}")
         
         # Get the next page of data
-        response = requests.get(next_link, auth=auth_credentials)
-        
-        if response.status_code == 200:
-            # Add new records to our data
-            new_records = response.json()['value']
-            data += new_records
-            print(f"Retrieved additional {len(new_records)} records. Total: {len(data)}")
-        else:
-            print(f"Error: Failed to retrieve next page: {response.status_code}")
+        payload = _fetch_odata_page(session, next_link)
+        if payload is None:
+            if strict:
+                raise ODataFetchError(f"Page {next_link} could not be retrieved after {received} records")
             break
+        received += len(payload['value'])
+        yield _select_fields(payload['value'], wanted, kept)
+        next_link = payload.get("@odata.nextLink")
+    if strict and total is not None and received < int(total):
+        raise ODataFetchError(f"Only {received} of {total} records of {url} were retrieved")
+
+
+def get_commcare_odata(url, auth_credentials, filter_params, max_workers=1, page_size=1000, columns=None, strict=False):
+    """
+    Fetch active muso groups from CommCare using OData API
+    
+    Args:
+        url (str): The OData API URL
+        auth_credentials (tuple): Username and password tuple (username, password)
+        filter_params (dict): Parameters to filter the data
+        max_workers (int): Number of pages fetched concurrently, see iter_commcare_odata_pages
+        page_size (int): Number of records requested per page in concurrent mode
+        columns (list): Properties to download ($select), None for all of them
+        strict (bool): Raise ODataFetchError instead of returning a partial list
+            when a page cannot be retrieved
+        
+    Returns:
+        list: List of muso group records
+    """
+    data = []
+    for new_records in iter_commcare_odata_pages(url, auth_credentials, filter_params, max_workers, page_size, columns,
+                                                 strict):
+        # Add new records to our data
+        data += new_records
+        print(f"Retrieved {len(new_records)} records. Total: {len(data)}")
     
     print(f"Total records retrieved: {len(data)}")
     return data
@@ -55,6 +201,7 @@ def get_commcare_odata(url, auth_credentials, filter_params):
 def is_beneficiary_active(row):
     """
     Check if a beneficiary is active based on various date fields
+    (row-wise reference, use beneficiary_activity on whole frames)
     Args:
         row (dict): A dictionary representing a beneficiary record
         start_date (str): The start date for the active period
@@ -83,6 +230,7 @@ def is_beneficiary_active(row):
 def is_groupe_active(row):
     """
     Check if a group is active based on various date fields
+    (row-wise reference, use groupe_activity on whole frames)
     Args:
         row (dict): A dictionary representing a group record
     Returns:
@@ -115,6 +263,96 @@ def is_groupe_active(row):
         return "yes"
     return "no"
 
+def _as_dates(series, reference):
+    """Column as datetime64 and `reference` as a Timestamp comparable with it (same timezone)."""
+    dates = pd.to_datetime(series, errors='coerce')
+    reference = pd.Timestamp(reference)
+    tz = getattr(dates.dt, 'tz', None)
+    if tz is not None and reference.tzinfo is None:
+        reference = reference.tz_localize(tz)
+    elif tz is None and reference.tzinfo is not None:
+        reference = reference.tz_localize(None)
+    return dates, reference
+
+
+def _activity_status(df, conditions):
+    """
+    First matching rule wins, as in the row-wise functions; no rule matched gives 'no'
+
+    Args:
+        conditions (list): (boolean mask, 'yes' or 'no') in order of precedence
+    """
+    status = np.select([mask.to_numpy(dtype=bool) for mask, _ in conditions],
+                       [value for _, value in conditions], default='no')
+    return pd.Series(pd.Categorical(status, categories=['no', 'yes']), index=df.index)
+
+
+def beneficiary_activity(df, start_date, end_date):
+    """
+    Vectorized is_beneficiary_active: yes/no status of every MUSO beneficiary over a period
+
+    Args:
+        df (pd.DataFrame): Beneficiaries with closed_date, creation_date, graduation_date,
+            abandoned_date, inactive_date, is_inactive and graduated
+        start_date (str | datetime): Start of the period
+        end_date (str | datetime): End of the period
+
+    Returns:
+        pd.Series: Categorical 'yes'/'no', aligned on df
+    """
+    closed, start = _as_dates(df['closed_date'], start_date)
+    creation, end = _as_dates(df['creation_date'], end_date)
+    graduation, _ = _as_dates(df['graduation_date'], start_date)
+    abandoned, _ = _as_dates(df['abandoned_date'], start_date)
+    inactive, _ = _as_dates(df['inactive_date'], start_date)
+    still_enrolled = (
+        (df['is_inactive'].isna() | (df['is_inactive'] == 0))
+        & ((df['graduated'] == 0) | df['graduated'].isna())
+    )
+    return _activity_status(df, [
+        (closed < start, 'no'),
+        (creation > end, 'no'),
+        (graduation > start, 'yes'),
+        (abandoned > start, 'yes'),
+        (inactive > start, 'yes'),
+        (inactive < start, 'no'),
+        (graduation < start, 'no'),
+        (still_enrolled, 'yes'),
+    ])
+
+
+def groupe_activity(df, start_date, end_date):
+    """
+    Vectorized is_groupe_active: yes/no status of every MUSO group over a period
+
+    Args:
+        df (pd.DataFrame): Groups with office_name, closed_date, creation_date,
+            graduation_date, inactive_date, is_inactive and is_graduated
+        start_date (str | datetime): Start of the period
+        end_date (str | datetime): End of the period
+
+    Returns:
+        pd.Series: Categorical 'yes'/'no', aligned on df
+    """
+    closed, start = _as_dates(df['closed_date'], start_date)
+    creation, end = _as_dates(df['creation_date'], end_date)
+    graduation, _ = _as_dates(df['graduation_date'], start_date)
+    inactive, _ = _as_dates(df['inactive_date'], start_date)
+    still_running = (
+        (df['is_inactive'].isna() | (df['is_inactive'] == 0))
+        & ((df['is_graduated'] == 0) | df['is_graduated'].isna())
+    )
+    return _activity_status(df, [
+        (df['office_name'].isin(['CAY', 'JER']), 'no'),
+        (closed < start, 'no'),
+        (creation > end, 'no'),
+        (graduation > start, 'yes'),
+        (inactive > start, 'yes'),
+        (inactive < start, 'no'),
+        (graduation < start, 'no'),
+        (still_running, 'yes'),
+    ])
+
 import re
 from datetime import datetime
 import os